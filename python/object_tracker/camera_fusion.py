@@ -0,0 +1,271 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import time
+import heapq
+import threading
+import multiprocessing
+import Queue
+import numpy as np
+
+def quaternion_multiply(q1, q2):
+    """ Multiply the quaternion q1 by each of the quaternions (Nx4, in x, y, z, w order) in q2. """
+    x1, y1, z1, w1 = q1
+    x2, y2, z2, w2 = q2[:, 0], q2[:, 1], q2[:, 2], q2[:, 3]
+    return np.column_stack((w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                            w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                            w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+                            w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2))
+
+def quaternion_from_rotation(rotation):
+    """ Convert a 3x3 rotation matrix into a quaternion, in x, y, z, w order. """
+    trace = np.trace(rotation)
+    if trace > 0.0:
+        s = 2.0 * np.sqrt(trace + 1.0)
+        return np.array([(rotation[2, 1] - rotation[1, 2]) / s, (rotation[0, 2] - rotation[2, 0]) / s, (rotation[1, 0] - rotation[0, 1]) / s, 0.25 * s])
+    i = int(np.argmax(np.diag(rotation)))
+    j, k = (i + 1) % 3, (i + 2) % 3
+    s = 2.0 * np.sqrt(1.0 + rotation[i, i] - rotation[j, j] - rotation[k, k])
+    quaternion = np.empty(4)
+    quaternion[i] = 0.25 * s
+    quaternion[j] = (rotation[j, i] + rotation[i, j]) / s
+    quaternion[k] = (rotation[k, i] + rotation[i, k]) / s
+    quaternion[3] = (rotation[k, j] - rotation[j, k]) / s
+    return quaternion
+
+def preprocess_detections(positions, orientations, keys, confidences, transformation, roi_limits=None, dedup_distance=0.0):
+    """
+    Bring the detections of a camera into the fixed frame, dropping the ones outside the ROI and the duplicates.
+
+    Args:
+        positions: the Nx3 array of the positions of the detections, in the camera frame
+        orientations: the Nx4 array of the orientations of the detections (x, y, z, w quaternions), in the camera frame
+        keys: the array of the integer keys of the object ids and dbs of the detections
+        confidences: the array of the confidences of the detections
+        transformation: the 4x4 matrix transforming the camera frame into the fixed frame
+        roi_limits: None or the (x_min, x_max, y_min, y_max, z_min, z_max) limits of the ROI, in the fixed frame
+        dedup_distance: the detections of the same object closer than this are duplicates, only the most confident one is kept
+
+    Returns:
+        a (kept, positions, orientations) tuple: the indices of the kept detections and their positions and orientations in the fixed frame
+    """
+    positions = np.dot(positions, transformation[0:3, 0:3].T) + transformation[0:3, 3]
+    kept = np.arange(len(positions))
+    
+    if roi_limits is not None and len(kept) > 0:
+        limits = np.asarray(roi_limits, dtype=float)
+        inside = np.all((positions >= limits[0::2]) & (positions <= limits[1::2]), axis=1)
+        kept = kept[inside]
+    
+    if dedup_distance > 0.0 and len(kept) > 1:
+        distances = np.sqrt(np.sum((positions[kept, np.newaxis, :] - positions[np.newaxis, kept, :])**2, axis=2))
+        duplicates = (distances < dedup_distance) & (keys[kept, np.newaxis] == keys[np.newaxis, kept])
+        removed = np.zeros(len(kept), dtype=bool)
+        for idx in np.argsort(-confidences[kept], kind='mergesort'):
+            if not removed[idx]:
+                duplicates[idx, idx] = False
+                removed |= duplicates[idx]
+        kept = kept[~removed]
+    
+    orientations = quaternion_multiply(quaternion_from_rotation(transformation[0:3, 0:3]), orientations[kept])
+    return kept, positions[kept], orientations
+
+def _camera_worker(inbox, outbox):
+    """ The loop of a CameraFusion worker process: preprocess the frames of a camera until a None job is received. """
+    while True:
+        job = inbox.get()
+        if job is None:
+            return
+        camera, seq, stamp, positions, orientations, keys, confidences, transformation, roi_limits, dedup_distance = job
+        result = preprocess_detections(positions, orientations, keys, confidences, transformation, roi_limits, dedup_distance)
+        outbox.put((camera, seq, stamp) + result)
+
+class CameraWorkerPool:
+    """
+    The worker processes preprocessing the recognition results of the cameras, shared by the successive CameraFusion instances.
+
+    The workers must be forked before the node starts any thread (rospy.init_node, TF, timers and subscribers), since only the
+    forking thread survives in the child process and the locks held by the other threads would stay locked forever.
+    """
+    def __init__(self, num_workers):
+        """
+        Args:
+            num_workers: the number of worker processes, the cameras are assigned to them in a round robin fashion
+        """
+        self.num_workers = num_workers
+        self.outbox = multiprocessing.Queue()
+        self._inboxes = [ multiprocessing.Queue() for _ in range(num_workers) ]
+        self._workers = [ multiprocessing.Process(target=_camera_worker, args=(inbox, self.outbox)) for inbox in self._inboxes ]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+        self._lock = threading.Lock()
+        self._seq = 0
+    
+    def next_seq(self):
+        """ Return a sequence number never returned before, identifying a job across the CameraFusion instances. """
+        with self._lock:
+            seq = self._seq
+            self._seq += 1
+            return seq
+        
+    def inbox(self, camera):
+        """ Return the queue of the worker of a camera. """
+        return self._inboxes[camera % self.num_workers]
+    
+    def close(self):
+        """ Stop the worker processes. """
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for worker in self._workers:
+            worker.join(1.0)
+            if worker.is_alive():
+                worker.terminate()
+
+class CameraFusion:
+    """
+    Fuse the recognition results of several cameras into a single stream, expressed in the fixed frame.
+
+    The results of each camera are preprocessed (transformed into the fixed frame, cropped to the ROI and cleaned of the
+    duplicate detections) by the worker of the camera in a CameraWorkerPool, or in the calling thread without a pool. The
+    preprocessed results are then released in timestamp order: a result is held until every camera has delivered a newer one,
+    or for at most merge_window seconds.
+    """
+    def __init__(self, num_cameras, callback, dedup_distance=0.02, merge_window=0.2, workers=None):
+        """
+        Args:
+            num_cameras: the number of cameras
+            callback: the function receiving the fused RecognizedObjectArray, in timestamp order
+            dedup_distance: the detections of the same object closer than this (m) within a result are duplicates
+            merge_window: the maximum time (s) a result is held waiting for the results of the other cameras
+            workers: None or the CameraWorkerPool preprocessing the results
+        """
+        self.dedup_distance = dedup_distance
+        self.merge_window = merge_window
+        self._callback = callback
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._running = True
+        self._seq = 0
+        self._keys = dict()
+        self._pending = dict()
+        self._heap = []
+        self._latest = [ None ] * num_cameras
+        self._outbox = workers.outbox if workers is not None else Queue.Queue()
+        
+        self._merge_thread = threading.Thread(target=self._merge_loop)
+        self._merge_thread.daemon = True
+        self._merge_thread.start()
+        
+    def submit(self, camera, data, base_frame, transformation, roi_limits=None):
+        """
+        Hand a recognition result of a camera to its worker.
+
+        Args:
+            camera: the index of the camera
+            data: the RecognizedObjectArray, its objects are reused in the fused result
+            base_frame: the fixed frame
+            transformation: the 4x4 matrix transforming the frame of the result into the fixed frame
+            roi_limits: None or the limits of the ROI, in the fixed frame
+        """
+        num_objects = len(data.objects)
+        positions = np.empty((num_objects, 3))
+        orientations = np.empty((num_objects, 4))
+        confidences = np.empty(num_objects)
+        for idx, obj in enumerate(data.objects):
+            position = obj.pose.pose.pose.position
+            orientation = obj.pose.pose.pose.orientation
+            positions[idx] = (position.x, position.y, position.z)
+            orientations[idx] = (orientation.x, orientation.y, orientation.z, orientation.w)
+            confidences[idx] = obj.confidence
+        
+        # submit runs in the subscriber thread of each camera
+        with self._lock:
+            keys = np.array([ self._keys.setdefault((obj.id.id, obj.id.db), len(self._keys)) for obj in data.objects ], dtype=int)
+            if self._workers is not None:
+                seq = self._workers.next_seq()
+            else:
+                seq = self._seq
+                self._seq += 1
+            self._pending[seq] = (data, base_frame)
+        stamp = data.header.stamp.to_sec()
+        if self._workers is not None:
+            self._workers.inbox(camera).put((camera, seq, stamp, positions, orientations, keys, confidences, transformation, roi_limits, self.dedup_distance))
+        else:
+            result = preprocess_detections(positions, orientations, keys, confidences, transformation, roi_limits, self.dedup_distance)
+            self._outbox.put((camera, seq, stamp) + result)
+        
+    def close(self):
+        """ Stop the merge thread; the workers are left running for the next CameraFusion. """
+        self._running = False
+        # wait for the thread to stop reading the outbox shared with the next CameraFusion
+        self._merge_thread.join()
+    
+    def _merge_loop(self):
+        """ Collect the preprocessed results and release them in timestamp order. """
+        while self._running:
+            try:
+                camera, seq, stamp, kept, positions, orientations = self._outbox.get(True, max(self.merge_window / 2.0, 0.01))
+            except Queue.Empty:
+                pass
+            else:
+                with self._lock:
+                    pending = self._pending.pop(seq, None)
+                if pending is None:
+                    # submitted to a previous CameraFusion sharing the workers
+                    continue
+                data, base_frame = pending
+                self._fuse(data, base_frame, kept, positions, orientations)
+                heapq.heappush(self._heap, (stamp, seq, time.time(), data))
+                self._latest[camera] = stamp if self._latest[camera] is None else max(self._latest[camera], stamp)
+            
+            # the results older than the latest result of every camera can not be preceded by others anymore
+            watermark = min(self._latest) if None not in self._latest else float('-inf')
+            now = time.time()
+            while self._heap and (self._heap[0][0] <= watermark or now - self._heap[0][2] >= self.merge_window):
+                self._callback(heapq.heappop(self._heap)[3])
+        
+    def _fuse(self, data, base_frame, kept, positions, orientations):
+        """ Replace the objects of a result with the preprocessed ones, expressed in the fixed frame. """
+        objects = []
+        for idx, position, orientation in zip(kept, positions, orientations):
+            obj = data.objects[idx]
+            obj.header.frame_id = base_frame
+            obj.pose.header = obj.header
+            pose = obj.pose.pose.pose
+            pose.position.x, pose.position.y, pose.position.z = position.tolist()
+            pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w = orientation.tolist()
+            objects.append(obj)
+        data.objects = objects
+        data.header.frame_id = base_frame
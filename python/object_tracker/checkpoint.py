@@ -0,0 +1,78 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import os
+import zipfile
+import numpy as np
+
+CHECKPOINT_VERSION = 1
+
+def save_checkpoint(path, **arrays):
+    """
+    Atomically write a checkpoint of the tracker state.
+
+    The arrays are stored in an uncompressed numpy archive written next to the destination and then renamed over it,
+    so a crash while writing never leaves a truncated checkpoint behind.
+
+    Args:
+        path: the checkpoint file
+        arrays: the named arrays to store
+    """
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, 'wb') as checkpoint:
+        np.savez(checkpoint, version=CHECKPOINT_VERSION, **arrays)
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+    os.rename(tmp_path, path)
+
+def load_checkpoint(path):
+    """
+    Load a checkpoint written by save_checkpoint.
+
+    Args:
+        path: the checkpoint file
+
+    Returns:
+        a dictionary containing the stored arrays, or None if the file does not exist, is corrupted or has an incompatible version
+    """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with np.load(path) as checkpoint:
+            if int(checkpoint['version']) != CHECKPOINT_VERSION:
+                return None
+            return dict((key, checkpoint[key]) for key in checkpoint.files)
+    except (IOError, ValueError, KeyError, zipfile.BadZipfile):
+        return None
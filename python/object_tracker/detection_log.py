@@ -0,0 +1,240 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import os
+import threading
+import Queue
+import numpy as np
+import rospy
+from object_recognition_msgs.msg import RecognizedObjectArray, RecognizedObject
+
+# the columns of the log, one file per column, one row per detection
+DETECTION_COLUMNS = [ ('stamp', np.float64, 1),
+                      ('id', np.int32, 1),
+                      ('db', np.int32, 1),
+                      ('position', np.float64, 3),
+                      ('orientation', np.float64, 4),
+                      ('confidence', np.float32, 1) ]
+# one row per recognition result, pointing to its slice of detections
+FRAME_DTYPE = np.dtype([ ('stamp', np.float64), ('frame_id', np.int32), ('start', np.int64), ('count', np.int32) ])
+FRAMES_FILE = 'frames.bin'
+STRINGS_FILE = 'strings.txt'
+
+def column_file(name):
+    """ Return the name of the file containing a column. """
+    return '%s.bin' % name
+
+class DetectionLogWriter:
+    """
+    Record the recognition results in a columnar on-disk log.
+
+    Only the values needed to replay the detections are extracted in the caller thread; the conversion to arrays and the
+    writes are batched and performed by a background thread. Strings (object ids, dbs and frame ids) are stored once in a
+    string table and referenced by index.
+    """
+    def __init__(self, directory, batch_size=100):
+        """
+        Args:
+            directory: the directory containing the log, created if needed; an existing log is appended to
+            batch_size: the maximum number of recognition results written at once
+        """
+        self.directory = directory
+        self.batch_size = batch_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        
+        self._strings = dict()
+        strings_path = os.path.join(directory, STRINGS_FILE)
+        if os.path.exists(strings_path):
+            with open(strings_path) as strings_file:
+                for line in strings_file:
+                    self._strings[line.rstrip('\n')] = len(self._strings)
+        stamps_path = os.path.join(directory, column_file('stamp'))
+        self._num_detections = os.path.getsize(stamps_path) // 8 if os.path.exists(stamps_path) else 0
+        
+        self._new_strings = []
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+        
+    def record(self, data):
+        """
+        Queue a recognition result for writing.
+
+        Args:
+            data: a RecognizedObjectArray
+        """
+        rows = [ (obj.header.stamp.to_sec(), obj.id.id, obj.id.db, 
+                  obj.pose.pose.pose.position.x, obj.pose.pose.pose.position.y, obj.pose.pose.pose.position.z,
+                  obj.pose.pose.pose.orientation.x, obj.pose.pose.pose.orientation.y, obj.pose.pose.pose.orientation.z, 
+                  obj.pose.pose.pose.orientation.w, obj.confidence) for obj in data.objects ]
+        self._queue.put((data.header.stamp.to_sec(), data.header.frame_id, rows))
+        
+    def close(self):
+        """ Write the pending recognition results and stop the writer thread. """
+        self._queue.put(None)
+        self._thread.join()
+        
+    def _string_index(self, string):
+        """ Return the index of a string in the string table, adding it if needed. """
+        index = self._strings.get(string)
+        if index is None:
+            index = len(self._strings)
+            self._strings[string] = index
+            self._new_strings.append(string)
+        return index
+    
+    def _write_loop(self):
+        """ The writer thread: drain the queue and write the recognition results in batches. """
+        running = True
+        while running:
+            batch = [ self._queue.get() ]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = batch[:batch.index(None)]
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except (IOError, OSError), e:
+                    rospy.logerr("Unable to write the detection log: %s" % e)
+                
+    def _write_batch(self, batch):
+        """ Append a batch of recognition results to the log files. """
+        frames = np.zeros(len(batch), dtype=FRAME_DTYPE)
+        rows = []
+        for frame_idx, (stamp, frame_id, frame_rows) in enumerate(batch):
+            frames[frame_idx] = (stamp, self._string_index(frame_id), self._num_detections + len(rows), len(frame_rows))
+            rows.extend(frame_rows)
+        
+        if rows:
+            table = np.array([ row[0:1] + row[3:] for row in rows ], dtype=np.float64)
+            ids = np.array([ self._string_index(row[1]) for row in rows ], dtype=np.int32)
+            dbs = np.array([ self._string_index(row[2]) for row in rows ], dtype=np.int32)
+        
+        # strings first and frames last, so that a reader never sees a reference to data not written yet
+        if self._new_strings:
+            with open(os.path.join(self.directory, STRINGS_FILE), 'a') as strings_file:
+                strings_file.write(''.join('%s\n' % string for string in self._new_strings))
+            self._new_strings = []
+            
+        if rows:
+            columns = dict(stamp=table[:, 0], id=ids, db=dbs, position=table[:, 1:4], orientation=table[:, 4:8], confidence=table[:, 8])
+            for name, dtype, width in DETECTION_COLUMNS:
+                with open(os.path.join(self.directory, column_file(name)), 'ab') as column:
+                    np.ascontiguousarray(columns[name], dtype=dtype).tofile(column)
+            self._num_detections += len(rows)
+        
+        with open(os.path.join(self.directory, FRAMES_FILE), 'ab') as frames_file:
+            frames.tofile(frames_file)
+
+class DetectionFrame:
+    """ A recognition result read from a log: the frame stamp and id and the columns of its detections, as array slices. """
+    def __init__(self, stamp, frame_id, columns, strings):
+        self.stamp = stamp
+        self.frame_id = frame_id
+        self.stamps = columns['stamp']
+        self.ids = columns['id']
+        self.dbs = columns['db']
+        self.positions = columns['position']
+        self.orientations = columns['orientation']
+        self.confidences = columns['confidence']
+        self.strings = strings
+        
+    def __len__(self):
+        return self.stamps.shape[0]
+
+class DetectionLogReader:
+    """ Read a log written by DetectionLogWriter, memory mapping its columns. """
+    def __init__(self, directory):
+        """
+        Args:
+            directory: the directory containing the log
+        """
+        with open(os.path.join(directory, STRINGS_FILE)) as strings_file:
+            self.strings = [ line.rstrip('\n') for line in strings_file ]
+        
+        self.columns = dict()
+        num_detections = None
+        for name, dtype, width in DETECTION_COLUMNS:
+            path = os.path.join(directory, column_file(name))
+            length = os.path.getsize(path) // (np.dtype(dtype).itemsize * width)
+            num_detections = length if num_detections is None else min(num_detections, length)
+            self.columns[name] = self._map(path, dtype, width, length)
+        
+        frames = self._map(os.path.join(directory, FRAMES_FILE), FRAME_DTYPE, 1, os.path.getsize(os.path.join(directory, FRAMES_FILE)) // FRAME_DTYPE.itemsize)
+        # ignore the frames whose detections have not been completely written
+        self.frames = frames[:np.searchsorted(frames['start'] + frames['count'], num_detections, side='right')]
+        
+    def _map(self, path, dtype, width, length):
+        """ Memory map a column file. """
+        if length == 0:
+            return np.zeros((0, width) if width > 1 else 0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(length, width) if width > 1 else (length,))
+        
+    def __len__(self):
+        return len(self.frames)
+    
+    def __iter__(self):
+        """ Iterate over the recognition results as DetectionFrame. """
+        for frame in self.frames:
+            start = frame['start']
+            end = start + frame['count']
+            columns = dict((name, column[start:end]) for name, column in self.columns.iteritems())
+            yield DetectionFrame(float(frame['stamp']), self.strings[frame['frame_id']], columns, self.strings)
+            
+    def recognized_object_arrays(self):
+        """ Iterate over the recognition results as RecognizedObjectArray, e.g. to feed them to Tracker.recognized_object_callback. """
+        for frame in self:
+            data = RecognizedObjectArray()
+            data.header.stamp = rospy.Time.from_sec(frame.stamp)
+            data.header.frame_id = frame.frame_id
+            for idx in range(len(frame)):
+                obj = RecognizedObject()
+                obj.header.stamp = rospy.Time.from_sec(float(frame.stamps[idx]))
+                obj.header.frame_id = frame.frame_id
+                obj.id.id = self.strings[frame.ids[idx]]
+                obj.id.db = self.strings[frame.dbs[idx]]
+                obj.confidence = float(frame.confidences[idx])
+                obj.pose.header = obj.header
+                obj.pose.pose.pose.position.x, obj.pose.pose.pose.position.y, obj.pose.pose.pose.position.z = frame.positions[idx].tolist()
+                (obj.pose.pose.pose.orientation.x, obj.pose.pose.pose.orientation.y, 
+                 obj.pose.pose.pose.orientation.z, obj.pose.pose.pose.orientation.w) = frame.orientations[idx].tolist()
+                data.objects.append(obj)
+            yield data
@@ -0,0 +1,107 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import numpy as np
+
+# the detections that can be merged
+MERGE_ANY = 'any'
+MERGE_SAME_DB = 'same_db'
+MERGE_SAME_ID = 'same_id'
+
+def cluster_detections(positions, groups, distance):
+    """
+    Cluster the detections of a recognition result lying closer than a distance from each other.
+
+    Two detections belong to the same cluster when they are in the same group and closer than distance, directly or through
+    other detections of the cluster (single linkage).
+
+    Args:
+        positions: the Nx3 array of the positions of the detections
+        groups: the array of the integer groups of the detections, only the detections of the same group can be clustered
+        distance: the maximum distance between two neighbouring detections of a cluster
+
+    Returns:
+        the array of the cluster labels of the detections, the label of a cluster is the smallest index of its detections
+    """
+    labels = np.arange(len(positions))
+    if len(positions) < 2:
+        return labels
+    
+    squared_distances = np.sum((positions[:, np.newaxis, :] - positions[np.newaxis, :, :])**2, axis=2)
+    neighbours = (squared_distances < distance**2) & (groups[:, np.newaxis] == groups[np.newaxis, :])
+    if np.count_nonzero(neighbours) == len(positions):
+        return labels
+    
+    # propagate the smallest label through the neighbours until every cluster is labeled consistently
+    while True:
+        new_labels = np.where(neighbours, labels[np.newaxis, :], len(positions)).min(axis=1)
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+def merge_clusters(labels, positions, orientations, confidences):
+    """
+    Merge each cluster of detections into a single detection, weighting the detections with their confidence.
+
+    Args:
+        labels: the cluster labels of the detections, as returned by cluster_detections
+        positions: the Nx3 array of the positions of the detections
+        orientations: the Nx4 array of the orientations of the detections (x, y, z, w quaternions)
+        confidences: the array of the confidences of the detections
+
+    Returns:
+        a (kept, positions, orientations, confidences) tuple: the indices of the most confident detection of each cluster,
+        and the merged positions, orientations and confidences of the clusters
+    """
+    clusters, inverse = np.unique(labels, return_inverse=True)
+    weights = np.maximum(confidences, 1e-6)
+    total_weights = np.bincount(inverse, weights)
+    
+    # the most confident detection of each cluster: sort by cluster, then by decreasing confidence
+    order = np.lexsort((-confidences, inverse))
+    kept = order[np.searchsorted(inverse[order], np.arange(len(clusters)))]
+    
+    merged_positions = np.zeros((len(clusters), 3))
+    for axis in range(3):
+        merged_positions[:, axis] = np.bincount(inverse, weights * positions[:, axis]) / total_weights
+    
+    # q and -q are the same rotation, align the quaternions to the one of the most confident detection before averaging
+    signs = np.where(np.sum(orientations * orientations[kept][inverse], axis=1) < 0.0, -1.0, 1.0)
+    merged_orientations = np.zeros((len(clusters), 4))
+    for axis in range(4):
+        merged_orientations[:, axis] = np.bincount(inverse, weights * signs * orientations[:, axis])
+    norms = np.sqrt(np.sum(merged_orientations**2, axis=1))
+    merged_orientations = np.where(norms[:, np.newaxis] > 1e-9, merged_orientations / np.maximum(norms, 1e-9)[:, np.newaxis], orientations[kept])
+    
+    return kept, merged_positions, merged_orientations, confidences[kept]
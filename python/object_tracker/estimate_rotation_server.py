@@ -44,20 +44,161 @@ Output: circle center,
 
 from numpy import *
 import math
+import time
+import threading
+import argparse
+import multiprocessing
+import Queue
 #import roslib; roslib.load_manifest('sushi_turntable')
 import rospy
 from object_tracker.srv import EstimateRotation, EstimateRotationResponse
+from object_tracker.msg import EstimationServerStatus
+from object_tracker.tracing import logdebug
 from geometry_msgs.msg import PoseStamped, Pose, Point, Vector3, PoseWithCovarianceStamped, PoseWithCovariance
 from scipy import optimize, linalg
 import functools
 from matplotlib import pyplot as p, cm, colors # only needed if want to plot separately
 
+# state of a worker process of the RotationWorkerPool
+_worker_finder = None
+_worker_buffer = None
+
+def _init_worker(shared_buffer):
+    """ Initialize a worker process of the RotationWorkerPool. """
+    global _worker_finder, _worker_buffer
+    _worker_finder = CircleFinder()
+    _worker_buffer = shared_buffer
+    
+def _estimate_in_worker(slot, num_poses, max_poses, poses=None):
+    """
+    Estimate the rotation parameters inside a worker process.
+
+    Args:
+        slot: the index of the shared memory slot holding the poses, ignored if poses is given
+        num_poses: the number of poses stored in the slot
+        max_poses: the capacity of each slot
+        poses: an optional 4xN array (times, x, y, z) passed by value, used when the poses do not fit in a slot
+
+    Returns:
+        the estimated center, axis, radius and speed followed by the fit diagnostics (see CircleFinder.estimate_rotation) and 
+        the time spent fitting (s)
+    """
+    start = time.time()
+    if poses is None:
+        slot_size = 4 * max_poses
+        poses = frombuffer(_worker_buffer, dtype=float64, count=slot_size, offset=slot * slot_size * 8).reshape(4, max_poses)[:, :num_poses]
+    center, axis, radius, speed, info = _worker_finder.estimate_rotation(poses[0], poses[1], poses[2], poses[3], full_output=True)
+    return center.tolist(), axis.tolist(), float(radius), float(speed), info, time.time() - start
+
+class RotationWorkerPool:
+    """
+    A pool of processes running the rotation estimation in parallel.
+
+    The poses of each request are copied into a slot of a shared memory buffer allocated before the workers are forked,
+    so only the slot index travels through the pool pipes. Requests larger than a slot are passed by value.
+    """
+    def __init__(self, num_workers, max_poses):
+        """
+        Args:
+            num_workers: the number of worker processes
+            max_poses: the maximum number of poses of a request handed off through shared memory
+        """
+        self.num_workers = num_workers
+        self.max_poses = max_poses
+        num_slots = 2 * num_workers
+        self._buffer = multiprocessing.RawArray('d', num_slots * 4 * max_poses)
+        self._slots = frombuffer(self._buffer, dtype=float64).reshape(num_slots, 4, max_poses)
+        self._free_slots = Queue.Queue()
+        for slot in range(num_slots):
+            self._free_slots.put(slot)
+        self._pool = multiprocessing.Pool(num_workers, _init_worker, (self._buffer,))
+        
+    def estimate(self, poses):
+        """
+        Estimate the rotation parameters in one of the workers, blocking until the result is available.
+
+        Args:
+            poses: a 4xN array containing the times and the x, y, z coordinates of the poses
+
+        Returns:
+            the estimated center, axis, radius and speed followed by the fit diagnostics and the time spent fitting (s)
+        """
+        num_poses = poses.shape[1]
+        if num_poses > self.max_poses:
+            return self._pool.apply(_estimate_in_worker, (-1, num_poses, self.max_poses, poses))
+        
+        slot = self._free_slots.get()
+        try:
+            self._slots[slot, :, :num_poses] = poses
+            return self._pool.apply(_estimate_in_worker, (slot, num_poses, self.max_poses))
+        finally:
+            self._free_slots.put(slot)
+            
+    def shutdown(self):
+        """ Terminate the worker processes. """
+        self._pool.terminate()
+        self._pool.join()
+
+class FitStatistics:
+    """
+    Rolling statistics of the requests served by the estimation server.
+
+    The latency, fit time, optimizer evaluations, residual RMS and number of poses of the latest requests are stored in a
+    preallocated ring buffer, the statistics are computed only when they are read.
+    """
+    # the columns of the ring buffer
+    LATENCY, FIT_TIME, EVALUATIONS, RESIDUAL_RMS, NUM_POSES = range(5)
+    
+    def __init__(self, window=1000):
+        """
+        Args:
+            window: the number of latest requests the statistics are computed on
+        """
+        self._records = zeros((window, 5))
+        self._next = 0
+        self._count = 0
+        self._failed_fits = 0
+        self._rejected_requests = 0
+        
+    def record(self, latency, fit_time, evaluations, residual_rms, num_poses, converged=True):
+        """ Record a served request; converged is False if the optimizer did not find a solution. """
+        self._records[self._next] = (latency, fit_time, evaluations, residual_rms, num_poses)
+        self._next = (self._next + 1) % self._records.shape[0]
+        if self._count < self._records.shape[0]:
+            self._count += 1
+        if not converged:
+            self._failed_fits += 1
+            
+    def reject(self):
+        """ Record a request rejected without fitting. """
+        self._rejected_requests += 1
+        
+    def fill_status(self, status):
+        """ Fill the statistics fields of an EstimationServerStatus message. """
+        status.window_requests = self._count
+        status.failed_fits = self._failed_fits
+        status.rejected_requests = self._rejected_requests
+        if self._count == 0:
+            return
+        records = self._records[:self._count]
+        status.mean_latency, status.mean_fit_time, status.mean_evaluations, status.mean_residual_rms, status.mean_poses = mean(records, axis=0)
+        status.max_latency, status.max_fit_time, status.max_evaluations, status.max_residual_rms, status.max_poses = amax(records, axis=0)
+        status.p95_latency = percentile(records[:, self.LATENCY], 95)
+
 class CircleFinder:
     def __init__(self):
         self.center = None
         self.axis = None
         self.radius = None
         self.speed = None
+        self._worker_pool = None
+        self._stats_lock = threading.Lock()
+        self._pending_requests = 0
+        self._requests_served = 0
+        self._busy_time = 0.0
+        self._last_status_time = time.time()
+        self._last_status_requests = 0
+        self._fit_statistics = FitStatistics()
         
     def calc_R(self, xc, yc, x, y):
         """ Calculate the distance of each 3D point from the center (xc, yc). """
@@ -256,7 +397,7 @@ class CircleFinder:
     
         return xc_2, yc_2, R_2
     
-    def find_circle(self, x_in, y_in, times, plot_circle=False):
+    def find_circle(self, x_in, y_in, times, plot_circle=False, full_output=False):
         """
         Find a the best circle that passes through the input points. Computes also the angular speed.
 
@@ -265,19 +406,22 @@ class CircleFinder:
             y_in: the y_coordinates of the points
             times: the observation time for each couple of x-y values
             plot_circle: an optional arguments that allows for a graphical visualization of the results
+            full_output: if True the number of function evaluations and the ier flag of optimize.leastsq are returned too
 
         Returns:
             xc_2: the x coordinate of the center
             yc_2: the y coordinate of the center
             R_2: the circle radius
             ang_vel: the angular rotation speed
+            evaluations: (only with full_output) the number of evaluations of the cost function
+            ier: (only with full_output) the ier flag of optimize.leastsq, 1 to 4 if a solution was found
         """
         # coordinates of the barycenter
         x_m = mean(x_in)
         y_m = mean(y_in)
     
         center_estimate = x_m, y_m
-        center_2, ier = optimize.leastsq(self.f_2, center_estimate, args=(x_in, y_in))
+        center_2, cov_x, infodict, mesg, ier = optimize.leastsq(self.f_2, center_estimate, args=(x_in, y_in), full_output=True)
     
         xc_2, yc_2 = center_2
         Ri_2       = self.calc_R(xc_2, yc_2, x_in, y_in)
@@ -299,13 +443,16 @@ class CircleFinder:
         y_rel = y_in - yc_2
           
         angle_history = time_history = array([])
+        skipped_frames = 0
         for i in range(len(x_rel)):
             if not i == 0:
                 if times[i] == times[i-1]:
-                    rospy.loginfo('Skipping frame since it has same timestamp as last frame')
+                    skipped_frames += 1
                     continue
             angle_history = append(angle_history, math.atan2(y_rel[i], x_rel[i]))
             time_history = append(time_history, times[i])
+        if skipped_frames > 0:
+            logdebug('Skipped %d frames with the same timestamp as the previous frame', skipped_frames)
     
         angle_diff = angle_history[1:] - angle_history[:-1]
         time_diff = time_history[1:] - time_history[:-1]
@@ -320,35 +467,30 @@ class CircleFinder:
         if plot_circle:
             self.plot_all(xc_2, yc_2, R_2, x_in, y_in)
     
+        if full_output:
+            return xc_2, yc_2, R_2, ang_vel, int(infodict['nfev']), ier
         return xc_2, yc_2, R_2, ang_vel
 
-    def find_circle_posestamped(self, req):
+    def estimate_rotation(self, times_in, x_in, y_in, z_in, full_output=False):
         """
-        Given an EstimateRotationRequest containing a list of object poses compute if possible the rotation parameters.
+        Estimate the rotation parameters from the positions of a single object observed at different times.
 
         Args:
-            req: an EstimateRotationRequest containing a list of PoseWithCovarianceStamped.
+            times_in: the observation times
+            x_in: the x coordinates of the object
+            y_in: the y coordinates of the object
+            z_in: the z coordinates of the object
+            full_output: if True the diagnostics of the fit are returned too
 
         Returns:
-            response: an EstimateRotationResponse containing the rotation parameters for the rotating object.
+            center: an array containing the center of rotation
+            axis: an array containing the rotation axis
+            radius: the radius of the circle described by the object
+            speed: the angular rotation speed
+            info: (only with full_output) a dictionary containing the number of evaluations of the circle cost function 
+                  ('evaluations'), the ier flag of optimize.leastsq ('ier') and the RMS distance of the positions from the 
+                  fitted circle ('residual_rms')
         """
-        pose_stamped_list = req.poses
-        
-        if len(pose_stamped_list) < 5:
-            print 'Not enough poses to estimate a rotation'
-            return EstimateRotationResponse(success=False)
-        
-        x_in = [] #array('f')
-        y_in = [] #array('f')
-        z_in = [] #array('f')
-        times_in = []
-
-        for i in range(len(pose_stamped_list)):
-            times_in.append(pose_stamped_list[i].header.stamp.to_sec())
-            x_in.append(pose_stamped_list[i].pose.pose.position.x)
-            y_in.append(pose_stamped_list[i].pose.pose.position.y)
-            z_in.append(pose_stamped_list[i].pose.pose.position.z)
-            
         # 1st thing: find the supporting plane
         plane_coeffs = self.fit_plane(x_in, y_in, z_in)
         #print "plane coeffs: %s" % plane_coeffs
@@ -358,45 +500,144 @@ class CircleFinder:
         x_proj2d, y_proj2d, x_axis, y_axis = self.points3d_to_2d(proj_x, proj_y, proj_z, plane_coeffs)
         
         # 3rd: now find the circle.
-        c_x, c_y, self.radius, self.speed = self.find_circle(x_proj2d, y_proj2d, times_in, False)
+        c_x, c_y, radius, speed, evaluations, ier = self.find_circle(x_proj2d, y_proj2d, times_in, False, full_output=True)
         
         # c_x and c_y are relative to the origin on the plane, convert them back to world coords
         c_vector = origin + x_axis * c_x + y_axis * c_y
 
-        self.center = Point()
-        self.center.x = c_vector[0]
-        self.center.y = c_vector[1]
-        self.center.z = c_vector[2]
-        
         axis = array([plane_coeffs[0], plane_coeffs[1], plane_coeffs[2]])
         #c_vector points towards the rotation center
         if dot(c_vector, axis) > 0:
             axis = -axis
-            self.speed = -self.speed
+            speed = -speed
         
-        self.axis = Vector3()
-        self.axis.x = axis[0]
-        self.axis.y = axis[1]
-        self.axis.z = axis[2]        
+        if not full_output:
+            return c_vector, axis, radius, speed
         
+        # distance of each position from the circle: along the axis and, within the plane, from the circumference
+        offsets = array([ x_in, y_in, z_in ]).T - c_vector
+        heights = dot(offsets, axis)
+        radial = sqrt(maximum(sum(offsets**2, axis=1) - heights**2, 0.0)) - radius
+        info = dict(evaluations=evaluations, ier=int(ier), residual_rms=float(sqrt(mean(heights**2 + radial**2))))
+        return c_vector, axis, radius, speed, info
+
+    def find_circle_posestamped(self, req):
+        """
+        Given an EstimateRotationRequest containing a list of object poses compute if possible the rotation parameters.
+
+        The estimation runs in the worker pool if one has been started, otherwise in the calling thread.
+
+        Args:
+            req: an EstimateRotationRequest containing a list of PoseWithCovarianceStamped.
+
+        Returns:
+            response: an EstimateRotationResponse containing the rotation parameters for the rotating object.
+        """
+        start = time.time()
+        pose_stamped_list = req.poses
+        
+        if len(pose_stamped_list) < 5:
+            print 'Not enough poses to estimate a rotation'
+            with self._stats_lock:
+                self._fit_statistics.reject()
+            return EstimateRotationResponse(success=False)
+        
+        poses = array([ [ pose.header.stamp.to_sec(), 
+                          pose.pose.pose.position.x, 
+                          pose.pose.pose.position.y, 
+                          pose.pose.pose.position.z ] for pose in pose_stamped_list ]).T
+                          
+        with self._stats_lock:
+            self._pending_requests += 1
+        try:
+            if self._worker_pool is not None:
+                c_vector, axis, radius, speed, info, fit_time = self._worker_pool.estimate(poses)
+            else:
+                fit_start = time.time()
+                c_vector, axis, radius, speed, info = self.estimate_rotation(poses[0], poses[1], poses[2], poses[3], full_output=True)
+                fit_time = time.time() - fit_start
+        finally:
+            with self._stats_lock:
+                self._pending_requests -= 1
+                
+        with self._stats_lock:
+            self._requests_served += 1
+            self._busy_time += fit_time
+            self._fit_statistics.record(time.time() - start, fit_time, info['evaluations'], info['residual_rms'], poses.shape[1], 
+                                        info['ier'] in (1, 2, 3, 4))
+        
+        # the service threads run concurrently, the response is built only from local values
         response = EstimateRotationResponse()
         response.success = True
-        response.center = self.center
-        response.axis = self.axis
-        response.radius = self.radius
-        response.speed = self.speed        
+        response.center = Point(c_vector[0], c_vector[1], c_vector[2])
+        response.axis = Vector3(axis[0], axis[1], axis[2])
+        response.radius = radius
+        response.speed = speed
+        response.residual_rms = info['residual_rms']
+        response.evaluations = info['evaluations']
         
         return response
     
-    def start(self):
-        """ Start the rotation estimation server. """
+    def status(self):
+        """
+        Collect the load of the server since the last call and the statistics of the latest requests (see FitStatistics).
+
+        Returns:
+            an EstimationServerStatus message
+        """
+        now = time.time()
+        num_workers = self._worker_pool.num_workers if self._worker_pool is not None else 1
+        
+        status = EstimationServerStatus()
+        status.header.stamp = rospy.Time.now()
+        status.num_workers = num_workers
+        with self._stats_lock:
+            status.queue_depth = self._pending_requests
+            status.requests_served = self._requests_served
+            status.worker_utilization = self._busy_time / (num_workers * maximum(now - self._last_status_time, 1e-6))
+            status.request_rate = (self._requests_served - self._last_status_requests) / maximum(now - self._last_status_time, 1e-6)
+            self._fit_statistics.fill_status(status)
+            self._busy_time = 0.0
+            self._last_status_time = now
+            self._last_status_requests = self._requests_served
+            
+        return status
+    
+    def publish_status(self, event):
+        """ A callback used by a timer to publish the server load. """
+        self._status_publisher.publish(self.status())
+    
+    def start(self, num_workers=0, max_poses=1000, status_rate=1.0):
+        """ 
+        Start the rotation estimation server. 
+
+        Args:
+            num_workers: the number of worker processes, 0 to run the estimation inside the service threads
+            max_poses: the maximum number of poses per request handed off to the workers through shared memory
+            status_rate: the rate in Hz at which the server load is published
+        """
+        # fork the workers before the node starts its threads
+        if num_workers > 0:
+            self._worker_pool = RotationWorkerPool(num_workers, max_poses)
+        
         rospy.init_node('estimate_rotation_server')
         s = rospy.Service('estimate_rotation', EstimateRotation, self.find_circle_posestamped)
+        self._status_publisher = rospy.Publisher('estimate_rotation_status', EstimationServerStatus)
+        self._status_timer = rospy.Timer(rospy.Duration(1.0 / status_rate), self.publish_status)
         print "Ready to estimate circles."
         rospy.spin()
+        
+        if self._worker_pool is not None:
+            self._worker_pool.shutdown()
     
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rotation estimation server.')
+    parser.add_argument('--workers', type=int, default=0, help='the number of worker processes (0 runs the estimation in process)')
+    parser.add_argument('--max-poses', type=int, default=1000, help='the maximum number of poses per request handed off through shared memory')
+    parser.add_argument('--status-rate', type=float, default=1.0, help='the rate in Hz at which the server load is published')
+    args = parser.parse_args(rospy.myargv()[1:])
+    
     server = CircleFinder()
-    server.start()
+    server.start(args.workers, args.max_poses, args.status_rate)
     
@@ -0,0 +1,146 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import time
+import threading
+from collections import deque
+
+class FrameQueue:
+    """
+    A bounded queue of recognition results, between the topic subscriber and the tracker.
+
+    When the tracker falls behind, the oldest frames are dropped (DROP_OLDEST) or only the newest frame is kept (LATEST),
+    so a burst of detections never builds up an unbounded latency. With max_batch greater than one, the frames waiting
+    in the queue are handed over together, letting the tracker update the model once for the whole batch.
+    """
+    DROP_OLDEST = 'drop_oldest'
+    LATEST = 'latest'
+    
+    capacity = 0
+    policy = DROP_OLDEST
+    max_batch = 1
+    received = 0
+    dropped = 0
+    processed = 0
+    batches = 0
+    
+    def __init__(self, capacity=5, policy=DROP_OLDEST, max_batch=1):
+        """
+        Args:
+            capacity: the maximum number of frames waiting in the queue, with the DROP_OLDEST policy
+            policy: DROP_OLDEST or LATEST
+            max_batch: the maximum number of frames returned by get
+        """
+        self.capacity = capacity
+        self.policy = policy
+        self.max_batch = max_batch
+        self._frames = deque()
+        self._condition = threading.Condition()
+        self.reset_statistics()
+        
+    def reset_statistics(self):
+        """ Zero the counters and the latency statistics. """
+        with self._condition:
+            self.received = 0
+            self.dropped = 0
+            self.processed = 0
+            self.batches = 0
+            self._total_latency = 0.0
+            self._max_latency = 0.0
+        
+    def put(self, frame):
+        """ Enqueue a frame, dropping the frames exceeding the capacity according to the policy. """
+        with self._condition:
+            self.received += 1
+            limit = 1 if self.policy == self.LATEST else max(self.capacity, 1)
+            while len(self._frames) >= limit:
+                self._frames.popleft()
+                self.dropped += 1
+            self._frames.append((time.time(), frame))
+            self._condition.notify()
+            
+    def get(self, timeout=None):
+        """
+        Wait for frames to process.
+
+        Args:
+            timeout: the maximum time (s) to wait, None waits forever
+
+        Returns:
+            the list of the dequeued frames, oldest first: at most max_batch frames, empty if the timeout expired
+        """
+        with self._condition:
+            if not self._frames:
+                self._condition.wait(timeout)
+            if not self._frames:
+                return []
+            
+            now = time.time()
+            batch = []
+            for _ in range(min(len(self._frames), max(self.max_batch, 1))):
+                stamp, frame = self._frames.popleft()
+                latency = now - stamp
+                self._total_latency += latency
+                self._max_latency = max(self._max_latency, latency)
+                batch.append(frame)
+            self.processed += len(batch)
+            self.batches += 1
+            return batch
+        
+    def clear(self):
+        """ Drop every frame waiting in the queue. """
+        with self._condition:
+            self.dropped += len(self._frames)
+            self._frames.clear()
+        
+    def statistics(self):
+        """
+        Return the statistics of the queue.
+
+        Returns:
+            a dictionary containing the received, dropped, processed frames and batches counters, the current depth of the queue
+            and the mean and max time (s) spent by the frames in the queue
+        """
+        with self._condition:
+            return dict(received=self.received, 
+                        dropped=self.dropped, 
+                        processed=self.processed, 
+                        batches=self.batches, 
+                        depth=len(self._frames),
+                        mean_latency=self._total_latency / self.processed if self.processed > 0 else 0.0,
+                        max_latency=self._max_latency)
+        
+    def __len__(self):
+        with self._condition:
+            return len(self._frames)
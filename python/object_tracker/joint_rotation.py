@@ -0,0 +1,277 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import math
+import numpy as np
+
+def frame_from_axis(axis):
+    """ Build an orthonormal 3x3 frame whose columns are two directions orthogonal to axis and axis itself. """
+    z_axis = np.asarray(axis, dtype=float)
+    z_axis = z_axis / np.linalg.norm(z_axis)
+    reference = np.array([0.0, 1.0, 0.0]) if abs(z_axis[1]) < 0.9 else np.array([1.0, 0.0, 0.0])
+    x_axis = np.cross(reference, z_axis)
+    x_axis /= np.linalg.norm(x_axis)
+    y_axis = np.cross(z_axis, x_axis)
+    return np.column_stack((x_axis, y_axis, z_axis))
+
+def rotation_from_angles(alpha, beta):
+    """ Rodrigues' formula for the rotation by the vector (alpha, beta, 0). """
+    angle = math.hypot(alpha, beta)
+    if angle < 1e-12:
+        return np.identity(3)
+    kx, ky = alpha / angle, beta / angle
+    skew = np.array([[0.0, 0.0, ky], [0.0, 0.0, -kx], [-ky, kx, 0.0]])
+    return np.identity(3) + math.sin(angle) * skew + (1.0 - math.cos(angle)) * np.dot(skew, skew)
+
+def initial_rotation(times, positions):
+    """
+    Estimate a rough rotation from the poses of a single object, e.g. to start fit_joint_rotation without a model.
+
+    The axis is the normal of the plane best fitting the positions, the center is given by an algebraic circle fit in that
+    plane and the speed by a linear fit of the unwrapped angle around the center.
+
+    Args:
+        times: the array of the times (s) of the poses
+        positions: the Nx3 array of the positions of the poses
+
+    Returns:
+        a (center, axis, speed) tuple
+    """
+    times = np.asarray(times, dtype=float)
+    positions = np.asarray(positions, dtype=float)
+    mean = np.mean(positions, axis=0)
+    axis = np.linalg.svd(positions - mean)[2][2]
+    frame = frame_from_axis(axis)
+    local = np.dot(positions - mean, frame)
+    
+    # x^2 + y^2 = 2 a x + 2 b y + c
+    design = np.column_stack((2.0 * local[:, 0], 2.0 * local[:, 1], np.ones(len(local))))
+    a, b, _ = np.linalg.lstsq(design, local[:, 0]**2 + local[:, 1]**2, rcond=-1)[0]
+    center = mean + np.dot(frame[:, 0:2], [a, b])
+    
+    angles = np.unwrap(np.arctan2(local[:, 1] - b, local[:, 0] - a))
+    speed = np.polyfit(times - times[0], angles, 1)[0] if np.ptp(times) > 0 else 0.0
+    return center, frame[:, 2].copy(), speed
+
+class JointRotationFit:
+    """
+    The result of fit_joint_rotation.
+
+    The per object parameters are expressed in frame, a 3x3 matrix whose last column is the axis: each object moves along
+    center + frame * (radius cos(phase + speed (t - stamp)), radius sin(phase + speed (t - stamp)), height).
+    """
+    def __init__(self):
+        self.success = False
+        self.center = np.zeros(3)
+        self.axis = np.array([0.0, 0.0, 1.0])
+        self.speed = 0.0
+        self.frame = np.identity(3)
+        self.stamp = 0.0
+        self.radius = np.zeros(0)
+        self.phase = np.zeros(0)
+        self.height = np.zeros(0)
+        self.center_covariance = None
+        self.axis_covariance = None
+        self.speed_std_dev = None
+        self.rms = float('inf')
+        self.iterations = 0
+
+def fit_joint_rotation(times, positions, center, axis, speed, max_iterations=20, tolerance=1e-9):
+    """
+    Fit a single rotation to the poses of several objects at once.
+
+    The rotation center, the axis and the angular speed are shared by all the objects, while each object has its own radius,
+    phase and height along the axis. The least squares problem is solved with Levenberg-Marquardt iterations in which the
+    per object parameters, whose blocks of the normal equations are independent, are eliminated through the Schur complement:
+    every iteration costs time linear in the total number of poses. The covariance of the shared parameters is scaled
+    by the residual variance and propagated to the center and axis.
+
+    The center of the rotation is not observable along the axis: the returned one lies at the mean height of the objects.
+
+    Args:
+        times: a list containing, for each object, the array of the times (s) of its poses
+        positions: a list containing, for each object, the Nx3 array of the positions of its poses
+        center: the initial rotation center
+        axis: the initial rotation axis
+        speed: the initial angular speed (rad/s)
+        max_iterations: the maximum number of iterations
+        tolerance: the relative decrease of the cost below which the fit is considered converged
+
+    Returns:
+        a JointRotationFit, whose success field is False if the problem is underdetermined or the fit diverged
+    """
+    fit = JointRotationFit()
+    num_objects = len(times)
+    counts = np.array([len(t) for t in times])
+    if num_objects == 0 or np.sum(counts) * 3 <= 5 + 3 * num_objects:
+        return fit
+    
+    t = np.concatenate([np.asarray(stamps, dtype=float) for stamps in times])
+    p = np.concatenate([np.asarray(points, dtype=float).reshape(-1, 3) for points in positions])
+    idx = np.repeat(np.arange(num_objects), counts)
+    stamp = np.max(t)
+    t = t - stamp
+    
+    c = np.asarray(center, dtype=float).copy()
+    frame = frame_from_axis(axis)
+    w = float(speed)
+    
+    # initial per object parameters, projecting the poses on the initial model
+    q = np.dot(p - c, frame)
+    r = np.bincount(idx, np.hypot(q[:, 0], q[:, 1])) / counts
+    h = np.bincount(idx, q[:, 2]) / counts
+    angles = np.arctan2(q[:, 1], q[:, 0]) - w * t
+    phi = np.arctan2(np.bincount(idx, np.sin(angles)), np.bincount(idx, np.cos(angles)))
+    
+    def residuals(c, frame, w, r, phi, h):
+        theta = phi[idx] + w * t
+        model = np.column_stack((r[idx] * np.cos(theta), r[idx] * np.sin(theta), h[idx]))
+        return np.dot(p - c, frame) - model, model, theta
+    
+    def normal_equations(model, theta, error):
+        # derivatives of the model, expressed in the fit frame, wrt. the shared (center u, v, tilt alpha, beta, speed)
+        # and per object (radius, phase, height) parameters
+        cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+        tangent = np.column_stack((-model[:, 1], model[:, 0], np.zeros(len(t))))
+        shared = np.zeros((len(t), 3, 5))
+        shared[:, 0, 0] = 1.0
+        shared[:, 1, 1] = 1.0
+        shared[:, 1, 2] = -model[:, 2]
+        shared[:, 2, 2] = model[:, 1]
+        shared[:, 0, 3] = model[:, 2]
+        shared[:, 2, 3] = -model[:, 0]
+        shared[:, :, 4] = tangent * t[:, np.newaxis]
+        local = np.zeros((len(t), 3, 3))
+        local[:, 0, 0] = cos_theta
+        local[:, 1, 0] = sin_theta
+        local[:, :, 1] = tangent
+        local[:, 2, 2] = 1.0
+        
+        a = np.einsum('pki,pkj->ij', shared, shared)
+        b = np.zeros((num_objects, 5, 3))
+        np.add.at(b, idx, np.einsum('pki,pkj->pij', shared, local))
+        d = np.zeros((num_objects, 3, 3))
+        np.add.at(d, idx, np.einsum('pki,pkj->pij', local, local))
+        g_shared = np.einsum('pki,pk->i', shared, error)
+        g_local = np.zeros((num_objects, 3))
+        np.add.at(g_local, idx, np.einsum('pki,pk->pi', local, error))
+        return a, b, d, g_shared, g_local
+    
+    def solve(a, b, d, g_shared, g_local, damping):
+        a = a + damping * np.diag(np.diag(a))
+        d = d + damping * np.einsum('nii->ni', d)[:, :, np.newaxis] * np.identity(3)
+        d_inv = np.linalg.inv(d)
+        # W_i = D_i^-1 B_i^T
+        w_blocks = np.einsum('nij,nkj->nik', d_inv, b)
+        schur = a - np.einsum('nij,njk->ik', b, w_blocks)
+        rhs = g_shared - np.einsum('nij,nj->i', b, np.einsum('nij,nj->ni', d_inv, g_local))
+        delta_shared = np.linalg.solve(schur, rhs)
+        delta_local = np.einsum('nij,nj->ni', d_inv, g_local - np.einsum('nji,j->ni', b, delta_shared))
+        return delta_shared, delta_local, schur, d_inv, w_blocks
+    
+    error, model, theta = residuals(c, frame, w, r, phi, h)
+    cost = np.sum(error**2)
+    damping = 1e-3
+    try:
+        for iteration in range(max_iterations):
+            fit.iterations = iteration + 1
+            equations = normal_equations(model, theta, error)
+            improved = False
+            while damping < 1e10:
+                delta_shared, delta_local = solve(*(equations + (damping,)))[0:2]
+                new_c = c + np.dot(frame[:, 0:2], delta_shared[0:2])
+                new_frame = np.dot(frame, rotation_from_angles(delta_shared[2], delta_shared[3]))
+                new_w = w + delta_shared[4]
+                new_r, new_phi, new_h = r + delta_local[:, 0], phi + delta_local[:, 1], h + delta_local[:, 2]
+                new_error, new_model, new_theta = residuals(new_c, new_frame, new_w, new_r, new_phi, new_h)
+                new_cost = np.sum(new_error**2)
+                if new_cost <= cost:
+                    improved = True
+                    break
+                damping *= 10.0
+            if not improved:
+                break
+            
+            converged = cost - new_cost <= tolerance * max(cost, 1e-30)
+            c, frame, w, r, phi, h = new_c, new_frame, new_w, new_r, new_phi, new_h
+            error, model, theta, cost = new_error, new_model, new_theta, new_cost
+            damping = max(damping / 10.0, 1e-9)
+            if converged:
+                break
+        
+        # covariance of the shared parameters from the undamped normal equations
+        a, b, d, g_shared, g_local = normal_equations(model, theta, error)
+        _, _, schur, d_inv, w_blocks = solve(a, b, d, g_shared, g_local, 0.0)
+        shared_covariance = np.linalg.inv(schur)
+    except np.linalg.LinAlgError:
+        return fit
+    
+    if not (np.isfinite(cost) and np.all(np.isfinite(shared_covariance))):
+        return fit
+    
+    variance = cost / (3 * len(t) - 5 - 3 * num_objects)
+    shared_covariance *= variance
+    
+    # the center moves to the mean height of the objects: center + frame * (u, v, mean(h)), tilting with the axis
+    mean_height = np.mean(h)
+    center_jacobian = np.zeros((3, 5))
+    center_jacobian[0, 0] = 1.0
+    center_jacobian[1, 1] = 1.0
+    center_jacobian[0, 3] = mean_height
+    center_jacobian[1, 2] = -mean_height
+    center_jacobian[2, :] = -np.mean(w_blocks[:, 2, :], axis=0)
+    center_covariance = np.dot(np.dot(center_jacobian, shared_covariance), center_jacobian.T)
+    center_covariance[2, 2] += variance * np.sum(d_inv[:, 2, 2]) / num_objects**2
+    axis_jacobian = np.zeros((3, 5))
+    axis_jacobian[0, 3] = 1.0
+    axis_jacobian[1, 2] = -1.0
+    
+    # negative radii are equivalent to a half turn of the phase
+    phi = np.where(r < 0, phi + math.pi, phi)
+    r = np.abs(r)
+    
+    fit.success = True
+    fit.center = c + frame[:, 2] * mean_height
+    fit.axis = frame[:, 2].copy()
+    fit.speed = w
+    fit.frame = frame
+    fit.stamp = stamp
+    fit.radius = r
+    fit.phase = np.mod(phi + math.pi, 2.0 * math.pi) - math.pi
+    fit.height = h - mean_height
+    fit.center_covariance = np.dot(np.dot(frame, center_covariance), frame.T)
+    fit.axis_covariance = np.dot(np.dot(frame, np.dot(np.dot(axis_jacobian, shared_covariance), axis_jacobian.T)), frame.T)
+    fit.speed_std_dev = math.sqrt(shared_covariance[4, 4])
+    fit.rms = math.sqrt(cost / len(t))
+    return fit
@@ -0,0 +1,198 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import math
+import time
+import argparse
+import numpy as np
+from object_tracker.joint_rotation import fit_joint_rotation, frame_from_axis, initial_rotation
+
+def select_keyframes(times, angles, budget, recent):
+    """
+    Select the poses of an object history worth keeping.
+
+    The most recent poses are always kept. The rest of the budget is spent on angular coverage: the circle is split into as
+    many sectors as the free slots and the newest pose of each sector is kept, so poses bunched on the same arc do not crowd
+    out the rest of the circle. If the history covers only a short arc, the slots left are filled with poses spread
+    uniformly in time.
+
+    Args:
+        times: the array of the times of the poses, in ascending order
+        angles: the array of the angles (rad) of the poses around the rotation axis
+        budget: the maximum number of poses to keep
+        recent: the number of most recent poses always kept
+
+    Returns:
+        the array of the indices of the poses to keep, in ascending order
+    """
+    times = np.asarray(times, dtype=float)
+    num_poses = len(times)
+    if num_poses <= budget:
+        return np.arange(num_poses)
+    
+    recent = min(recent, budget)
+    keep = np.zeros(num_poses, dtype=bool)
+    keep[num_poses - recent:] = True
+    slots = budget - recent
+    if slots == 0:
+        return np.flatnonzero(keep)
+    
+    candidates = np.arange(num_poses - recent)
+    sectors = np.mod(np.asarray(angles, dtype=float)[candidates], 2.0 * math.pi) * (slots / (2.0 * math.pi))
+    sectors = np.minimum(sectors.astype(int), slots - 1)
+    newest = np.full(slots, -1, dtype=int)
+    np.maximum.at(newest, sectors, candidates)
+    keep[newest[newest >= 0]] = True
+    
+    free_slots = slots - np.count_nonzero(newest >= 0)
+    others = candidates[~keep[candidates]]
+    if free_slots > 0 and len(others) > 0:
+        targets = np.linspace(times[others[0]], times[others[-1]], min(free_slots, len(others)))
+        nearest = np.clip(np.searchsorted(times[others], targets), 0, len(others) - 1)
+        keep[others[nearest]] = True
+    
+    return np.flatnonzero(keep)
+
+def rotation_angles(positions, center, frame):
+    """ Compute the angles of the positions (Nx3) around the axis of a rotation center frame (3x3, the axis being the last column). """
+    local = np.dot(np.asarray(positions, dtype=float) - center, frame[:, 0:2])
+    return np.arctan2(local[:, 1], local[:, 0])
+
+def tracks_from_log(directory, min_poses=10):
+    """
+    Read the detections of a log written by DetectionLogWriter, grouped by object id and db.
+
+    Every id/db pair is considered a single object: the logs to evaluate should not contain several instances of the same object.
+
+    Args:
+        directory: the directory containing the log
+        min_poses: the minimum number of detections of an object
+
+    Returns:
+        a list containing, for each object, a (times, positions) tuple of arrays sorted by time
+    """
+    from object_tracker.detection_log import DetectionLogReader
+    
+    reader = DetectionLogReader(directory)
+    count = reader.frames['start'][-1] + reader.frames['count'][-1] if len(reader) > 0 else 0
+    stamps = np.asarray(reader.columns['stamp'][:count])
+    positions = np.asarray(reader.columns['position'][:count])
+    keys = np.asarray(reader.columns['id'][:count]).astype(np.int64) * len(reader.strings) + reader.columns['db'][:count]
+    
+    tracks = []
+    for key in np.unique(keys):
+        rows = np.flatnonzero(keys == key)
+        if len(rows) < min_poses:
+            continue
+        rows = rows[np.argsort(stamps[rows], kind='mergesort')]
+        tracks.append((stamps[rows], positions[rows]))
+    return tracks
+
+def evaluate_keyframes(tracks, budgets, recent=10, refit_every=10):
+    """
+    Compare the keyframe selection with keeping the last poses of each object, replaying recorded tracks.
+
+    The reference rotation is fit to all the poses of all the objects. The poses are then replayed in time order and every
+    refit_every poses the histories are trimmed to the budget, with either policy, and the rotation is fit again, starting from
+    the previous estimate, as the tracker does.
+
+    Args:
+        tracks: a list of (times, positions) tuples, as returned by tracks_from_log
+        budgets: the numbers of poses per object to test
+        recent: the number of most recent poses always kept by the keyframe selection
+        refit_every: the number of replayed poses between two fits
+
+    Returns:
+        a list of (policy, budget, mean fit time (s), mean center error (m), mean axis error (rad), mean speed error (rad/s)) tuples
+    """
+    longest = max(tracks, key=lambda track: len(track[0]))
+    center, axis, speed = initial_rotation(*longest)
+    reference = fit_joint_rotation([ track[0] for track in tracks ], [ track[1] for track in tracks ], center, axis, speed)
+    if not reference.success:
+        raise RuntimeError("The reference rotation could not be fit to the recorded tracks.")
+    
+    # the order in which the poses are replayed, as (track, pose) pairs
+    events = np.concatenate([ np.column_stack((np.full(len(track[0]), idx), np.arange(len(track[0])))) for idx, track in enumerate(tracks) ])
+    events = events[np.argsort(np.concatenate([ track[0] for track in tracks ]), kind='mergesort')]
+    
+    results = []
+    for budget in budgets:
+        for policy in ('last', 'keyframes'):
+            histories = [ [] for _ in tracks ]
+            estimate = (reference.center, reference.axis, reference.speed)
+            fit_times, center_errors, axis_errors, speed_errors = [], [], [], []
+            for event_idx, (track_idx, pose_idx) in enumerate(events):
+                histories[track_idx].append(pose_idx)
+                if (event_idx + 1) % refit_every != 0:
+                    continue
+                
+                frame = frame_from_axis(estimate[1])
+                for idx, history in enumerate(histories):
+                    if len(history) <= budget:
+                        continue
+                    if policy == 'last':
+                        del history[:-budget]
+                    else:
+                        times, positions = tracks[idx][0][history], tracks[idx][1][history]
+                        history[:] = [ history[i] for i in select_keyframes(times, rotation_angles(positions, estimate[0], frame), budget, recent) ]
+                
+                used = [ idx for idx, history in enumerate(histories) if len(history) >= 3 ]
+                if not used:
+                    continue
+                start = time.time()
+                fit = fit_joint_rotation([ tracks[idx][0][histories[idx]] for idx in used ], [ tracks[idx][1][histories[idx]] for idx in used ], *estimate)
+                fit_times.append(time.time() - start)
+                if not fit.success:
+                    continue
+                estimate = (fit.center, fit.axis, fit.speed)
+                
+                offset = fit.center - reference.center
+                center_errors.append(np.linalg.norm(offset - np.dot(offset, reference.axis) * reference.axis))
+                axis_errors.append(math.acos(min(abs(np.dot(fit.axis, reference.axis)), 1.0)))
+                speed_errors.append(abs(fit.speed - reference.speed) if np.dot(fit.axis, reference.axis) > 0 else abs(fit.speed + reference.speed))
+                
+            results.append((policy, budget, np.mean(fit_times), np.mean(center_errors), np.mean(axis_errors), np.mean(speed_errors)))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Evaluate the keyframe selection of the object histories on a detection log.')
+    parser.add_argument('log', help='the directory of a log written by the tracker (detection_log_dir parameter)')
+    parser.add_argument('--budgets', type=int, nargs='+', default=[10, 20, 50], help='the numbers of poses per object to test')
+    parser.add_argument('--recent', type=int, default=10, help='the number of most recent poses always kept')
+    parser.add_argument('--refit-every', type=int, default=10, help='the number of replayed poses between two fits')
+    args = parser.parse_args()
+    
+    print "%10s %7s %14s %18s %16s %20s" % ("policy", "budget", "fit time [ms]", "center error [mm]", "axis error [deg]", "speed error [rad/s]")
+    for policy, budget, fit_time, center_error, axis_error, speed_error in evaluate_keyframes(tracks_from_log(args.log), args.budgets, args.recent, args.refit_every):
+        print "%10s %7d %14.2f %18.2f %16.3f %20.4f" % (policy, budget, 1e3 * fit_time, 1e3 * center_error, math.degrees(axis_error), speed_error)
@@ -0,0 +1,202 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import os
+import time
+import threading
+import Queue
+import argparse
+import numpy as np
+import rospy
+
+# one record per update of the rotation model, the covariances not available are NaN
+MODEL_DTYPE = np.dtype([ ('stamp', np.float64),
+                         ('center', np.float64, 3),
+                         ('center_covariance', np.float64, 9),
+                         ('center_time_covariance', np.float64, 9),
+                         ('axis', np.float64, 3),
+                         ('axis_covariance', np.float64, 9),
+                         ('axis_time_covariance', np.float64, 9),
+                         ('speed', np.float64),
+                         ('speed_std_dev', np.float64),
+                         ('speed_time_std_dev', np.float64),
+                         ('tracked_objects', np.int32) ])
+
+def covariance_values(covariance, size=9):
+    """ Return the flattened values of a covariance matrix (or standard deviation), NaN if it is not available. """
+    if covariance is None:
+        return [ float('nan') ] * size
+    return np.asarray(covariance, dtype=np.float64).flatten().tolist()
+
+class ModelHistoryWriter:
+    """
+    Append the updates of the rotation model to a binary file of fixed size records (see MODEL_DTYPE).
+
+    The caller thread only copies the values of the update; the records are batched and appended by a background thread, so
+    that an update never waits for the disk. Since the records are only ever appended, a reader can map the file while it
+    is written.
+    """
+    def __init__(self, path, batch_size=100, flush_interval=1.0):
+        """
+        Args:
+            path: the history file, created if needed; an existing history is appended to
+            batch_size: the maximum number of records written at once
+            flush_interval: the maximum time (s) a record waits to be written
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory != "" and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # drop a record partially written before a crash
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size % MODEL_DTYPE.itemsize != 0:
+            with open(path, 'r+b') as history_file:
+                history_file.truncate(size - size % MODEL_DTYPE.itemsize)
+        
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+        
+    def record(self, stamp, center, axis, speed, covariances, tracked_objects):
+        """
+        Queue an update of the rotation model for writing.
+
+        Args:
+            stamp: the time (s) of the update
+            center: the center of rotation
+            axis: the rotation axis
+            speed: the angular speed (rad/s)
+            covariances: the covariances of the model, as returned by Tracker.compute_model_covariances
+            tracked_objects: the number of tracked objects
+        """
+        self._queue.put((stamp, 
+                         tuple(center), covariance_values(covariances['center_covariance']), covariance_values(covariances['center_time_covariance']),
+                         tuple(axis), covariance_values(covariances['axis_covariance']), covariance_values(covariances['axis_time_covariance']),
+                         speed, covariance_values(covariances['speed_std_dev'], 1)[0], covariance_values(covariances['speed_time_std_dev'], 1)[0],
+                         tracked_objects))
+        
+    def close(self):
+        """ Write the pending records and stop the writer thread. """
+        self._queue.put(None)
+        self._thread.join()
+        
+    def _write_loop(self):
+        """ The writer thread: collect the records for up to flush_interval and append them in batches. """
+        running = True
+        while running:
+            batch = [ self._queue.get() ]
+            deadline = time.time() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0.0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except Queue.Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            if batch:
+                try:
+                    with open(self.path, 'ab') as history_file:
+                        np.array(batch, dtype=MODEL_DTYPE).tofile(history_file)
+                except (IOError, OSError), e:
+                    rospy.logerr("Unable to write the model history: %s" % e)
+
+class ModelHistoryReader:
+    """ Read a history written by ModelHistoryWriter, memory mapping its records; the records are assumed to be sorted by stamp. """
+    def __init__(self, path):
+        """
+        Args:
+            path: the history file
+        """
+        # ignore a record not completely written yet
+        length = os.path.getsize(path) // MODEL_DTYPE.itemsize
+        if length == 0:
+            self.records = np.zeros(0, dtype=MODEL_DTYPE)
+        else:
+            self.records = np.memmap(path, dtype=MODEL_DTYPE, mode='r', shape=(length,))
+            
+    def __len__(self):
+        return self.records.shape[0]
+    
+    def range(self, start=None, end=None):
+        """ Return the records with a stamp in [start, end], as a view of the file; None leaves a side unbounded. """
+        stamps = self.records['stamp']
+        first = 0 if start is None else np.searchsorted(stamps, start, side='left')
+        last = len(stamps) if end is None else np.searchsorted(stamps, end, side='right')
+        return self.records[first:last]
+    
+    def downsample(self, start=None, end=None, max_records=1000):
+        """
+        Read the records with a stamp in [start, end] reduced to at most max_records, e.g. to plot a long period.
+
+        The range is divided in max_records intervals of the same duration, and the records in each interval are averaged;
+        the empty intervals are skipped.
+
+        Returns:
+            an array of MODEL_DTYPE records
+        """
+        records = self.range(start, end)
+        if records.shape[0] <= max_records:
+            return np.array(records)
+        
+        stamps = records['stamp']
+        edges = np.linspace(stamps[0], stamps[-1], max_records + 1)[:-1]
+        starts = np.unique(np.searchsorted(stamps, edges, side='left'))
+        counts = np.diff(np.append(starts, stamps.shape[0]))
+        downsampled = np.zeros(starts.shape[0], dtype=MODEL_DTYPE)
+        for name in MODEL_DTYPE.names:
+            values = np.add.reduceat(np.asarray(records[name], dtype=np.float64), starts, axis=0)
+            counts_shape = (-1,) + (1,) * (values.ndim - 1)
+            downsampled[name] = values / counts.reshape(counts_shape)
+        return downsampled
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print the history of the rotation model recorded by the tracker.')
+    parser.add_argument('history', help='the history file written by the tracker (model_history_file parameter)')
+    parser.add_argument('--start', type=float, default=None, help='the first stamp to print (s)')
+    parser.add_argument('--end', type=float, default=None, help='the last stamp to print (s)')
+    parser.add_argument('--points', type=int, default=100, help='the maximum number of rows, the records are averaged over longer periods')
+    args = parser.parse_args()
+    
+    print "%18s %10s %10s %10s %8s %8s %8s %12s %14s %8s" % ("stamp", "center x", "center y", "center z", "axis x", "axis y", "axis z", 
+                                                           "speed", "speed std dev", "objects")
+    for record in ModelHistoryReader(args.history).downsample(args.start, args.end, args.points):
+        print "%18.3f %10.4f %10.4f %10.4f %8.4f %8.4f %8.4f %12.5f %14.5f %8d" % ((record['stamp'],) + tuple(record['center']) + tuple(record['axis']) + 
+                                                                             (record['speed'], record['speed_std_dev'], record['tracked_objects']))
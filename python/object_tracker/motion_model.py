@@ -0,0 +1,191 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import math
+import numpy as np
+from scipy import optimize
+
+def wrap_angle(angle):
+    """ Wrap an angle (or an array of angles) into the [-pi, pi) interval. """
+    return np.mod(np.asarray(angle) + math.pi, 2.0 * math.pi) - math.pi
+
+class PolarMotionFilter:
+    """
+    A constant angular velocity Kalman filter expressed in polar coordinates wrt. the rotating frame.
+
+    The phase and its rate of change are estimated jointly, the radius is filtered independently as a random walk.
+    Since the objects are observed in the rotating frame the estimated rate is the residual angular speed not yet
+    captured by the rotation model; it is what allows the filter to predict where a track will be at the time of the next detection.
+    """
+    def __init__(self, stamp, radius, phase, process_noise=0.05, measurement_noise=0.01, radius_process_noise=1e-4):
+        """
+        Args:
+            stamp: the time (s) of the first observation
+            radius: the first observed radius (m)
+            phase: the first observed phase (rad)
+            process_noise: the angular acceleration noise (rad/s^2)
+            measurement_noise: the position noise of a detection (m)
+            radius_process_noise: the radius random walk noise (m^2/s)
+        """
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.radius_process_noise = radius_process_noise
+        self.reset(stamp, radius, phase)
+
+    def reset(self, stamp, radius, phase):
+        """ Restart the filter from a single observation, forgetting the estimated angular rate. """
+        self.stamp = stamp
+        self.radius = radius
+        self.phase = phase
+        self.omega = 0.0
+        self.radius_var = self.measurement_noise**2
+        phase_var = self.phase_variance(radius)
+        # covariance of (phase, omega)
+        self.p00 = phase_var
+        self.p01 = 0.0
+        self.p11 = 1.0
+
+    def rebase(self, stamp, radius, phase, speed_delta):
+        """
+        Move the filter into a new rotating frame, keeping the estimated angular rate and its covariance.
+
+        Args:
+            stamp: the time (s) of the reprojected observation
+            radius: the observed radius (m) in the new frame
+            phase: the observed phase (rad) in the new frame
+            speed_delta: the change of the rotation model speed (rad/s), now captured by the frame instead of the residual rate
+        """
+        self.stamp = stamp
+        self.radius = radius
+        self.phase = phase
+        self.omega -= speed_delta
+
+    def phase_variance(self, radius):
+        """ Convert the position noise of a detection into a phase noise at the given radius. """
+        return (self.measurement_noise / max(radius, self.measurement_noise))**2
+
+    def predict(self, stamp):
+        """
+        Predict the polar coordinates of the object at a given time, without changing the filter state.
+
+        Args:
+            stamp: the time (s) at which the prediction is needed
+
+        Returns:
+            radius: the predicted radius
+            phase: the predicted phase, wrapped into [-pi, pi)
+        """
+        return self.radius, float(wrap_angle(self.phase + self.omega * (stamp - self.stamp)))
+
+    def update(self, stamp, radius, phase):
+        """
+        Propagate the filter up to a new observation and correct it.
+
+        Args:
+            stamp: the time (s) of the observation
+            radius: the observed radius (m)
+            phase: the observed phase (rad)
+        """
+        dt = max(stamp - self.stamp, 0.0)
+        q = self.process_noise**2
+
+        # predict: phase += omega * dt
+        p00 = self.p00 + dt * (2.0 * self.p01 + dt * self.p11) + q * dt**3 / 3.0
+        p01 = self.p01 + dt * self.p11 + q * dt**2 / 2.0
+        p11 = self.p11 + q * dt
+        predicted_phase = self.phase + self.omega * dt
+        radius_var = self.radius_var + self.radius_process_noise * dt
+
+        # correct the phase and the angular rate
+        innovation = float(wrap_angle(phase - predicted_phase))
+        s = p00 + self.phase_variance(radius)
+        k0 = p00 / s
+        k1 = p01 / s
+        self.phase = float(wrap_angle(predicted_phase + k0 * innovation))
+        self.omega += k1 * innovation
+        self.p00 = (1.0 - k0) * p00
+        self.p01 = (1.0 - k0) * p01
+        self.p11 = p11 - k1 * p01
+
+        # correct the radius
+        k_r = radius_var / (radius_var + self.measurement_noise**2)
+        self.radius += k_r * (radius - self.radius)
+        self.radius_var = (1.0 - k_r) * radius_var
+
+        self.stamp = stamp
+
+def polar_dist_matrix(r1, phi1, r2, phi2):
+    """
+    Compute the pairwise polar distances between two sets of points.
+
+    Args:
+        r1, phi1: arrays of shape (N,) or (N, M) with the polar coordinates of the first set
+        r2, phi2: arrays broadcastable against r1 with the polar coordinates of the second set
+
+    Returns:
+        the array of the distances
+    """
+    sq_dist = r1**2 + r2**2 - 2.0 * r1 * r2 * np.cos(phi1 - phi2)
+    return np.sqrt(np.maximum(sq_dist, 0.0))
+
+def gated_assignment(cost, gate):
+    """
+    Solve the global assignment problem between the rows and the columns of a cost matrix.
+
+    Pairs whose cost exceeds the gate (including those masked out with an infinite cost) are never matched.
+    Rows and columns without any admissible pair are discarded before running the Hungarian algorithm.
+
+    Args:
+        cost: a (num_rows, num_cols) array of costs
+        gate: the maximum cost allowed for a pair
+
+    Returns:
+        a list of (row, col) tuples
+    """
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0:
+        return []
+
+    admissible = cost <= gate
+    rows = np.flatnonzero(admissible.any(axis=1))
+    cols = np.flatnonzero(admissible.any(axis=0))
+    if rows.size == 0:
+        return []
+
+    reduced_cost = cost[np.ix_(rows, cols)]
+    # non admissible pairs get a cost big enough to never be preferred over an admissible one
+    reduced_cost = np.where(reduced_cost <= gate, reduced_cost, gate * (rows.size + cols.size + 1.0) + 1.0)
+    row_ind, col_ind = optimize.linear_sum_assignment(reduced_cost)
+
+    return [ (int(rows[r]), int(cols[c])) for r, c in zip(row_ind, col_ind) if reduced_cost[r, c] <= gate ]
@@ -35,8 +35,10 @@
 
 import sys
 import time
+import socket
 import math
 import threading
+import argparse
 import rospy
 import actionlib
 import numpy as np
@@ -47,11 +49,30 @@ from dynamic_reconfigure.server import Server
 from object_recognition_msgs.msg import RecognizedObjectArray, RecognizedObject, ObjectId, ObjectRecognitionAction, ObjectRecognitionGoal, ObjectRecognitionResult
 from geometry_msgs.msg import PoseWithCovarianceStamped, PoseStamped, Point, Vector3, PoseArray, Pose, PointStamped
 from std_msgs.msg import Header 
+from sensor_msgs.msg import PointCloud2
 from visualization_msgs.msg import MarkerArray, Marker
 from object_tracker.srv import EstimateRotation, EstimateRotationResponse, EstimateRotationRequest
-from object_tracker.msg import RotationParameters, RotatingObjects
+from object_tracker.srv import PredictObjectPoses, PredictObjectPosesResponse
+from object_tracker.srv import DumpTrace, DumpTraceResponse
+from object_tracker.msg import RotationParameters, RotatingObjects, TrackerInputStatus, ModelUpdateStatus
 from object_tracker.cfg import RotatingObjectTrackerConfig
-from copy import copy, deepcopy
+from object_tracker.motion_model import PolarMotionFilter, polar_dist_matrix, gated_assignment
+from object_tracker.joint_rotation import fit_joint_rotation
+from object_tracker.keyframes import select_keyframes, rotation_angles
+from object_tracker.refit_scheduler import RefitScheduler
+from object_tracker.rate_scheduler import AdaptiveRateScheduler, PhasedTimer
+from object_tracker.checkpoint import save_checkpoint, load_checkpoint
+from object_tracker.detection_log import DetectionLogWriter
+from object_tracker.model_history import ModelHistoryWriter
+from object_tracker.shared_state import SharedStateWriter
+from object_tracker.pointcloud_frontend import PointCloudFrontEnd, CLUSTER_DB
+from object_tracker.frame_queue import FrameQueue
+from object_tracker.camera_fusion import CameraFusion, CameraWorkerPool
+from object_tracker.tracing import TraceBuffer, logdebug
+from object_tracker.predictive_roi import PredictiveRoi, intersect_limits
+from object_tracker.detection_merge import cluster_detections, merge_clusters, MERGE_ANY, MERGE_SAME_DB
+from object_tracker.output_cache import RecognizedObjectCache, RecognizedObjectArrayBuilder, RotatingObjectsBuilder
+from copy import copy
 
 class TrackedObject:
     """ A tracked object, defined by its id, db and progressive id. The object is identified through its radius and phase wrt the rotation model. """
@@ -64,6 +85,13 @@ class TrackedObject:
     phase = 0.0
     confidence = 0.0
     recognized_object = RecognizedObject   
+    source_object = None
+    marker = None
+    motion_filter = None
+    restored = False
+    fit = None
+    deferrals = 0
+    missed_results = 0
 
 class Tracker:
     _initialized = False
@@ -77,6 +105,10 @@ class Tracker:
     
     _dynamic_reconfigure_server = Server
     _estimate_rotation_service = EstimateRotation
+    _estimation_services = []
+    _estimation_connections = 0
+    _prediction_service = rospy.Service
+    _dump_trace_service = rospy.Service
     _object_detection_client = actionlib.SimpleActionClient
     _tf_publisher = tf.TransformBroadcaster
     _tf_listener = tf.TransformListener
@@ -86,12 +118,17 @@ class Tracker:
     
     _detection_rate = 0.0
     _tf_rate = 0.0
-    _detection_timer = None
-    _tf_timer = None
+    _detection_timer = PhasedTimer
+    _tf_timer = PhasedTimer
+    _detection_timer_rate = 0.0
+    _tf_timer_rate = 0.0
+    _adaptive_rates = False
+    _rate_scheduler = AdaptiveRateScheduler
     
     _model_lock = threading.Lock
     _detection_lock = threading.Lock
     _tf_lock = threading.Lock
+    _timer_lock = threading.Lock
     
     _reference_frame = np.array
     _rotation_center = np.array
@@ -104,13 +141,69 @@ class Tracker:
     
     _static_object_threshold = 0.0
     _static_object_window = 0.0
+    _duplicate_merge_distance = 0.0
+    _duplicate_merge_mode = ""
     _min_poses_for_estimation = 0
     _min_poses_to_consider_an_object = 0
     _max_poses_for_object = 0
     _max_stale_time_for_object = 0.0
     _same_object_threshold = 0.0    
+    _motion_process_noise = 0.0
+    _motion_measurement_noise = 0.0
+    _joint_estimation = True
+    _keyframe_selection = True
+    _keyframe_recent_poses = 0
+    _refit_scheduler = RefitScheduler
+    _trace = TraceBuffer
+    _model_update_publisher = None
     _use_roi = False
     _roi_limits = []
+    _transform_cache = dict()
+    _transform_refresh_period = 0.0
+    _roi_limits_cache = dict()
+    _use_predictive_roi = False
+    _predictive_roi = PredictiveRoi
+    _keep_object_payload = True
+    _skip_unchanged_outputs = True
+    _output_cache = RecognizedObjectCache
+    _rotation_output = RotatingObjectsBuilder
+    _rotating_objects_output = RecognizedObjectArrayBuilder
+    
+    _checkpoint_file = ""
+    _checkpoint_interval = 0.0
+    _checkpoint_max_age = 0.0
+    _checkpoint_validation_frames = 0
+    _checkpoint_timer = None
+    _resume_frames_left = 0
+    _resume_detections = 0
+    _resume_matches = 0
+    _reacquisition_frames = 0
+    _reacquiring = False
+    
+    _detection_log_dir = ""
+    _detection_log = None
+    _shared_state_file = ""
+    _shared_state = None
+    _model_history_file = ""
+    _model_history = None
+    
+    _use_point_cloud = False
+    _cloud_subscriber = None
+    
+    _running = False
+    _subscribe_input = False
+    _input_subscriber = None
+    _input_queue = FrameQueue
+    _input_thread = None
+    _input_status_publisher = None
+    _last_input_status = 0.0
+    _camera_topics = []
+    _camera_subscribers = []
+    _camera_fusion = None
+    _camera_workers = None
+    _camera_dedup_distance = 0.0
+    _camera_merge_window = 0.0
+    _cloud_frontend = PointCloudFrontEnd
     
     # TODO now the ids are not considering the DB field, fix that
     def __init__(self):
@@ -119,6 +212,7 @@ class Tracker:
         self._model_lock = threading.Lock()
         self._detection_lock = threading.Lock()
         self._tf_lock = threading.Lock()
+        self._timer_lock = threading.Lock()
         self._rotation_center = np.zeros(3)
         self._rotation_axis = np.zeros(3)
         self._rotation_speed = np.zeros(1)
@@ -128,22 +222,136 @@ class Tracker:
         self._tracked_objects = set()
         self._static_object_threshold = 0.025
         self._static_object_window = 4
+        self._duplicate_merge_distance = 0.02
+        self._duplicate_merge_mode = MERGE_SAME_DB
         self._max_poses_for_object = 50
         self._max_stale_time_for_object = 10.0
         self._min_poses_to_consider_an_object = 5
         self._min_poses_for_estimation = 10
         self._progressive_id = 0
         self._same_object_threshold = 0.1
+        self._motion_process_noise = 0.05
+        self._motion_measurement_noise = 0.01
+        self._joint_estimation = True
+        self._keyframe_selection = True
+        self._keyframe_recent_poses = 10
+        self._refit_scheduler = RefitScheduler()
+        self._trace = TraceBuffer(1000)
+        self._model_update_publisher = None
         self._use_roi = False
         self._roi_limits = []
+        self._transform_cache = dict()
+        self._transform_refresh_period = 1.0
+        self._roi_limits_cache = dict()
+        self._use_predictive_roi = False
+        self._predictive_roi = PredictiveRoi()
+        self._keep_object_payload = True
+        self._skip_unchanged_outputs = True
+        self._output_cache = RecognizedObjectCache()
+        self._rotation_output = RotatingObjectsBuilder(self._output_cache)
+        self._rotating_objects_output = RecognizedObjectArrayBuilder(self._output_cache)
+        self._checkpoint_file = ""
+        self._checkpoint_interval = 0.0
+        self._checkpoint_max_age = 3600.0
+        self._checkpoint_validation_frames = 5
+        self._resume_frames_left = 0
+        self._resume_detections = 0
+        self._resume_matches = 0
+        self._reacquisition_frames = 5
+        self._reacquiring = False
+        self._detection_log_dir = ""
+        self._detection_log = None
+        self._shared_state_file = ""
+        self._shared_state = None
+        self._model_history_file = ""
+        self._model_history = None
+        self._use_point_cloud = False
+        self._cloud_subscriber = None
+        self._running = False
+        self._subscribe_input = False
+        self._input_subscriber = None
+        self._input_queue = FrameQueue()
+        self._input_thread = None
+        self._input_status_publisher = None
+        self._last_input_status = 0.0
+        self._camera_topics = []
+        self._camera_subscribers = []
+        self._camera_fusion = None
+        self._camera_workers = None
+        self._camera_dedup_distance = 0.02
+        self._camera_merge_window = 0.2
+        self._estimation_services = []
+        self._estimation_connections = 4
+        self._cloud_frontend = PointCloudFrontEnd()
         self._detection_rate = 2.0
         self._tf_rate = 20.0
+        self._detection_timer_rate = 0.0
+        self._tf_timer_rate = 0.0
+        self._adaptive_rates = False
+        self._rate_scheduler = AdaptiveRateScheduler()
+        self._detection_timer = PhasedTimer(self.detection_timer_callback)
+        self._tf_timer = PhasedTimer(self.tf_callback)
         self._ork_camera_frame = ""
         
+    def new_motion_filter(self, stamp, radius, phase):
+        """ Create a motion filter for a track observed at a given time and position, using the current noise parameters. """
+        return PolarMotionFilter(stamp, radius, phase, self._motion_process_noise, self._motion_measurement_noise)
+        
     def tf_frame_for_object(self, obj):
         """ Return a formatted string that uniquely identifies an object, based on its database and progressive id. """
         return "%s_%s_%s" % (self._rotating_tf_frame, obj.id, obj.progressive_id)
     
+    def rotating_recognized_object(self, obj):
+        """
+        Build the RecognizedObject describing a tracked object at the origin of its own TF frame.
+
+        The message is built once, when the object starts being tracked, and reused by every output. The heavy ORK payload
+        (point clouds, bounding mesh and contours) of the detection that originated the track is shared by reference, or dropped
+        if keep_object_payload is disabled.
+
+        Args:
+            obj: a TrackedObject whose progressive id has already been assigned
+
+        Returns:
+            a RecognizedObject
+        """
+        recognized_object = RecognizedObject()
+        recognized_object.header.frame_id = self.tf_frame_for_object(obj)
+        recognized_object.id.id = obj.id
+        recognized_object.id.db = obj.db
+        recognized_object.confidence = obj.confidence
+        recognized_object.pose.header = recognized_object.header
+        recognized_object.pose.pose.pose.orientation.w = 1.0
+        
+        if self._keep_object_payload and obj.source_object is not None:
+            recognized_object.point_clouds = obj.source_object.point_clouds
+            recognized_object.bounding_mesh = obj.source_object.bounding_mesh
+            recognized_object.bounding_contours = obj.source_object.bounding_contours
+        # the detection is not needed anymore
+        obj.source_object = None
+        
+        return recognized_object
+    
+    def marker_for_object(self, obj):
+        """ Build the visualization marker of a tracked object, frame locked with the object's TF frame. """
+        marker = Marker()
+        marker.header.frame_id = self.tf_frame_for_object(obj)
+        marker.id = obj.progressive_id
+        marker.lifetime = rospy.Duration(10.0)
+        marker.ns = "rotating_objects"
+        marker.action = Marker.ADD
+        marker.type = Marker.SPHERE
+        marker.pose = obj.recognized_object.pose.pose.pose
+        marker.scale.x = 0.05
+        marker.scale.y = 0.05
+        marker.scale.z = 0.05
+        marker.color.r = 1.0
+        marker.color.g = 0.0
+        marker.color.b = 0.0
+        marker.color.a = 1.0
+        marker.frame_locked = True
+        return marker
+    
     def broadcast_tf(self, time):
         """ Publish TF data: a static frame for the center and axis of rotation, a moving rotating frame and an unique frame for each tracked object. """
         # the lock on the model should have been acquired outside
@@ -170,50 +378,65 @@ class Tracker:
         Publish visualization markers for each tracked object.
 
         The markers are frame locked with the object's TF frame hence moving continuously as long as the TF frame is updated. 
+        Each object's marker is built once and only its stamp is updated.
         """
         tracked_objs_copy = set()
         with self._model_lock:
             tracked_objs_copy = copy(self._tracked_objects)
         
         marker_array = MarkerArray()
-        id = 0
         now = rospy.Time.now()
         for obj in tracked_objs_copy:
             if len(obj.poses) < self._min_poses_to_consider_an_object:
                 continue
-            marker = Marker()
-            marker.header.stamp = now
-            marker.header.frame_id = self.tf_frame_for_object(obj)
-            marker.id = id
-            marker.lifetime = rospy.Duration(10.0)
-            id += 1
-            marker.ns = "rotating_objects"
-            marker.action = Marker.ADD
-            marker.type = Marker.SPHERE
-            marker.pose = obj.recognized_object.pose.pose.pose
-            marker.scale.x = 0.05
-            marker.scale.y = 0.05
-            marker.scale.z = 0.05
-            marker.color.r = 1.0
-            marker.color.g = 0.0
-            marker.color.b = 0.0
-            marker.color.a = 1.0
-            marker.frame_locked = True
-            
-            marker_array.markers.append(marker)
+            if obj.marker is None:
+                obj.marker = self.marker_for_object(obj)
+            obj.marker.header.stamp = now
+            
+            marker_array.markers.append(obj.marker)
             
         self._marker_publisher.publish(marker_array)
         
-    def publish_rotation_msg(self, new_centers, new_axii, new_speeds):  
+    def compute_model_covariances(self, new_centers, new_axii, fit=None):
+        """
+        Compute the covariances describing the confidence in the rotation model.
+
+        Args:
+            new_centers: a list of the newly estimated rotation centers
+            new_axii: a list of the newly estimated rotation axii
+            fit: the JointRotationFit the new estimates come from, if any; its parameter covariances are used instead of the spread of the estimates
+
+        Returns:
+            a dictionary containing the center_covariance, center_time_covariance, axis_covariance and axis_time_covariance 
+            3x3 matrices, the speed_std_dev and the speed_time_std_dev; each entry is None if there are not enough estimates to compute it
+        """
+        covariances = dict()
+        if fit is not None:
+            covariances['center_covariance'] = fit.center_covariance
+            covariances['axis_covariance'] = fit.axis_covariance
+            covariances['speed_std_dev'] = fit.speed_std_dev
+        else:
+            covariances['center_covariance'] = np.cov(new_centers, rowvar=0) if len(new_centers) > 1 else None
+            covariances['axis_covariance'] = np.cov(new_axii, rowvar=0) if len(new_axii) > 1 else None
+            covariances['speed_std_dev'] = None
+        covariances['center_time_covariance'] = np.cov(self._rotation_center, rowvar=0) if self._rotation_center.shape[0] > 1 else None
+        covariances['axis_time_covariance'] = np.cov(self._rotation_axis, rowvar=0) if self._rotation_axis.shape[0] > 1 else None
+        covariances['speed_time_std_dev'] = np.std(self._rotation_speed) if self._rotation_speed.shape[0] > 1 else None
+        return covariances
+        
+    def covariance_to_list(self, covariance):
+        """ Convert a 3x3 covariance into a flat list, using the identity if the covariance is not available. """
+        if covariance is None:
+            return np.identity(3).flatten().tolist()
+        return covariance.flatten().tolist()
+        
+    def publish_rotation_msg(self, covariances):  
         """
         Publish a message containing the rotation parameters, the estimation confidences and the list of tracked objects.
 
         Args:
-            new_centers: a list of the newly estimated rotation centers, used to compute the estimation confidence
-            new_axii: a list of the newly estimated rotation axii, used to compute the estimation confidence
-            new_speeds: a list of the newly estimated rotation speeds, used to compute the estimation confidence
+            covariances: the covariances of the rotation model, as returned by compute_model_covariances
         """
-        rotating_objs = RotatingObjects()       
         rotation_params = RotationParameters()
         rotation_params.header.frame_id = self._base_tf_frame
         rotation_params.header.stamp = rospy.Time.now()
@@ -221,70 +444,61 @@ class Tracker:
         rotation_params.center.x = self._rotation_center[-1, 0]
         rotation_params.center.y = self._rotation_center[-1, 1]
         rotation_params.center.z = self._rotation_center[-1, 2]
-        
-        if len(new_centers) > 1:
-            rotation_params.center_covariance = np.cov(new_centers, rowvar=0).flatten().tolist()
-        else:
-            rotation_params.center_covariance = np.identity(3).flatten().tolist()
-            
-        if self._rotation_center.shape[0] > 1:
-            rotation_params.center_time_covariance = np.cov(self._rotation_center, rowvar=0).flatten().tolist()
-        else:
-            rotation_params.center_time_covariance = np.identity(3).flatten().tolist()            
+        rotation_params.center_covariance = self.covariance_to_list(covariances['center_covariance'])
+        rotation_params.center_time_covariance = self.covariance_to_list(covariances['center_time_covariance'])
         
         rotation_params.axis.x = self._rotation_axis[-1, 0]
         rotation_params.axis.y = self._rotation_axis[-1, 1]
         rotation_params.axis.z = self._rotation_axis[-1, 2]
-        
-        if len(new_axii) > 1:
-            rotation_params.axis_covariance = np.cov(new_axii, rowvar=0).flatten().tolist()
-        else:
-            rotation_params.axis_covariance = np.identity(3).flatten().tolist()
-            
-        if self._rotation_axis.shape[0] > 1:
-            rotation_params.axis_time_covariance = np.cov(self._rotation_axis, rowvar=0).flatten().tolist()
-        else:
-            rotation_params.axis_time_covariance = np.identity(3).flatten().tolist()       
+        rotation_params.axis_covariance = self.covariance_to_list(covariances['axis_covariance'])
+        rotation_params.axis_time_covariance = self.covariance_to_list(covariances['axis_time_covariance'])
         
         rotation_params.speed = self._rotation_speed[-1]
-        rotation_params.speed_std_dev = np.std(self._rotation_speed)
+        rotation_params.speed_std_dev = covariances['speed_std_dev'] if covariances['speed_std_dev'] is not None else np.std(self._rotation_speed)
         rotation_params.speed_time_std_dev = np.std(self._rotation_speed)
         
-        rotating_objs.rotation_parameters = rotation_params
-        
-        for obj in self._tracked_objects:
-            rotating_objs.objects.append(obj.recognized_object)
-            rotating_objs.radius.append(obj.radius)
-            rotating_objs.phase.append(obj.phase)
-        
-        self._rotation_publisher.publish(rotating_objs)
+        # called with the model lock held
+        tracked_objs = sorted(self._tracked_objects, key=lambda obj: obj.progressive_id)
+        rotating_objs = self._rotation_output.update(rotation_params,
+                                                     [(obj.progressive_id, obj.recognized_object) for obj in tracked_objs],
+                                                     [obj.radius for obj in tracked_objs],
+                                                     [obj.phase for obj in tracked_objs],
+                                                     self._skip_unchanged_outputs,
+                                                     self._rotation_publisher.get_num_connections())
+        if rotating_objs is not None:
+            self._rotation_publisher.publish(rotating_objs)
       
     def publish_rotating_objects(self):
-        """ Publish an object_recognition_msgs/RecognizedObjectArray containing the tracked objects with the poses expressed using the rotating reference frame. """
-        recognized_objects = RecognizedObjectArray()
-        tracked_objs_copy = set()
+        """
+        Publish an object_recognition_msgs/RecognizedObjectArray containing the tracked objects with the poses expressed using the rotating reference frame.
+
+        Nothing is published if the tracked objects did not change since the last message, unless skip_unchanged_outputs is disabled.
+        """
         with self._model_lock:
-            tracked_objs_copy = copy(self._tracked_objects)
+            tracked_objs = sorted(self._tracked_objects, key=lambda obj: obj.progressive_id)
         
-        now = rospy.Time().now()
-        recognized_objects.header.frame_id = self._base_tf_frame
-        recognized_objects.header.stamp = now
-        for obj in tracked_objs_copy:
-            if len(obj.poses) < self._min_poses_to_consider_an_object:
-                continue
-            # update the timestamp of the object
-            obj.recognized_obj.header.stamp = now
-            
-            recognized_objects.objects.append(obj.recognized_obj)
+        objects = [(obj.progressive_id, obj.recognized_object) for obj in tracked_objs
+                   if len(obj.poses) >= self._min_poses_to_consider_an_object]
+        recognized_objects = self._rotating_objects_output.update(self._base_tf_frame, rospy.Time.now(), objects,
+                                                                  self._skip_unchanged_outputs,
+                                                                  self._rotating_objects_publisher.get_num_connections())
+        # forget the serialized objects that are not tracked anymore
+        self._output_cache.prune(obj.progressive_id for obj in tracked_objs)
         
-        self._rotating_objects_publisher.publish(recognized_objects)          
+        if recognized_objects is not None:
+            self._rotating_objects_publisher.publish(recognized_objects)
     
     def update_model(self, header):
         """
         Update the rotation parameters using the newly acquired poses for the tracked objects.
 
-        For each tracked object the rotation model is estimated independently; the results are then combined in order to
-        obtain a more robust set of rotation parameters.
+        Only the objects whose last fit is stale (see RefitScheduler) are fitted again; if there are none the model is left as it is.
+        If joint_estimation is enabled a single rotation is fit to the poses of all the tracked objects at once, starting from the
+        current model: a single stale object refreshes the contributions of all of them. Otherwise, or if the joint fit fails or
+        is not expected to complete within the estimation_budget, the rotation model is estimated independently for each stale
+        object and combined with the last fits of the other objects in order to obtain a more robust set of rotation parameters.
+        With an estimation_budget only the stale objects expected to be fitted within the budget are, the others are deferred
+        to the following updates.
         """
         num_models = 0
         new_axii = []
@@ -296,23 +510,71 @@ class Tracker:
             tracked_objs_copy = copy(self._tracked_objects)        
         
         for obj in tracked_objs_copy:
-            if len(obj.poses) > self._min_poses_for_estimation:
-                try:
-                    request = EstimateRotationRequest()
-                    request.poses = obj.poses
-                    response = EstimateRotationResponse()
-                    response = self._estimate_rotation_service(request)
-                    if response.success:
-                        new_axii.append(np.array([response.axis.x, response.axis.y, response.axis.z]))
-                        new_centers.append(np.array([response.center.x, response.center.y, response.center.z]))
-                        new_speeds.append(response.speed)
-                        num_models += 1
-#                        print "Response: ", response
-                except rospy.ServiceException, e:
-                    rospy.logerr("Error! %s" % e)
-                    
             if len(obj.poses) > self._max_poses_for_object:
-                del obj.poses[:-self._max_poses_for_object]
+                self.trim_object_history(obj)
+        
+        eligible_objs = [ obj for obj in tracked_objs_copy if len(obj.poses) > self._min_poses_for_estimation ]
+        now = rospy.Time.now().to_sec()
+        stale_objs = [ obj for obj in eligible_objs if self._refit_scheduler.is_stale(obj, now) ]
+        start_time = time.time()
+        
+        fit = None
+        joint_skipped = False
+        deferred_objs = []
+        num_poses = sum(len(obj.poses) for obj in eligible_objs)
+        if self._joint_estimation and self._model_valid and stale_objs:
+            if self._refit_scheduler.joint_fit_allowed(num_poses, now):
+                # a single stale object is enough to fit the whole model again
+                fit = self.estimate_joint_rotation(eligible_objs)
+                self._refit_scheduler.record_joint_fit_time(num_poses, time.time() - start_time, now)
+            else:
+                joint_skipped = True
+                self._refit_scheduler.skip_joint_fit(len(eligible_objs), num_poses)
+                logdebug("The joint fit of %d poses would exceed the estimation budget, fitting the objects independently.", num_poses)
+            
+        if fit is not None:
+            for obj in eligible_objs:
+                self._refit_scheduler.fitted(obj, fit.center, fit.axis, fit.speed, now)
+            refitted_objs = len(eligible_objs)
+            new_axii.append(fit.axis)
+            new_centers.append(fit.center)
+            new_speeds.append(fit.speed)
+            num_models = 1
+        else:
+            refitted_objs = 0
+            stale_objs, deferred_objs = self._refit_scheduler.schedule(stale_objs, now, time.time() - start_time)
+            fits_start_time = time.time()
+            for obj, response in zip(stale_objs, self.estimate_rotation_for_objects(stale_objs)):
+                if response is None:
+                    continue
+                axis = np.array([response.axis.x, response.axis.y, response.axis.z])
+                speed = response.speed
+                if np.dot(axis, [0.0, 0.0, 1.0]) < 0:
+                    axis = -axis
+                    speed = -speed
+                self._refit_scheduler.fitted(obj, np.array([response.center.x, response.center.y, response.center.z]), axis, speed, now)
+                refitted_objs += 1
+                if self._trace.capacity > 0:
+                    self._trace.record('object_fit', object=obj.progressive_id, poses=len(obj.poses), center=obj.fit.center.round(4).tolist(), 
+                                       axis=axis.round(4).tolist(), speed=round(speed, 5), radius=round(obj.fit.radius, 4))
+            self._refit_scheduler.record_fit_time(len(stale_objs), time.time() - fits_start_time)
+            
+            # the model changes only if some object was fitted again, the other objects contribute with their last fit
+            if refitted_objs > 0:
+                for obj in eligible_objs:
+                    if obj.fit is not None:
+                        new_axii.append(obj.fit.axis)
+                        new_centers.append(obj.fit.center)
+                        new_speeds.append(obj.fit.speed)
+                        num_models += 1
+        
+        overrun = self._refit_scheduler.check_overrun(time.time() - start_time)
+        self.publish_model_update_status(len(tracked_objs_copy), len(eligible_objs), refitted_objs, len(deferred_objs), fit is not None, 
+                                         joint_skipped, time.time() - start_time, overrun)
+        if self._trace.capacity > 0:
+            self._trace.record('model_update', tracked=len(tracked_objs_copy), eligible=len(eligible_objs), refitted=refitted_objs, 
+                               deferred=len(deferred_objs), joint=fit is not None, joint_skipped=joint_skipped, 
+                               fit_time=round(time.time() - start_time, 6), overrun=overrun)
                   
         if num_models > 0:                    
             new_axis = np.mean(new_axii, axis=0)
@@ -323,18 +585,10 @@ class Tracker:
             if np.dot(new_axis, [ 0.0, 0.0, 1.0 ]) < 0:
                 new_axis = -new_axis
                 new_speed = -new_speed
-            if new_axis is not [ 0.0, 1.0, 0.0 ] and new_axis is not [ 0, -1, 0 ]:
-                x_axis = np.cross(new_axis, [ 0.0, 1.0, 0.0 ])
-            else:
-                x_axis = np.cross(new_axis, [ 1.0, 0.0, 0.0 ])
-                
-            y_axis = np.cross(new_axis, x_axis)
-            rot_matr =  np.array([ [ x_axis[0], y_axis[0], new_axis[0], 0.0 ], 
-                                   [ x_axis[1], y_axis[1], new_axis[1], 0.0 ],
-                                   [ x_axis[2], y_axis[2], new_axis[2], 0.0 ],
-                                   [ 0.0,       0.0,       0.0,         1.0 ] ])
+            rot_matr = self.rotation_frame_from_axis(new_axis)
             
             with self._model_lock:
+                speed_delta = new_speed - float(self._rotation_speed[-1])
                 self._rotation_center = np.vstack((self._rotation_center, new_center))
                 if self._rotation_center.shape[0] > self._max_poses_for_object:
                     self._rotation_center = self._rotation_center[-self._max_poses_for_object:-1,:]
@@ -353,13 +607,20 @@ class Tracker:
                 self.broadcast_tf(rospy.Time.now())
 #                self.broadcast_tf(header.stamp)
             
+                covariances = self.compute_model_covariances(new_centers, new_axii, fit)
+                if self._model_history is not None:
+                    self._model_history.record(rospy.Time.now().to_sec(), new_center, new_axis, new_speed, covariances, len(tracked_objs_copy))
+                self._rate_scheduler.update_model_uncertainty(covariances['center_time_covariance'], covariances['speed_time_std_dev'])
+                
                 if self._rotation_publisher.get_num_connections() > 0:
-                    self.publish_rotation_msg(new_centers, new_axii, new_speeds) 
+                    self.publish_rotation_msg(covariances) 
                 
-            rospy.logdebug("Updated model: center: %s axis: %s speed: %s" % (new_center, new_axis, new_speed))
+            logdebug("Updated model: center: %s axis: %s speed: %s", new_center, new_axis, new_speed)
+            if self._trace.capacity > 0:
+                self._trace.record('model', center=new_center.round(4).tolist(), axis=new_axis.round(4).tolist(), speed=round(new_speed, 5))
             
             # Update already tracked objs to reflect the new model
-            rospy.logdebug("There are %s tracked objects." % len(tracked_objs_copy))
+            logdebug("There are %s tracked objects.", len(tracked_objs_copy))
             for obj in tracked_objs_copy:
                 obj_pose = PoseStamped()
                 obj_pose.header = obj.poses[-1].header
@@ -368,70 +629,252 @@ class Tracker:
                     obj_pose = self._tf_listener.transformPose(self._rotating_tf_frame, obj_pose)
                     obj.radius = math.sqrt(obj_pose.pose.position.x**2 + obj_pose.pose.position.y**2)
                     obj.phase = math.atan2(obj_pose.pose.position.y, obj_pose.pose.position.x)
+                    # the rotating frame changed, move the motion filter to the reprojected pose keeping its rate
+                    if obj.motion_filter is None:
+                        obj.motion_filter = self.new_motion_filter(obj.poses[-1].header.stamp.to_sec(), obj.radius, obj.phase)
+                    else:
+                        obj.motion_filter.rebase(obj.poses[-1].header.stamp.to_sec(), obj.radius, obj.phase, speed_delta)
                 except tf.Exception, e:
                     rospy.logwarn("%s" % e)
                     
-    def init_model_from_object(self, object):
+    def publish_model_update_status(self, tracked_objs, eligible_objs, refitted_objs, deferred_objs, joint_fit, joint_skipped, fit_time, overrun):
+        """ Publish how many objects were fitted again or deferred, and how long it took, in an update of the model. """
+        logdebug("Model update: %d of %d eligible objects fitted, %d deferred, in %s s", refitted_objs, eligible_objs, deferred_objs, fit_time)
+        if overrun:
+            rospy.logwarn("Model update took %s s, over the estimation budget of %s s" % (fit_time, self._refit_scheduler.budget))
+        if self._model_update_publisher is None or self._model_update_publisher.get_num_connections() == 0:
+            return
+        status = ModelUpdateStatus()
+        status.header.stamp = rospy.Time.now()
+        status.header.frame_id = self._base_tf_frame
+        status.tracked_objects = tracked_objs
+        status.eligible_objects = eligible_objs
+        status.refitted_objects = refitted_objs
+        status.reused_objects = eligible_objs - refitted_objs
+        status.deferred_objects = deferred_objs
+        status.joint_fit = joint_fit
+        status.joint_fit_skipped = joint_skipped
+        status.joint_fit_skips = self._refit_scheduler.joint_fit_skips
+        status.fit_time = fit_time
+        status.budget = self._refit_scheduler.budget
+        status.budget_overrun = overrun
+        status.budget_overruns = self._refit_scheduler.overruns
+        status.total_deferred_objects = self._refit_scheduler.deferred
+        self._model_update_publisher.publish(status)
+    
+    def trim_object_history(self, obj):
         """
-        Initializes the rotation model with a rough estimate based only on one object.
+        Reduce the poses of a tracked object to max_poses_for_object.
 
-        Once a single object has been identified in multiple subsequent recognition results, a circle is fit through its poses and some starting rotation parameters
-        are determined in order to track more objects in the future and improve the accuracy.
+        With keyframe_selection enabled and a valid model, the last keyframe_recent_poses poses are kept and the rest of the budget
+        goes to the poses covering the widest arc around the rotation axis (see keyframes.select_keyframes); otherwise only the
+        most recent poses are kept.
+        """
+        if self._keyframe_selection and self._model_valid:
+            with self._model_lock:
+                center = self._rotation_center[-1, :]
+                frame = self._reference_frame[0:3, 0:3]
+            times = [ pose.header.stamp.to_sec() for pose in obj.poses ]
+            angles = rotation_angles([ self.pose_to_array(pose) for pose in obj.poses ], center, frame)
+            recent = max(self._keyframe_recent_poses, self._static_object_window)
+            keyframes = select_keyframes(times, angles, self._max_poses_for_object, recent)
+            if len(obj.stamps) == len(obj.poses):
+                obj.stamps[:] = [ obj.stamps[idx] for idx in keyframes ]
+            obj.poses[:] = [ obj.poses[idx] for idx in keyframes ]
+        else:
+            del obj.poses[:-self._max_poses_for_object]
+        del obj.stamps[:-self._max_poses_for_object]
+    
+    def estimate_joint_rotation(self, objects):
+        """
+        Refine the current rotation model fitting it to the poses of several objects at once.
 
         Args:
-            object: a TrackedObject
+            objects: a list of TrackedObject
 
         Returns:
-            a boolean value indicating whether the model estimation was successful or not
+            the successful JointRotationFit, or None if it failed or does not explain the poses within same_object_threshold
         """
-        request = EstimateRotationRequest()
-        request.poses = object.poses
-        response = EstimateRotationResponse()
-        try:
-            response = self._estimate_rotation_service(request)
-        except rospy.ServiceException, e:
-            rospy.logerr("Error! %s" % e)
-            return False
+        with self._model_lock:
+            center = self._rotation_center[-1, :]
+            axis = self._rotation_axis[-1, :]
+            speed = float(self._rotation_speed[-1])
         
-        rospy.logdebug("Initialization: received a response: %s" % response)
-        if response.success:
-            z_axis = np.array([response.axis.x, response.axis.y, response.axis.z])
-            rotation_center = np.array([response.center.x, response.center.y, response.center.z])
+        times = [ [ pose.header.stamp.to_sec() for pose in obj.poses ] for obj in objects ]
+        positions = [ [ self.pose_to_array(pose) for pose in obj.poses ] for obj in objects ]
+        fit = fit_joint_rotation(times, positions, center, axis, speed)
+        if not fit.success or fit.rms > self._same_object_threshold:
+            rospy.logwarn("The joint rotation fit failed (rms %s), estimating the rotation for each object." % fit.rms)
+            return None
+        
+        logdebug("Joint rotation fit of %d objects: %d iterations, rms %s", len(objects), fit.iterations, fit.rms)
+        return fit
+    
+    def estimate_rotation_for_objects(self, objects):
+        """
+        Estimate independently the rotation parameters from the poses of several objects.
 
-            if np.dot(z_axis, [0.0, 0.0, 1.0]) < 0:
-                z_axis = -z_axis
-                response.speed = -response.speed
-            if z_axis is not [0.0,1.0,0.0] and z_axis is not [0.0, -1.0, 0.0]:
-                x_axis = np.cross(z_axis, [0.0,1.0,0.0])
-            else:
-                x_axis = np.cross(z_axis, [1.0,0.0,0.0])
-                
-            y_axis = np.cross(z_axis, x_axis)
-            rot_matr =  np.array([[x_axis[0], y_axis[0], z_axis[0], 0.0], 
-                                  [x_axis[1], y_axis[1], z_axis[1], 0.0],
-                                  [x_axis[2], y_axis[2], z_axis[2], 0.0],
-                                  [0.0,0.0,0.0,1.0]])
-            
-            
-            # initialize the object
-            object.radius = response.radius
-            obj_pose = self.pose_to_array(object.poses[-1]) - rotation_center
-            obj_x = np.dot(x_axis, obj_pose)
-            obj_y = np.dot(y_axis, obj_pose)
-            object.phase = math.atan2(obj_y, obj_x)
+        When there is more than one object the requests are spread over the pool of persistent service connections opened by start(),
+        one thread per connection, so that up to estimation_connections fits run in parallel if the estimation server has a worker pool.
+        A connection failing a request is reopened and the request is sent once more on it.
 
-            with self._model_lock:
-                self._rotation_center = np.array([rotation_center])
-                self._rotation_axis = np.array([z_axis])
-                self._rotation_speed = np.array([response.speed])
-                self._reference_frame = rot_matr
-                self._initialized = True 
-                self._model_valid = True
-                self._last_tf_broadcast = object.poses[-1].header.stamp.to_sec()   
+        Args:
+            objects: a list of TrackedObject
+
+        Returns:
+            a list containing for each object the successful EstimateRotationResponse or None
+        """
+        responses = [ None ] * len(objects)
+        num_connections = min(len(self._estimation_services), len(objects))
+        
+        def estimate(connection):
+            for idx in range(connection, len(objects), num_connections):
+                request = EstimateRotationRequest()
+                request.poses = objects[idx].poses
+                for attempt in range(2):
+                    try:
+                        response = self._estimation_services[connection](request)
+                        if response.success:
+                            responses[idx] = response
+                        break
+                    except (rospy.ServiceException, rospy.ROSException, socket.error, IOError), e:
+                        rospy.logerr("Error! %s" % e)
+                        # a persistent connection is not reopened after an error
+                        self._estimation_services[connection] = rospy.ServiceProxy("estimate_rotation", EstimateRotation, True)
+                        if rospy.is_shutdown():
+                            return
+        
+        if num_connections <= 1:
+            if num_connections == 1:
+                estimate(0)
+            return responses
+        
+        threads = [ threading.Thread(target=estimate, args=(connection,)) for connection in range(num_connections) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        return responses
+    
+    def rotation_frame_from_axis(self, z_axis):
+        """ Build the 4x4 matrix of the rotation center frame, whose z axis is the rotation axis. """
+        if z_axis is not [0.0,1.0,0.0] and z_axis is not [0.0, -1.0, 0.0]:
+            x_axis = np.cross(z_axis, [0.0,1.0,0.0])
+        else:
+            x_axis = np.cross(z_axis, [1.0,0.0,0.0])
             
-            rospy.loginfo("Initialization successful.")
+        y_axis = np.cross(z_axis, x_axis)
+        return np.array([[x_axis[0], y_axis[0], z_axis[0], 0.0], 
+                         [x_axis[1], y_axis[1], z_axis[1], 0.0],
+                         [x_axis[2], y_axis[2], z_axis[2], 0.0],
+                         [0.0,0.0,0.0,1.0]])
+    
+    def rotation_residual(self, center, axis, object):
+        """
+        Measure how well a center and axis of rotation explain the poses of an object.
+
+        Args:
+            center: the center of rotation
+            axis: the (unit) rotation axis
+            object: a TrackedObject
+
+        Returns:
+            the root of the sum of the variances of the distances of the poses from the axis and of their heights along the axis
+        """
+        positions = np.array([ self.pose_to_array(pose) for pose in object.poses ]) - center
+        heights = np.dot(positions, axis)
+        distances = np.sqrt(np.maximum(np.sum(positions**2, axis=1) - heights**2, 0.0))
+        return math.sqrt(np.var(distances) + np.var(heights))
+        
+    def init_model_from_objects(self, objects):
+        """
+        Initializes the rotation model from the objects that have been identified in multiple subsequent recognition results.
+
+        A circle is fit independently through the poses of each object. Each fit is then scored by the number of objects whose 
+        poses it explains within half of same_object_threshold; the best supported fit (the smallest residual breaking ties) 
+        wins and the rotation parameters are averaged over the objects agreeing with it. A mis-associated object rarely explains
+        anything but itself, hence it cannot seed the model if better candidates exist.
+
+        Args:
+            objects: a list of TrackedObject
+
+        Returns:
+            the list of the objects consistent with the new model, empty if the model estimation was not successful
+        """
+        responses = self.estimate_rotation_for_objects(objects)
+        fits = []
+        for obj, response in zip(objects, responses):
+            if response is None:
+                continue
+            rospy.logdebug("Initialization: received a response: %s" % response)
+            axis = np.array([response.axis.x, response.axis.y, response.axis.z])
+            speed = response.speed
+            if np.dot(axis, [0.0, 0.0, 1.0]) < 0:
+                axis = -axis
+                speed = -speed
+            fits.append((obj, np.array([response.center.x, response.center.y, response.center.z]), axis, speed))
+        
+        if not fits:
+            return []
+        
+        tolerance = self._same_object_threshold / 2.0
+        residuals = np.array([ [ self.rotation_residual(center, axis, obj) for obj, _, _, _ in fits ] for _, center, axis, _ in fits ])
+        agreements = residuals < tolerance
+        best = min(range(len(fits)), key=lambda idx: (-np.sum(agreements[idx]), np.sum(residuals[idx][agreements[idx]])))
+        if not agreements[best, best]:
+            rospy.loginfo("Initialization: no candidate fits its own poses (best residual %s)." % residuals[best, best])
+            return []
+        
+        consistent_fits = [ fits[idx] for idx in np.flatnonzero(agreements[best]) ]
+        rotation_center = np.mean([ fit[1] for fit in consistent_fits ], axis=0)
+        z_axis = np.mean([ fit[2] for fit in consistent_fits ], axis=0)
+        z_axis /= np.linalg.norm(z_axis)
+        speed = np.mean([ fit[3] for fit in consistent_fits ])
+        rot_matr = self.rotation_frame_from_axis(z_axis)
+        rospy.loginfo("Initialization: %d of %d candidates agree on the model." % (len(consistent_fits), len(objects)))
+        
+        # initialize the objects
+        consistent_objects = []
+        for obj, _, _, _ in consistent_fits:
+            obj_pose = self.pose_to_array(obj.poses[-1]) - rotation_center
+            obj_x = np.dot(rot_matr[0:3, 0], obj_pose)
+            obj_y = np.dot(rot_matr[0:3, 1], obj_pose)
+            obj.radius = math.sqrt(obj_x**2 + obj_y**2)
+            obj.phase = math.atan2(obj_y, obj_x)
+            obj.motion_filter = self.new_motion_filter(obj.poses[-1].header.stamp.to_sec(), obj.radius, obj.phase)
+            consistent_objects.append(obj)
+
+        with self._model_lock:
+            self._rotation_center = np.array([rotation_center])
+            self._rotation_axis = np.array([z_axis])
+            self._rotation_speed = np.array([speed])
+            self._reference_frame = rot_matr
+            self._initialized = True 
+            self._model_valid = True
+            self._last_tf_broadcast = max(obj.poses[-1].header.stamp.to_sec() for obj in consistent_objects)
+        
+        rospy.loginfo("Initialization successful.")
             
-        return response.success
+        return consistent_objects
+    
+    def identities_compatible(self, detection_id, detection_db, track_id, track_db):
+        """ Return True if a detection can be associated with a track: same id and db, or either of them a point cloud cluster. """
+        return (detection_id == track_id and detection_db == track_db) or detection_db == CLUSTER_DB or track_db == CLUSTER_DB
+    
+    def adopt_identity(self, track, detection):
+        """
+        Give a track started from point cloud clusters the identity of the recognized object associated with it.
+
+        Returns:
+            True if the identity of the track changed
+        """
+        if track.db != CLUSTER_DB or detection.id.db == CLUSTER_DB:
+            return False
+        track.id = detection.id.id
+        track.db = detection.id.db
+        track.confidence = detection.confidence
+        return True
     
     def find_closest_object_from_list(self, object, object_list, max_dist = sys.float_info.max):
         """
@@ -490,8 +933,8 @@ class Tracker:
         The behavior during initialization phase.
 
         Since a rotation model has not yet been estimated, a simple tracking mechanism in which objects from different recognition results are
-        considered the same object if they are close enough is used. When a certain minimum number of poses for a single object have been found, the estimation
-        of the rotation model is attempted. If the estimation is successful the internal tracker state is set to initialized and the subsequent behavior is different 
+        considered the same object if they are close enough is used. When a certain minimum number of poses has been found for one or more objects, the estimation
+        of the rotation model is attempted using all of them together (see init_model_from_objects). If the estimation is successful the internal tracker state is set to initialized and the subsequent behavior is different 
         (tracking_phase_behavior).
 
         Args:
@@ -504,18 +947,19 @@ class Tracker:
         with self._model_lock:
             tracked_objs_copy = copy(self._tracked_objects)
           
-        # categorization based only on the id, not the db, fixme    
         for obj in data.objects:
-            if obj.id.id in categorized_detection_result:
-                categorized_detection_result[obj.id.id].append(obj)
+            key = (obj.id.db, obj.id.id)
+            if key in categorized_detection_result:
+                categorized_detection_result[key].append(obj)
             else:
-                categorized_detection_result[obj.id.id] = [obj]
+                categorized_detection_result[key] = [obj]
         
+        candidates = []
         for objects in categorized_detection_result.itervalues():
             if objects:
                 potential_objs = []
                 for tracked_obj in tracked_objs_copy:
-                    if tracked_obj.id == objects[0].id.id and tracked_obj.db == objects[0].id.db:
+                    if self.identities_compatible(objects[0].id.id, objects[0].id.db, tracked_obj.id, tracked_obj.db):
                         potential_objs.append(tracked_obj)
                 
                 for object in objects:
@@ -529,7 +973,8 @@ class Tracker:
                         obj_to_append.confidence = object.confidence
                         obj_to_append.poses = [ object.pose ]
                         obj_to_append.stamps = [ object.header.stamp ]
-                        obj_to_append.recognized_object = deepcopy(object)
+                        if self._keep_object_payload:
+                            obj_to_append.source_object = object
                         
                         tracked_objs_copy.add(obj_to_append)
                         # nothing else can be done for this obj...
@@ -540,41 +985,39 @@ class Tracker:
                         # add current pose to the tracked obj
                         # remove the closest object from the potential list
                         potential_objs.remove(closest_potential_obj)
+                        if self.adopt_identity(closest_potential_obj, object) and self._keep_object_payload:
+                            closest_potential_obj.source_object = object
                         closest_potential_obj.poses.append(object.pose)
+                        closest_potential_obj.stamps.append(object.header.stamp)
                         
                         if len(closest_potential_obj.poses) > self._min_poses_for_estimation:
-                            rospy.loginfo("Object %s [%s]: I have %d poses now. Estimating model." % (closest_potential_obj.id, closest_potential_obj.db, len(closest_potential_obj.poses)))
-                            if self.init_model_from_object(closest_potential_obj):
-                                # setup ids
-                                closest_potential_obj.progressive_id = self._progressive_id
-                                
-                                #change the coordinates of the object according to the new reference frame
-                                closest_potential_obj.recognized_object.header.frame_id = self.tf_frame_for_object(closest_potential_obj)
-                                #closest_potential_obj.recognized_object.header.stamp = now
-                                closest_potential_obj.recognized_object.pose.header = closest_potential_obj.recognized_object.header
-                                closest_potential_obj.recognized_object.pose.pose.pose.position.x = 0.0
-                                closest_potential_obj.recognized_object.pose.pose.pose.position.y = 0.0
-                                closest_potential_obj.recognized_object.pose.pose.pose.position.z = 0.0
-                                closest_potential_obj.recognized_object.pose.pose.pose.orientation.x = 0.0
-                                closest_potential_obj.recognized_object.pose.pose.pose.orientation.y = 0.0
-                                closest_potential_obj.recognized_object.pose.pose.pose.orientation.z = 0.0
-                                closest_potential_obj.recognized_object.pose.pose.pose.orientation.w = 1.0
-                                
-                                self._progressive_id += 1
-                                tracked_objs_copy.clear() 
-                                tracked_objs_copy.add(closest_potential_obj)                                   
-                                with self._model_lock:
-                                    self._tracked_objects = tracked_objs_copy 
-                                # if the model got initialized return now
-                                return                                        
+                            candidates.append(closest_potential_obj)
 #                else:
 #                    rospy.loginfo("More than 1 object with id = %s, ambiguous initialization." % id)
 #                    # TODO, add behavior
+        
+        # fit every candidate of this recognition result at once
+        if candidates:
+            rospy.loginfo("%d objects have enough poses now. Estimating model." % len(candidates))
+            consistent_objects = self.init_model_from_objects(candidates)
+            if consistent_objects:
+                tracked_objs_copy.clear() 
+                for obj in consistent_objects:
+                    # setup ids
+                    obj.progressive_id = self._progressive_id
+                    self._progressive_id += 1
+                    #change the coordinates of the object according to the new reference frame
+                    obj.recognized_object = self.rotating_recognized_object(obj)
+                    tracked_objs_copy.add(obj)
+                with self._model_lock:
+                    self._tracked_objects = tracked_objs_copy 
+                # if the model got initialized return now
+                return                                        
                 
         with self._model_lock:
             self._tracked_objects = tracked_objs_copy
                 
-    def tracking_phase_behavior(self, data):
+    def tracking_phase_behavior(self, data, update_model=True):
         """
         The behavior during the tracking phase.
 
@@ -583,6 +1026,7 @@ class Tracker:
 
         Args:
             data: a RecognizedObjectArray containing the results of the object detection
+            update_model: if False the rotation model is not updated and nothing is published, e.g. for all but the last frame of a batch
         """
         #standard tracking
         new_tracked_objects = set()
@@ -591,6 +1035,7 @@ class Tracker:
         with self._model_lock:
             tracked_objs_copy = copy(self._tracked_objects)
         
+        detections = []
         for obj in data.objects:
             pose = PoseStamped()
             pose.header = obj.header
@@ -604,26 +1049,35 @@ class Tracker:
                             
             radius = math.sqrt(pose.pose.position.x**2 + pose.pose.position.y**2)
             phase = math.atan2(pose.pose.position.y, pose.pose.position.x)
-            rospy.logdebug("Radius: %s Phase: %s" % (radius, phase))
-            closest_obj = None
-            min_dist = self._same_object_threshold #sys.float_info.max
-            for tracked_obj in tracked_objs_copy:
-                if tracked_obj.id == obj.id.id and tracked_obj.db == obj.id.db:
-                    polar_dist = self.polar_dist(radius, phase, tracked_obj.radius, tracked_obj.phase)
-                    l2_dist = self.l2_dist(obj.pose, tracked_obj.poses[-1])
-
-                    rospy.logdebug("Polar Dist == %s ; L2 Dist = %s" % (polar_dist, l2_dist))
-                    if polar_dist < min_dist:
-                        min_dist = polar_dist
-                        closest_obj = tracked_obj
-                    #elif l2_dist < min_dist:
-                    #  min_dist = l2_dist
-                    #  closest_obj = tracked_obj
-                        
-            if closest_obj is not None:
+            detections.append((obj, radius, phase))
+        
+        tracks = list(tracked_objs_copy)
+        matches = self.associate_detections(detections, tracks)
+        self.record_roi_result(tracks, set(matches.itervalues()))
+        
+        if self._resume_frames_left > 0:
+            if not self._reacquiring:
+                self._resume_detections += len(detections)
+                self._resume_matches += len([ track_idx for track_idx in matches.itervalues() if tracks[track_idx].restored ])
+            elif tracks:
+                # the first detections after the loss only start the new tracks
+                self._resume_detections += len(detections)
+                self._resume_matches += len(matches)
+        
+        for det_idx, (obj, radius, phase) in enumerate(detections):
+            if det_idx in matches:
+                closest_obj = tracks[matches[det_idx]]
+                if self.adopt_identity(closest_obj, obj):
+                    closest_obj.source_object = obj
+                    closest_obj.recognized_object = self.rotating_recognized_object(closest_obj)
+                    closest_obj.marker = None
                 # add the current pose
                 closest_obj.poses.append(obj.pose)
                 closest_obj.stamps.append(obj.header.stamp)
+                if closest_obj.motion_filter is None:
+                    closest_obj.motion_filter = self.new_motion_filter(obj.header.stamp.to_sec(), radius, phase)
+                else:
+                    closest_obj.motion_filter.update(obj.header.stamp.to_sec(), radius, phase)
                 # remove the object from the tracking set
                 # put it into the new set
                 new_tracked_objects.add(closest_obj)
@@ -640,27 +1094,18 @@ class Tracker:
                 tracked_object.radius = radius
                 tracked_object.poses = [obj.pose]
                 tracked_object.stamps = [obj.header.stamp]
-                tracked_object.recognized_object = deepcopy(obj)
-                
-                # change coordinates according to the rotation frame
-                tracked_object.recognized_object.header.frame_id = self.tf_frame_for_object(tracked_object)
-                #tracked_object.recognized_object.header.stamp = now
-                tracked_object.recognized_object.pose.header = tracked_object.recognized_object.header
-                tracked_object.recognized_object.pose.pose.pose.position.x = 0.0
-                tracked_object.recognized_object.pose.pose.pose.position.y = 0.0
-                tracked_object.recognized_object.pose.pose.pose.position.z = 0.0
-                tracked_object.recognized_object.pose.pose.pose.orientation.x = 0.0
-                tracked_object.recognized_object.pose.pose.pose.orientation.y = 0.0
-                tracked_object.recognized_object.pose.pose.pose.orientation.z = 0.0
-                tracked_object.recognized_object.pose.pose.pose.orientation.w = 1.0
                 
 #                 if there is already an object in that position don't add the new one 
                 if (self.find_closest_object_from_list_polar(tracked_object, tracked_objs_copy, self._same_object_threshold) is None and
                         self.find_closest_object_from_list_polar(tracked_object, new_tracked_objects, self._same_object_threshold) is None):                    
+                    tracked_object.source_object = obj
+                    tracked_object.motion_filter = self.new_motion_filter(obj.header.stamp.to_sec(), radius, phase)
+                    # change coordinates according to the rotation frame
+                    tracked_object.recognized_object = self.rotating_recognized_object(tracked_object)
                     new_tracked_objects.add(tracked_object)
                     self._progressive_id += 1
                 else:
-                    rospy.logdebug("Skipping object insertion for object %s" % tracked_object.id)                    
+                    logdebug("Skipping object insertion for object %s", tracked_object.id)                    
                      
         # add back the new list to the old list
         tracked_objs_copy |= new_tracked_objects
@@ -668,6 +1113,9 @@ class Tracker:
         with self._model_lock:
             self._tracked_objects = tracked_objs_copy
         
+        if not update_model:
+            return
+        
         # update motion model...  
         self.update_model(data.header)
         
@@ -677,6 +1125,90 @@ class Tracker:
         if self._rotating_objects_publisher.get_num_connections() > 0:
             self.publish_rotating_objects()
             
+    def record_roi_result(self, tracks, matched_tracks):
+        """
+        Record in the predicted ROI how many of the tracked objects expected in view were detected in a recognition result.
+
+        Only the tracks with min_poses_for_tracking poses are expected, so spurious detections never count as missed. A track
+        missed in predictive_roi_max_misses consecutive results is no longer expected, being likely occluded by other objects
+        or gone, until it is detected again.
+
+        Args:
+            tracks: the list of the tracked objects
+            matched_tracks: the set of the indices of the tracks matched by a detection
+        """
+        expected_objs = 0
+        detected_objs = 0
+        for track_idx, obj in enumerate(tracks):
+            if len(obj.poses) < self._min_poses_to_consider_an_object:
+                continue
+            if track_idx in matched_tracks:
+                obj.missed_results = 0
+                expected_objs += 1
+                detected_objs += 1
+            else:
+                if obj.missed_results < self._predictive_roi.max_misses:
+                    expected_objs += 1
+                obj.missed_results += 1
+        self._predictive_roi.record(expected_objs, detected_objs)
+    
+    def associate_detections(self, detections, tracks):
+        """
+        Associate the detections of a recognition result with the tracked objects.
+
+        The position of each track is predicted by its motion filter at the time of each detection, then a single global
+        assignment is solved for the whole frame using the polar distance as cost. Only detections and tracks with the same
+        id and db can be paired and pairs farther than same_object_threshold are never matched.
+
+        Args:
+            detections: a list of (RecognizedObject, radius, phase) tuples, the coordinates expressed wrt. the rotating frame
+            tracks: a list of TrackedObject
+
+        Returns:
+            a dictionary mapping the index of each associated detection to the index of its track
+        """
+        if not detections or not tracks:
+            return {}
+        
+        det_radius = np.array([ det[1] for det in detections ])
+        det_phase = np.array([ det[2] for det in detections ])
+        det_stamp = np.array([ det[0].header.stamp.to_sec() for det in detections ])
+        
+        track_radius = np.empty(len(tracks))
+        track_phase = np.empty(len(tracks))
+        track_omega = np.zeros(len(tracks))
+        track_stamp = np.zeros(len(tracks))
+        for idx, track in enumerate(tracks):
+            if track.motion_filter is None:
+                track_radius[idx] = track.radius
+                track_phase[idx] = track.phase
+            else:
+                track_radius[idx] = track.motion_filter.radius
+                track_phase[idx] = track.motion_filter.phase
+                track_omega[idx] = track.motion_filter.omega
+                track_stamp[idx] = track.motion_filter.stamp
+        
+        # predicted phase of every track at the time of every detection
+        dt = np.maximum(det_stamp[:, None] - track_stamp[None, :], 0.0)
+        predicted_phase = track_phase[None, :] + track_omega[None, :] * dt
+        cost = polar_dist_matrix(det_radius[:, None], det_phase[:, None], track_radius[None, :], predicted_phase)
+        
+        # only objects with the same id and db can be associated, the point cloud clusters with any object
+        key_codes = dict()
+        det_codes = np.array([ key_codes.setdefault((det[0].id.id, det[0].id.db), len(key_codes)) for det in detections ])
+        track_codes = np.array([ key_codes.get((track.id, track.db), -1) for track in tracks ])
+        det_clusters = np.array([ det[0].id.db == CLUSTER_DB for det in detections ])
+        track_clusters = np.array([ track.db == CLUSTER_DB for track in tracks ])
+        compatible = (det_codes[:, None] == track_codes[None, :]) | det_clusters[:, None] | track_clusters[None, :]
+        cost[~compatible] = np.inf
+        
+        matches = dict(gated_assignment(cost, self._same_object_threshold))
+        if self._trace.capacity > 0:
+            self._trace.record('association', stamp=float(det_stamp.max()), detections=len(detections), tracks=len(tracks),
+                               matches=[ (det_idx, tracks[track_idx].progressive_id, round(cost[det_idx, track_idx], 4)) 
+                                         for det_idx, track_idx in sorted(matches.iteritems()) ])
+        return matches
+            
     def remove_static_objects(self):
         """
         Remove static objects from the tracked objects set.
@@ -700,14 +1232,14 @@ class Tracker:
                 prev_pose = pose
                
             if obj_movement < self._static_object_threshold:
-                rospy.logdebug("Removing %s at position %s since it's not moving." % (obj.id, prev_pose))
+                logdebug("Removing %s at position %s since it's not moving.", obj.id, prev_pose)
                 objs_to_remove.add(obj)
             
         with self._model_lock:
             self._tracked_objects -= objs_to_remove                       
     
         
-    def recognized_object_callback(self, data):
+    def recognized_object_callback(self, data, update_model=True):
         """
         The callback for the object recognition.
 
@@ -715,13 +1247,19 @@ class Tracker:
         1 - Objects older than a configurable amount of time are removed from the tracked objects set.
         2 - If necessary the input object poses are converted into an user specificable reference frame 
             (as an example to account for movements of the robot using the base_link frame)
-        3 - Static objects are removed.
-        4 - If the algorithm has lost track of each object a re-initialization is performed.
+        3 - Objects outside the Region of Interest and static objects are removed, duplicate detections are merged.
+        4 - If the algorithm has lost track of each object the objects are re-acquired using the current model (see start_reacquisition),
+            or a re-initialization is performed.
         5 - If not initialized perform the initialization_phase_behavior else perform the tracking_phase_behavior.
 
         Args:
             data: a RecognizedObjectArray containing the object detection results
+            update_model: if False the rotation model is not updated and nothing is published, e.g. for all but the last frame of a batch
         """
+        # record the detections before they get transformed
+        if self._detection_log is not None:
+            self._detection_log.record(data)
+            
         #remove old objects
         with self._model_lock:
             time = rospy.Time.now().to_sec()
@@ -731,11 +1269,18 @@ class Tracker:
             self._ork_camera_frame = data.header.frame_id
         
         if not data.objects:
+            self.record_roi_result(list(self._tracked_objects), set())
             return
         
         if self._base_tf_frame == "":
             self._base_tf_frame = data.header.frame_id
-        elif self._base_tf_frame != data.header.frame_id:
+            
+        # drop the objects outside the ROI before doing anything else with them
+        self.roi_prefilter(data)
+        if not data.objects:
+            return
+        
+        if self._base_tf_frame != data.header.frame_id:
             # Transform all poses into the correct RF
             for obj in data.objects:
                 pose = PoseStamped()
@@ -749,6 +1294,9 @@ class Tracker:
                 except tf.Exception, e:
                     rospy.logerr(e)
                     return
+        
+        # merge the multiple detections of the same object
+        self.merge_duplicate_detections(data)
                 
         # remove static objects from the tracking set
         self.remove_static_objects()
@@ -758,19 +1306,247 @@ class Tracker:
             with self._model_lock:
                 reinit = True
                 for obj in self._tracked_objects:
-                    if len(obj.poses) > self._min_poses_to_consider_an_object:
+                    # the restored tracks confirmed by the validation count as tracked until they have enough poses
+                    if len(obj.poses) > self._min_poses_to_consider_an_object or obj.restored:
                         reinit = False
                         break
                     
-                if reinit:
-                    rospy.logdebug("Lost track of every object, re-initializing....")
-                    self._initialized = False
+                # the tracks restored from a checkpoint or re-acquired are validated separately
+                if reinit and self._resume_frames_left == 0:
+                    if self._model_valid and self._reacquisition_frames > 0:
+                        self.start_reacquisition()
+                    else:
+                        rospy.logdebug("Lost track of every object, re-initializing....")
+                        self._initialized = False
                 
         if not self._initialized:
             self.initialization_phase_behavior(data)
         else:
-            self.tracking_phase_behavior(data)
+            self.tracking_phase_behavior(data, update_model)
+            if self._resume_frames_left > 0:
+                self.validate_restored_model()
+                
+        if self._shared_state is not None and update_model:
+            self.export_shared_state()
+            
+    def save_checkpoint(self, event):
+        """ A callback used by a timer to save the rotation model and the tracked objects to the checkpoint file. """
+        if not self._model_valid or self._resume_frames_left > 0:
+            return
+        
+        with self._model_lock:
+            tracked_objs = [ obj for obj in self._tracked_objects if len(obj.poses) >= self._min_poses_to_consider_an_object ]
+            state = dict(stamp=rospy.Time.now().to_sec(),
+                         base_frame=self._base_tf_frame,
+                         intermediate_frame=self._intermediate_tf_frame,
+                         rotating_frame=self._rotating_tf_frame,
+                         rotation_center=self._rotation_center,
+                         rotation_axis=self._rotation_axis,
+                         rotation_speed=np.ravel(self._rotation_speed),
+                         reference_frame=self._reference_frame,
+                         previous_angle=self._previous_angle,
+                         last_tf_broadcast=self._last_tf_broadcast,
+                         progressive_id=self._progressive_id,
+                         object_ids=[ obj.id for obj in tracked_objs ],
+                         object_dbs=[ obj.db for obj in tracked_objs ],
+                         object_progressive_ids=[ obj.progressive_id for obj in tracked_objs ],
+                         object_confidences=[ obj.confidence for obj in tracked_objs ],
+                         object_radii=[ obj.radius for obj in tracked_objs ],
+                         object_phases=[ obj.phase for obj in tracked_objs ])
+        
+        try:
+            save_checkpoint(self._checkpoint_file, **state)
+        except (IOError, OSError), e:
+            rospy.logwarn("Unable to write the checkpoint: %s" % e)
             
+    def restore_checkpoint(self):
+        """
+        Restore the rotation model and the tracked objects from the checkpoint file.
+
+        The checkpoint is used only if it was written for the same TF frames and is recent enough. The tracker then starts
+        directly in the tracking phase, each restored object placed where the model predicts it to be now; the restored model
+        is validated against the next detections (see validate_restored_model).
+
+        Returns:
+            a boolean value indicating whether the checkpoint was restored
+        """
+        checkpoint = load_checkpoint(self._checkpoint_file)
+        if checkpoint is None:
+            return False
+        
+        now = rospy.Time.now()
+        if (str(checkpoint['base_frame']) != self._base_tf_frame or 
+                str(checkpoint['intermediate_frame']) != self._intermediate_tf_frame or 
+                str(checkpoint['rotating_frame']) != self._rotating_tf_frame):
+            rospy.loginfo("Ignoring the checkpoint, it refers to different TF frames.")
+            return False
+        if now.to_sec() - float(checkpoint['stamp']) > self._checkpoint_max_age:
+            rospy.loginfo("Ignoring the checkpoint, it is too old.")
+            return False
+        
+        rotation_speed = checkpoint['rotation_speed'].reshape(-1, 1)
+        reference_frame = checkpoint['reference_frame']
+        rotation_center = checkpoint['rotation_center']
+        previous_angle = float(checkpoint['previous_angle'])
+        last_tf_broadcast = float(checkpoint['last_tf_broadcast'])
+        
+        # where the rotating frame is now
+        angle = float(rotation_speed[-1]) * (now.to_sec() - last_tf_broadcast) + previous_angle
+        rotation = np.dot(reference_frame[0:3, 0:3], tf.transformations.rotation_matrix(angle, [0.0, 0.0, 1.0])[0:3, 0:3])
+        
+        tracked_objs = set()
+        for idx in range(len(checkpoint['object_ids'])):
+            obj = TrackedObject()
+            obj.id = str(checkpoint['object_ids'][idx])
+            obj.db = str(checkpoint['object_dbs'][idx])
+            obj.progressive_id = int(checkpoint['object_progressive_ids'][idx])
+            obj.confidence = float(checkpoint['object_confidences'][idx])
+            obj.radius = float(checkpoint['object_radii'][idx])
+            obj.phase = float(checkpoint['object_phases'][idx])
+            obj.restored = True
+            
+            position = rotation_center[-1, :] + np.dot(rotation, [ obj.radius * math.cos(obj.phase), obj.radius * math.sin(obj.phase), 0.0 ])
+            pose = PoseWithCovarianceStamped()
+            pose.header.frame_id = self._base_tf_frame
+            pose.header.stamp = now
+            pose.pose.pose.position.x = position[0]
+            pose.pose.pose.position.y = position[1]
+            pose.pose.pose.position.z = position[2]
+            pose.pose.pose.orientation.w = 1.0
+            obj.poses = [ pose ]
+            obj.stamps = [ now ]
+            obj.motion_filter = self.new_motion_filter(now.to_sec(), obj.radius, obj.phase)
+            obj.recognized_object = self.rotating_recognized_object(obj)
+            tracked_objs.add(obj)
+        
+        with self._model_lock:
+            self._rotation_center = rotation_center
+            self._rotation_axis = checkpoint['rotation_axis']
+            self._rotation_speed = rotation_speed
+            self._reference_frame = reference_frame
+            self._previous_angle = previous_angle
+            self._last_tf_broadcast = last_tf_broadcast
+            self._progressive_id = max(self._progressive_id, int(checkpoint['progressive_id']))
+            self._tracked_objects = tracked_objs
+            self._initialized = True
+            self._model_valid = True
+            self._resume_frames_left = self._checkpoint_validation_frames
+            self._reacquiring = False
+            self._resume_detections = 0
+            self._resume_matches = 0
+            
+        rospy.loginfo("Restored the rotation model and %d objects from %s." % (len(tracked_objs), self._checkpoint_file))
+        return True
+    
+    def start_reacquisition(self):
+        """
+        Start re-acquiring the objects after losing track of all of them, keeping the current rotation model.
+
+        The detections keep being tracked in polar coordinates wrt. the model, so the objects are tracked again as soon as they
+        are detected; the model is then validated as a restored one (see validate_restored_model) over reacquisition_frames
+        recognition results. Called with the model lock held.
+        """
+        rospy.logdebug("Lost track of every object, re-acquiring them with the current model....")
+        self._reacquiring = True
+        self._resume_frames_left = self._reacquisition_frames
+        self._resume_detections = 0
+        self._resume_matches = 0
+    
+    def validate_restored_model(self):
+        """
+        Check the model restored from a checkpoint, or kept to re-acquire the objects, against the detections.
+
+        After checkpoint_validation_frames (reacquisition_frames) recognition results, at least half of the detections must have
+        been associated with a restored object (with any object already tracked), otherwise the model is discarded and a full
+        initialization is performed. While the objects are re-acquired a static turntable, or one rotating as the model predicts,
+        keeps the detections in place in the rotating frame; a changed rotation scatters them into new tracks.
+        When the model is confirmed the restored objects detected during the validation are considered tracked even with fewer
+        than min_poses_for_tracking poses, the others are not.
+        """
+        if self._reacquiring and self._resume_detections == 0:
+            # nothing to validate until the objects are tracked again
+            return
+        self._resume_frames_left -= 1
+        if self._resume_frames_left > 0:
+            return
+        
+        source = "kept" if self._reacquiring else "restored"
+        self._reacquiring = False
+        if self._resume_detections > 0 and self._resume_matches * 2 >= self._resume_detections:
+            rospy.loginfo("The %s model matches the detections (%d of %d)." % (source, self._resume_matches, self._resume_detections))
+            with self._model_lock:
+                for obj in self._tracked_objects:
+                    # a restored object never detected only has the pose predicted by the checkpoint
+                    if obj.restored and len(obj.poses) <= 1:
+                        obj.restored = False
+            return
+        
+        rospy.logwarn("The %s model does not match the detections (%d of %d), re-initializing...." % (source, self._resume_matches, self._resume_detections))
+        with self._model_lock:
+            self._tracked_objects = set()
+            self._initialized = False
+            self._model_valid = False
+            
+    def start_checkpoint_timer(self):
+        """ (Re)start the timer saving the checkpoint, if a checkpoint file is configured. """
+        with self._timer_lock:
+            if self._checkpoint_timer is not None:
+                self._checkpoint_timer.shutdown()
+                self._checkpoint_timer = None
+            if self._checkpoint_file != "":
+                self._checkpoint_timer = rospy.Timer(rospy.Duration(self._checkpoint_interval), self.save_checkpoint)
+    
+    def open_detection_log(self, directory):
+        """ Close the current detection log, if any, and start logging the detections in a new directory (empty to disable). """
+        if self._detection_log is not None:
+            self._detection_log.close()
+            self._detection_log = None
+        self._detection_log_dir = directory
+        if directory != "":
+            try:
+                self._detection_log = DetectionLogWriter(directory)
+            except (IOError, OSError), e:
+                rospy.logerr("Unable to open the detection log: %s" % e)
+    
+    def open_model_history(self, path):
+        """ Close the current model history, if any, and start recording the updates of the model in a new file (empty to disable). """
+        if self._model_history is not None:
+            self._model_history.close()
+            self._model_history = None
+        self._model_history_file = path
+        if path != "":
+            try:
+                self._model_history = ModelHistoryWriter(path)
+            except (IOError, OSError), e:
+                rospy.logerr("Unable to open the model history: %s" % e)
+    
+    def open_shared_state(self, path):
+        """ Remove the current shared memory segment, if any, and start exporting the state to a new one (empty to disable). """
+        if self._shared_state is not None:
+            self._shared_state.close()
+            self._shared_state = None
+        self._shared_state_file = path
+        if path != "":
+            try:
+                self._shared_state = SharedStateWriter(path)
+            except (IOError, OSError), e:
+                rospy.logerr("Unable to create the shared state segment: %s" % e)
+                
+    def export_shared_state(self):
+        """ Copy the rotation model and the tracked objects to the shared memory segment. """
+        with self._model_lock:
+            model = dict(stamp=rospy.Time.now().to_sec(), model_valid=self._model_valid)
+            if self._model_valid:
+                model.update(center=self._rotation_center[-1, :],
+                             axis=self._rotation_axis[-1, :],
+                             speed=float(self._rotation_speed[-1]),
+                             angle=self._previous_angle,
+                             angle_stamp=self._last_tf_broadcast,
+                             reference_frame=self._reference_frame)
+            objects = [ (obj.progressive_id, obj.id, obj.db, obj.radius, obj.phase, obj.poses[-1].header.stamp.to_sec(), len(obj.poses)) 
+                        for obj in self._tracked_objects if len(obj.poses) >= self._min_poses_to_consider_an_object ]
+            self._shared_state.write(model, objects)
+    
     def pose_to_array(self, pose):
         """ Convert a PoseWithCovarianceStamped into a numpy.array. """
         return np.array([ pose.pose.pose.position.x, 
@@ -785,6 +1561,108 @@ class Tracker:
         """ Compute the Euclidean distance between two PoseWithCovarianceStamped. """
         return np.linalg.norm(self.pose_to_array(pose1) - self.pose_to_array(pose2))
                               
+    def predict_object_poses(self, stamps, objects):
+        """
+        Predict the poses of the tracked objects using the current rotation model.
+
+        The lock on the model should have been acquired outside.
+
+        Args:
+            stamps: an array of T times (s)
+            objects: a list of N TrackedObject
+
+        Returns:
+            positions: a TxNx3 array containing the positions in the fixed frame
+            orientations: a Tx4 array containing the quaternions of the rotating frame (shared by every object frame)
+        """
+        angles = self._previous_angle + float(self._rotation_speed[-1]) * (stamps - self._last_tf_broadcast)
+        radii = np.array([ obj.radius for obj in objects ])
+        phases = np.array([ obj.phase for obj in objects ])
+        
+        object_angles = angles[:, None] + phases[None, :]
+        local_positions = np.zeros((len(stamps), len(objects), 3))
+        local_positions[:, :, 0] = radii * np.cos(object_angles)
+        local_positions[:, :, 1] = radii * np.sin(object_angles)
+        positions = self._rotation_center[-1, :] + np.dot(local_positions, self._reference_frame[0:3, 0:3].T)
+        
+        # quaternion product between the rotation center frame and a rotation about its z axis
+        qx, qy, qz, qw = tf.transformations.quaternion_from_matrix(self._reference_frame)
+        sin_half = np.sin(angles / 2.0)
+        cos_half = np.cos(angles / 2.0)
+        orientations = np.column_stack((qx * cos_half + qy * sin_half, 
+                                        qy * cos_half - qx * sin_half,
+                                        qz * cos_half + qw * sin_half,
+                                        qw * cos_half - qz * sin_half))
+        
+        return positions, orientations
+    
+    def predict_arrival_times(self, now, objects, arrival_phase):
+        """
+        Predict when each object will next reach a given phase around the rotation axis.
+
+        The lock on the model should have been acquired outside.
+
+        Args:
+            now: the current time (s)
+            objects: a list of N TrackedObject
+            arrival_phase: the phase (rad) measured in the rotation center frame
+
+        Returns:
+            an array of N times (s), NaN where the rotation speed is zero
+        """
+        speed = float(self._rotation_speed[-1])
+        angle = self._previous_angle + speed * (now - self._last_tf_broadcast)
+        phases = np.array([ obj.phase for obj in objects ])
+        if speed == 0.0:
+            return np.nan * phases
+        
+        # the angle still to be covered in the direction of the rotation
+        remaining_angle = np.mod((arrival_phase - angle - phases) * np.sign(speed), 2.0 * math.pi)
+        return now + remaining_angle / abs(speed)
+        
+    def dump_trace_callback(self, req):
+        """ The callback of the dump_trace service: return the latest trace records. """
+        return DumpTraceResponse(self._trace.dump(req.max_records, req.clear))
+    
+    def predict_object_poses_callback(self, req):
+        """ The callback of the predict_object_poses service. """
+        response = PredictObjectPosesResponse()
+        ids = set(req.ids)
+        stamps = np.array([ stamp.to_sec() for stamp in req.stamps ])
+        
+        with self._model_lock:
+            if not self._model_valid:
+                response.success = False
+                return response
+            
+            objects = [ obj for obj in self._tracked_objects 
+                        if len(obj.poses) >= self._min_poses_to_consider_an_object and (not ids or obj.id in ids) ]
+            positions, orientations = self.predict_object_poses(stamps, objects)
+            if req.compute_arrival:
+                arrival_times = self.predict_arrival_times(rospy.Time.now().to_sec(), objects, req.arrival_phase)
+            
+        response.success = True
+        response.ids = [ obj.id for obj in objects ]
+        response.dbs = [ obj.db for obj in objects ]
+        response.frame_ids = [ self.tf_frame_for_object(obj) for obj in objects ]
+        for time_idx, stamp in enumerate(req.stamps):
+            pose_array = PoseArray()
+            pose_array.header.frame_id = self._base_tf_frame
+            pose_array.header.stamp = stamp
+            orientation = orientations[time_idx].tolist()
+            for position in positions[time_idx].tolist():
+                pose = Pose()
+                pose.position.x, pose.position.y, pose.position.z = position
+                pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w = orientation
+                pose_array.poses.append(pose)
+            response.poses.append(pose_array)
+        
+        if req.compute_arrival:
+            response.arrival_stamps = [ rospy.Time(0) if math.isnan(arrival_time) else rospy.Time.from_sec(arrival_time) 
+                                        for arrival_time in arrival_times.tolist() ]
+            
+        return response
+    
     def tf_callback(self, event):
         """ A callback used by a timer to publish TF data. """
         with self._tf_lock:
@@ -794,60 +1672,215 @@ class Tracker:
             with self._model_lock:
                 self.broadcast_tf(event.current_real)
                 
-    def transform_roi_limits(self):
-        """ Transform the limits of the user specified Region of Interest for the object detection from an user specified reference_frame to the camera reference frame (used by ORK). """
-        # Has to be done for all the 8 cube points...
-        # The resulting cube is guaranteed to contain the original cube
+    def cached_transform(self, target_frame, source_frame):
+        """
+        Return the homogeneous matrix transforming points from source_frame to target_frame, using the latest available transform.
+
+        Within transform_refresh_period of the last lookup the cached matrix is returned as it is. Afterwards it is looked up
+        again when TF received a newer transform between the two frames, and always for static transforms, whose stamp does
+        not change when they are corrected, so a corrected static transform is used at most transform_refresh_period later.
+        The same array is returned as long as the transform does not change, so the callers can cache the results derived from it.
+
+        Args:
+            target_frame: the frame to transform the points to
+            source_frame: the frame the points are expressed in
+
+        Returns:
+            a 4x4 numpy array
+
+        Raises:
+            tf.Exception: if the transform is not available
+        """
+        key = (target_frame, source_frame)
+        now = rospy.get_time()
+        cached = self._transform_cache.get(key)
+        if cached is not None and 0.0 <= now - cached[2] < self._transform_refresh_period:
+            return cached[1]
+        
+        stamp = self._tf_listener.getLatestCommonTime(target_frame, source_frame)
+        # a static transform (/tf_static) keeps a zero stamp even when it is republished, so it is always looked up again
+        if cached is not None and cached[0] == stamp and stamp != rospy.Time(0):
+            self._transform_cache[key] = (stamp, cached[1], now)
+            return cached[1]
+        
         header = Header()
-        header.frame_id = self._base_tf_frame
+        header.frame_id = source_frame
         header.stamp = rospy.Time(0)
+        transformation = self._tf_listener.asMatrix(target_frame, header)
+        if cached is not None and np.array_equal(cached[1], transformation):
+            transformation = cached[1]
+        self._transform_cache[key] = (stamp, transformation, now)
+        return transformation
+    
+    def transform_roi_limits(self, target_frame=None):
+        """ 
+        Transform the limits of the user specified Region of Interest for the object detection from an user specified reference_frame to the camera reference frame (used by ORK). 
+
+        The result is cached and computed again only when the limits or the transform between the two frames change.
+
+        Args:
+            target_frame: the frame to transform the limits to, by default the camera frame used by ORK
+        """
+        if target_frame is None:
+            target_frame = self._ork_camera_frame
         
-        points = np.zeros(shape=(8,4))
-                    
         try:
-            transformation = self._tf_listener.asMatrix(self._ork_camera_frame, header)
-            
-            point = np.array([ self._roi_limits[0], self._roi_limits[2], self._roi_limits[4], 1.0 ])      
-            points[0,:] = np.dot(transformation, point)
-            
-            point = np.array([ self._roi_limits[0], self._roi_limits[3], self._roi_limits[4], 1.0 ])           
-            points[1,:] = np.dot(transformation, point)
-            
-            point = np.array([ self._roi_limits[0], self._roi_limits[2], self._roi_limits[5], 1.0 ])           
-            points[2,:] = np.dot(transformation, point)
-            
-            point = np.array([ self._roi_limits[0], self._roi_limits[3], self._roi_limits[5], 1.0 ])           
-            points[3,:] = np.dot(transformation, point)
-            
-            point = np.array([ self._roi_limits[1], self._roi_limits[2], self._roi_limits[4], 1.0 ])           
-            points[4,:] = np.dot(transformation, point)
-            
-            point = np.array([ self._roi_limits[1], self._roi_limits[3], self._roi_limits[4], 1.0 ])           
-            points[5,:] = np.dot(transformation, point)
-            
-            point = np.array([ self._roi_limits[1], self._roi_limits[2], self._roi_limits[5], 1.0 ])           
-            points[6,:] = np.dot(transformation, point)
-            
-            point = np.array([ self._roi_limits[1], self._roi_limits[3], self._roi_limits[5], 1.0 ])           
-            points[7,:] = np.dot(transformation, point)                                             
-            
-            return [ min(points[:,0]), 
-                     max(points[:,0]), 
-                     min(points[:,1]), 
-                     max(points[:,1]),
-                     min(points[:,2]), 
-                     max(points[:,2])]
-            
+            transformation = self.cached_transform(target_frame, self._base_tf_frame)
         except tf.Exception, e:
             rospy.logerr("Error while transforming ROI limits: %s" % e)
             return self._roi_limits
+        
+        roi_limits = tuple(self._roi_limits)
+        cached = self._roi_limits_cache.get(target_frame)
+        if cached is not None and cached[0] is transformation and cached[1] == roi_limits:
+            return list(cached[2])
+        
+        # Has to be done for all the 8 cube points...
+        # The resulting cube is guaranteed to contain the original cube
+        corners = np.ones((8, 4))
+        corners[:, 0:3] = [ (x, y, z) for x in roi_limits[0:2] for y in roi_limits[2:4] for z in roi_limits[4:6] ]
+        points = np.dot(corners, transformation.T)
+        
+        limits = np.empty(6)
+        limits[0::2] = np.amin(points[:, 0:3], axis=0)
+        limits[1::2] = np.amax(points[:, 0:3], axis=0)
+        limits = limits.tolist()
+        self._roi_limits_cache[target_frame] = (transformation, roi_limits, limits)
+        return list(limits)
+    
+    def predicted_roi_limits(self):
+        """
+        Predict the Region of Interest containing the tracked objects, in the camera frame used by ORK (see PredictiveRoi).
+
+        The region is padded by predictive_roi_margin and by the uncertainty of the rotation center, widened at every recognition
+        result missing some tracked objects and clipped to the user specified ROI, if enabled. Axis aligned limits can not exclude
+        the inside of the annulus described by the objects, so the region is the box containing the whole cylinder.
+
+        Returns:
+            the limits of the region, or None if they can not be predicted (no valid model, no tracked objects, objects re-acquired
+            or too many missed recognition results)
+        """
+        if self._base_tf_frame == "" or self._ork_camera_frame == "":
+            return None
+        with self._model_lock:
+            if not self._model_valid or self._resume_frames_left > 0 or not self._tracked_objects:
+                return None
+            center = self._rotation_center[-1, :]
+            axis = self._rotation_axis[-1, :]
+            center_std_dev = math.sqrt(np.sum(np.var(self._rotation_center, axis=0))) if self._rotation_center.shape[0] > 1 else 0.0
+            positions = [ self.pose_to_array(obj.poses[-1]) for obj in self._tracked_objects ]
+        
+        transformation = None
+        if self._base_tf_frame != self._ork_camera_frame:
+            try:
+                transformation = self.cached_transform(self._ork_camera_frame, self._base_tf_frame)
+            except tf.Exception, e:
+                rospy.logerr("Error while predicting the ROI: %s" % e)
+                return None
+        
+        limits = self._predictive_roi.limits(center, axis, positions, center_std_dev, transformation)
+        if limits is not None and self._use_roi:
+            roi_limits = self.transform_roi_limits() if transformation is not None else self._roi_limits
+            limits = intersect_limits(limits, roi_limits)
+        return limits
+    
+    def merge_duplicate_detections(self, data):
+        """
+        Merge the detections of a recognition result lying closer than duplicate_merge_distance into a single detection.
+
+        ORK can detect an object several times in the same result, possibly with different ids. The clusters of close detections
+        (see detection_merge.cluster_detections) are replaced by their most confident detection, moved to the confidence weighted
+        mean of their poses. With the same_db (same_id) mode only the detections with the same db (db and id) are merged.
+
+        Args:
+            data: a RecognizedObjectArray with the poses in the base frame, modified in place
+
+        Returns:
+            the number of objects removed
+        """
+        if self._duplicate_merge_distance <= 0.0 or len(data.objects) < 2:
+            return 0
+        
+        positions = np.array([ (p.x, p.y, p.z) for p in (obj.pose.pose.pose.position for obj in data.objects) ])
+        if self._duplicate_merge_mode == MERGE_ANY:
+            groups = np.zeros(len(data.objects), dtype=int)
+        else:
+            keys = dict()
+            group_keys = [ obj.id.db if self._duplicate_merge_mode == MERGE_SAME_DB else (obj.id.db, obj.id.id) for obj in data.objects ]
+            groups = np.array([ keys.setdefault(key, len(keys)) for key in group_keys ])
+        
+        labels = cluster_detections(positions, groups, self._duplicate_merge_distance)
+        removed = len(data.objects) - len(np.unique(labels))
+        if removed == 0:
+            return 0
+        
+        orientations = np.array([ (q.x, q.y, q.z, q.w) for q in (obj.pose.pose.pose.orientation for obj in data.objects) ])
+        confidences = np.array([ obj.confidence for obj in data.objects ], dtype=float)
+        kept, positions, orientations, confidences = merge_clusters(labels, positions, orientations, confidences)
+        
+        merged_objects = []
+        for idx, position, orientation in zip(kept, positions, orientations):
+            obj = data.objects[idx]
+            obj.pose.pose.pose.position.x, obj.pose.pose.pose.position.y, obj.pose.pose.pose.position.z = position.tolist()
+            (obj.pose.pose.pose.orientation.x, obj.pose.pose.pose.orientation.y, 
+             obj.pose.pose.pose.orientation.z, obj.pose.pose.pose.orientation.w) = orientation.tolist()
+            merged_objects.append(obj)
+        data.objects = merged_objects
+        logdebug("Merged %s duplicate detections.", removed)
+        return removed
+    
+    def roi_prefilter(self, data):
+        """
+        Remove from a recognition result the objects lying outside the Region of Interest.
+
+        ORK may ignore (or loosen, as the limits are transformed to its frame) the ROI sent with the goal: the positions of all
+        the detections are checked against the limits at once, before any per object work is done.
+
+        Args:
+            data: a RecognizedObjectArray, modified in place
+
+        Returns:
+            the number of objects removed
+        """
+        if not self._use_roi or not data.objects:
+            return 0
+        
+        frame_ids = [ obj.header.frame_id or data.header.frame_id for obj in data.objects ]
+        positions = np.ones((len(data.objects), 4))
+        positions[:, 0:3] = [ (p.x, p.y, p.z) for p in (obj.pose.pose.pose.position for obj in data.objects) ]
+        
+        frame_ids_array = np.array(frame_ids)
+        for frame_id in set(frame_ids):
+            if frame_id == self._base_tf_frame:
+                continue
+            try:
+                transformation = self.cached_transform(self._base_tf_frame, frame_id)
+            except tf.Exception, e:
+                # leave the objects alone, the transformation of their poses will fail anyway
+                rospy.logerr("Error while filtering the detections with the ROI: %s" % e)
+                return 0
+            rows = frame_ids_array == frame_id
+            positions[rows] = np.dot(positions[rows], transformation.T)
+        
+        limits = np.array(self._roi_limits)
+        inside = np.all((positions[:, 0:3] >= limits[0::2]) & (positions[:, 0:3] <= limits[1::2]), axis=1)
+        
+        removed = len(data.objects) - int(np.count_nonzero(inside))
+        if removed > 0:
+            data.objects = [ obj for obj, keep in zip(data.objects, inside) if keep ]
+            logdebug("Removed %s objects outside the ROI.", removed)
+        return removed
             
     def detection_timer_callback(self, event):
         """ A callback invoked at an user specified rate that performs the object recognition task and model estimation. """
         with self._detection_lock:
             goal = ObjectRecognitionGoal()
             goal.use_roi = self._use_roi
-            if self._use_roi:
+            predicted_limits = self.predicted_roi_limits() if self._use_predictive_roi else None
+            if predicted_limits is not None:
+                goal.use_roi = True
+                goal.filter_limits = predicted_limits
+            elif self._use_roi:
 #                if False: # look into the roi transofrmation
                 if self._base_tf_frame != "" and self._ork_camera_frame != "" and self._base_tf_frame != self._ork_camera_frame:
                     # transform the limits into the camera frame (since it's the only frame ORK understands)
@@ -859,11 +1892,265 @@ class Tracker:
             
             start_time = rospy.Time.now()
             self._object_detection_client.send_goal_and_wait(goal, rospy.Duration(5.0))
+            detection_latency = (rospy.Time.now() - start_time).to_sec()
             if self._object_detection_client.get_state() == actionlib.GoalStatus.SUCCEEDED:
                 self.recognized_object_callback(self._object_detection_client.get_result().recognized_objects)
                 
-            rospy.logdebug("The detection took %s and returned %s." % ((rospy.Time.now() - start_time).to_sec(), self._object_detection_client.get_state()))
+            rospy.logdebug("The detection took %s and returned %s." % (detection_latency, self._object_detection_client.get_state()))
+            
+            self._rate_scheduler.record_detection_latency(detection_latency)
+            if self._adaptive_rates:
+                self.reschedule_timers()
+            
+    def cloud_callback(self, cloud):
+        """
+        The callback for the point clouds, used in addition to the object recognition.
+
+        The centroids of the objects found in the cloud are processed as a recognition result. Clouds arriving while a 
+        recognition result is being processed are dropped, so that the tracker always works on the latest data.
+        """
+        if not self._detection_lock.acquire(False):
+            return
+        try:
+            if self._use_roi and self._base_tf_frame != "" and self._base_tf_frame != cloud.header.frame_id:
+                self._cloud_frontend.roi_limits = self.transform_roi_limits(cloud.header.frame_id)
+            else:
+                self._cloud_frontend.roi_limits = self._roi_limits if self._use_roi else None
+            
+            try:
+                data = self._cloud_frontend.detect(cloud)
+            except ValueError, e:
+                rospy.logerr("Unable to process the point cloud: %s" % e)
+                return
+            self.recognized_object_callback(data)
+        finally:
+            self._detection_lock.release()
+    
+    def topic_input_enabled(self):
+        """ Return True if the recognition results are received through topics, rather than by polling the object recognition action server. """
+        return self._subscribe_input or self._camera_fusion is not None
+    
+    def enable_topic_input(self, enable):
+        """
+        Switch between polling the object recognition action server and processing the recognition results published on the 
+        recognized_object_array topic.
+
+        The received results go through a bounded FrameQueue, emptied by a dedicated thread.
+        """
+        with self._timer_lock:
+            if enable:
+                self._detection_timer.shutdown()
+            if self._input_subscriber is not None:
+                self._input_subscriber.unregister()
+                self._input_subscriber = None
+        
+        if enable:
+            self._input_subscriber = rospy.Subscriber("recognized_object_array", RecognizedObjectArray, self._input_queue.put, 
+                                                      queue_size=max(self._input_queue.capacity, 1))
+            self.start_input_thread()
+        elif not self.topic_input_enabled():
+            self._input_queue.clear()
+            self.start_detection_timer(self._rate_scheduler.detection_rate() if self._adaptive_rates else self._detection_rate)
+    
+    def enable_camera_fusion(self, topics):
+        """
+        Start (or stop, if topics is empty) fusing the recognition results published by several cameras.
+
+        The results of each camera are preprocessed by a CameraFusion, in the camera worker processes forked by start() if any,
+        and then fed, in timestamp order, to the same input queue used by the recognized_object_array subscription.
+
+        Args:
+            topics: the list of the recognition result topics, one per camera
+        """
+        for subscriber in self._camera_subscribers:
+            subscriber.unregister()
+        self._camera_subscribers = []
+        if self._camera_fusion is not None:
+            self._camera_fusion.close()
+            self._camera_fusion = None
+        
+        if topics:
+            with self._timer_lock:
+                self._detection_timer.shutdown()
+            self._camera_fusion = CameraFusion(len(topics), self._input_queue.put, self._camera_dedup_distance, self._camera_merge_window,
+                                               self._camera_workers)
+            self._camera_subscribers = [ rospy.Subscriber(topic, RecognizedObjectArray, lambda data, camera=camera: self.camera_callback(camera, data), 
+                                                          queue_size=max(self._input_queue.capacity, 1))
+                                         for camera, topic in enumerate(topics) ]
+            self.start_input_thread()
+            rospy.loginfo("Fusing the recognition results of %s" % ", ".join(topics))
+        elif not self.topic_input_enabled():
+            self._input_queue.clear()
+            self.start_detection_timer(self._rate_scheduler.detection_rate() if self._adaptive_rates else self._detection_rate)
+    
+    def camera_callback(self, camera, data):
+        """ The callback for the recognition results of one of the fused cameras: hand them to the camera worker with the transform to the fixed frame. """
+        if self._base_tf_frame == "":
+            self._base_tf_frame = data.header.frame_id
+        
+        if data.header.frame_id == self._base_tf_frame:
+            transformation = np.identity(4)
+        else:
+            try:
+                transformation = self.cached_transform(self._base_tf_frame, data.header.frame_id)
+            except tf.Exception, e:
+                rospy.logerr("Dropping the recognition result of %s: %s" % (data.header.frame_id, e))
+                return
+        
+        fusion = self._camera_fusion
+        if fusion is not None:
+            fusion.submit(camera, data, self._base_tf_frame, transformation, self._roi_limits if self._use_roi else None)
+    
+    def start_input_thread(self):
+        """ Start the thread processing the input queue, unless it is already running. """
+        if self._input_thread is None or not self._input_thread.is_alive():
+            self._input_thread = threading.Thread(target=self.input_loop)
+            self._input_thread.daemon = True
+            self._input_thread.start()
+    
+    def input_loop(self):
+        """ Process the recognition results received through the topics; the ones waiting together are processed as a batch, updating the model once. """
+        while self.topic_input_enabled() and not rospy.is_shutdown():
+            batch = self._input_queue.get(0.5)
+            if batch:
+                with self._detection_lock:
+                    for idx, data in enumerate(batch):
+                        self.recognized_object_callback(data, idx == len(batch) - 1)
+                    if self._adaptive_rates:
+                        self.reschedule_timers()
+            self.publish_input_status()
+    
+    def publish_input_status(self):
+        """ Publish, at most once per second, the statistics of the input queue: received and dropped frames and the time spent in the queue. """
+        now = rospy.Time.now()
+        if self._input_status_publisher is None or now.to_sec() - self._last_input_status < 1.0:
+            return
+        self._last_input_status = now.to_sec()
+        
+        statistics = self._input_queue.statistics()
+        status = TrackerInputStatus()
+        status.header.stamp = now
+        status.received = statistics['received']
+        status.dropped = statistics['dropped']
+        status.processed = statistics['processed']
+        status.batches = statistics['batches']
+        status.queue_depth = statistics['depth']
+        status.mean_queue_latency = statistics['mean_latency']
+        status.max_queue_latency = statistics['max_latency']
+        self._input_status_publisher.publish(status)
+        rospy.logdebug("Input queue: %s" % statistics)
+    
+    def start_detection_timer(self, rate):
+        """ (Re)start the timer invoking the object detection at the given rate (Hz), keeping the time of its next tick within the new period. """
+        with self._timer_lock:
+            self._detection_timer_rate = rate
+            self._detection_timer.start(rate)
+            
+    def start_tf_timer(self, rate):
+        """ (Re)start the timer publishing the TF data at the given rate (Hz), keeping the time of its next tick within the new period. """
+        with self._timer_lock:
+            self._tf_timer_rate = rate
+            self._tf_timer.start(rate)
             
+    def reschedule_timers(self):
+        """
+        Adapt the detection and TF rates to the current state of the rotation model.
+
+        The detection rate decreases as the model estimates become stable in time and is bounded by the measured detection latency,
+        the TF rate follows the rotation speed so that the rotating frame moves by a bounded angle between two broadcasts.
+        The timers are restarted only when the rates change significantly.
+        """
+        if not self._initialized:
+            self._rate_scheduler.reset()
+            
+        detection_rate = self._rate_scheduler.detection_rate()
+        if not self.topic_input_enabled() and self._rate_scheduler.should_reschedule(self._detection_timer_rate, detection_rate):
+            rospy.logdebug("Detection rate: %s Hz" % detection_rate)
+            self.start_detection_timer(detection_rate)
+        
+        if self._model_valid:
+            with self._model_lock:
+                speed = float(self._rotation_speed[-1])
+            tf_rate = self._rate_scheduler.tf_rate(speed)
+        else:
+            tf_rate = self._rate_scheduler.min_tf_rate
+        if self._rate_scheduler.should_reschedule(self._tf_timer_rate, tf_rate):
+            rospy.logdebug("TF rate: %s Hz" % tf_rate)
+            self.start_tf_timer(tf_rate)
+            
+    def reset_tracking(self):
+        """ Forget the rotation model and every tracked object, starting the initialization from scratch. """
+        rospy.loginfo("Resetting the tracker.")
+        with self._model_lock:
+            self._tracked_objects.clear()
+            self._initialized = False
+            self._model_valid = False
+        self._predictive_roi.reset()
+        self._progressive_id = 0
+        self._resume_frames_left = 0
+        self._reacquiring = False
+        
+    def change_frames(self, base_frame, intermediate_frame, rotating_frame):
+        """
+        Change the TF frames of the tracker, preserving the rotation model and the tracked objects.
+
+        The rotation model and the poses of the tracked objects, expressed in the fixed frame, are reprojected into the new
+        fixed frame through a single transform; the radii and phases of the objects do not depend on the frames. If the transform
+        is not available the tracker is reset.
+
+        Args:
+            base_frame: the new fixed frame
+            intermediate_frame: the new frame of the rotation center
+            rotating_frame: the new rotating frame
+        """
+        old_base_frame = self._base_tf_frame
+        transformation = None
+        if old_base_frame != base_frame and old_base_frame != "" and (self._initialized or self._tracked_objects):
+            try:
+                transformation = self.cached_transform(base_frame, old_base_frame)
+            except tf.Exception, e:
+                rospy.logwarn("Cannot reproject the tracker state from %s to %s, resetting: %s" % (old_base_frame, base_frame, e))
+                self._base_tf_frame = base_frame
+                self._intermediate_tf_frame = intermediate_frame
+                self._rotating_tf_frame = rotating_frame
+                self.reset_tracking()
+                return
+        
+        with self._model_lock:
+            self._base_tf_frame = base_frame
+            self._intermediate_tf_frame = intermediate_frame
+            self._rotating_tf_frame = rotating_frame
+            
+            if transformation is not None:
+                rotation = transformation[0:3, 0:3]
+                self._rotation_center = np.dot(self._rotation_center, rotation.T) + transformation[0:3, 3]
+                self._rotation_axis = np.dot(self._rotation_axis, rotation.T)
+                self._reference_frame = np.dot(transformation, self._reference_frame)
+                self._reference_frame[0:3, 3] = 0.0
+                quaternion = tf.transformations.quaternion_from_matrix(transformation)
+                
+                for obj in self._tracked_objects:
+                    for pose in obj.poses:
+                        position = pose.pose.pose.position
+                        orientation = pose.pose.pose.orientation
+                        position.x, position.y, position.z = np.dot(transformation, [position.x, position.y, position.z, 1.0])[0:3].tolist()
+                        (orientation.x, orientation.y, orientation.z, orientation.w) = tf.transformations.quaternion_multiply(
+                            quaternion, [orientation.x, orientation.y, orientation.z, orientation.w]).tolist()
+                        pose.header.frame_id = base_frame
+                    # the cached fit is expressed in the old frame
+                    obj.fit = None
+            
+            # the frames of the objects are named after the rotating frame
+            for obj in self._tracked_objects:
+                recognized_object = copy(obj.recognized_object)
+                recognized_object.header = Header(frame_id=self.tf_frame_for_object(obj))
+                recognized_object.pose = copy(recognized_object.pose)
+                recognized_object.pose.header = recognized_object.header
+                obj.recognized_object = recognized_object
+                obj.marker = None
+        
+        rospy.loginfo("Changed frames to %s, %s, %s preserving %d tracked objects." % (base_frame, intermediate_frame, rotating_frame, len(self._tracked_objects)))
+    
     def set_parameters(self, config):   
         """
         Set the object tracking parameters.
@@ -875,47 +2162,145 @@ class Tracker:
         if not (self._base_tf_frame == config['fixed_frame'] 
                 and self._intermediate_tf_frame == config['rotation_center_frame'] 
                 and self._rotating_tf_frame == config['rotating_frame']):
-            self._base_tf_frame = config['fixed_frame']
-            self._intermediate_tf_frame = config['rotation_center_frame']
-            self._rotating_tf_frame = config['rotating_frame']
-            with self._model_lock:
-                self._tracked_objects.clear()
-            self._initialized = False
-            self._progressive_id = 0
+            with self._detection_lock:
+                self.change_frames(config['fixed_frame'], config['rotation_center_frame'], config['rotating_frame'])
+        
+        # explicit reset, the flag is cleared by dynamic_reconfigure_callback
+        if config['reset_tracking']:
+            with self._detection_lock:
+                self.reset_tracking()
         
         # tracking params
         self._min_poses_to_consider_an_object = config['min_poses_for_tracking']
         self._max_poses_for_object = config['max_poses_for_object']
         self._max_stale_time_for_object = config['max_stale_time']
         self._same_object_threshold = config ['same_object_threshold']
+        self._motion_process_noise = config['motion_process_noise']
+        self._motion_measurement_noise = config['motion_measurement_noise']
+        self._joint_estimation = config['joint_estimation']
+        self._keyframe_selection = config['keyframe_selection']
+        self._keyframe_recent_poses = config['keyframe_recent_poses']
+        self._refit_scheduler.min_new_poses = config['refit_min_new_poses']
+        self._refit_scheduler.max_age = config['refit_max_age']
+        self._refit_scheduler.drift_tolerance = config['refit_drift_tolerance']
+        self._refit_scheduler.budget = config['estimation_budget']
         self._use_roi = config['use_roi']
+        self._transform_refresh_period = config['transform_refresh_period']
+        self._keep_object_payload = config['keep_object_payload']
+        self._skip_unchanged_outputs = config['skip_unchanged_outputs']
+        self._use_predictive_roi = config['predictive_roi']
+        self._predictive_roi.margin = config['predictive_roi_margin']
+        self._predictive_roi.max_misses = config['predictive_roi_max_misses']
         self._roi_limits = [ config['x_min'], config['x_max'],
                              config['y_min'], config['y_max'],
                              config['z_min'], config['z_max'] ]        
         self._static_object_window = config['static_object_detection_window']
         self._static_object_threshold = config['static_object_threshold']
+        self._duplicate_merge_distance = config['duplicate_merge_distance']
+        self._duplicate_merge_mode = config['duplicate_merge_mode']
+        self._trace.resize(config['trace_buffer_size'])
+        
+        # detection log
+        if self._detection_log_dir != config['detection_log_dir']:
+            with self._detection_lock:
+                self.open_detection_log(config['detection_log_dir'])
+        
+        # model history
+        if self._model_history_file != config['model_history_file']:
+            with self._model_lock:
+                self.open_model_history(config['model_history_file'])
+        
+        # shared memory export
+        if self._shared_state_file != config['shared_state_file']:
+            with self._detection_lock:
+                self.open_shared_state(config['shared_state_file'])
+        
+        # point cloud input
+        self._cloud_frontend.leaf_size = config['cloud_leaf_size']
+        self._cloud_frontend.plane_threshold = config['cloud_plane_threshold']
+        self._cloud_frontend.cluster_tolerance = config['cloud_cluster_tolerance']
+        self._cloud_frontend.min_cluster_size = config['cloud_min_cluster_size']
+        if self._use_point_cloud != config['use_point_cloud']:
+            self._use_point_cloud = config['use_point_cloud']
+            if self._use_point_cloud:
+                self._cloud_subscriber = rospy.Subscriber("cloud_in", PointCloud2, self.cloud_callback, queue_size=1, buff_size=2**24)
+            elif self._cloud_subscriber is not None:
+                self._cloud_subscriber.unregister()
+                self._cloud_subscriber = None
+        
+        # topic input
+        self._input_queue.capacity = config['input_queue_size']
+        self._input_queue.policy = config['input_queue_policy']
+        self._input_queue.max_batch = config['input_max_batch']
+        if self._subscribe_input != config['subscribe_recognized_objects']:
+            self._subscribe_input = config['subscribe_recognized_objects']
+            # the subscriber is set up by start() the first time
+            if self._running:
+                self.enable_topic_input(self._subscribe_input)
+        
+        # multi camera fusion
+        self._camera_dedup_distance = config['camera_dedup_distance']
+        self._camera_merge_window = config['camera_merge_window']
+        # the connections are opened once by start()
+        self._estimation_connections = config['estimation_connections']
+        if self._camera_fusion is not None:
+            self._camera_fusion.dedup_distance = self._camera_dedup_distance
+            self._camera_fusion.merge_window = self._camera_merge_window
+        camera_topics = [ topic.strip() for topic in config['camera_topics'].split(',') if topic.strip() != "" ]
+        if self._camera_topics != camera_topics:
+            self._camera_topics = camera_topics
+            # the fusion is set up by start() the first time
+            if self._running:
+                self.enable_camera_fusion(self._camera_topics)
+        
+        # checkpoint
+        self._checkpoint_max_age = config['checkpoint_max_age']
+        self._checkpoint_validation_frames = config['checkpoint_validation_frames']
+        self._reacquisition_frames = config['reacquisition_frames']
+        if self._checkpoint_file != config['checkpoint_file'] or self._checkpoint_interval != config['checkpoint_interval']:
+            self._checkpoint_file = config['checkpoint_file']
+            self._checkpoint_interval = config['checkpoint_interval']
+            self.start_checkpoint_timer()
         
         # rates
-        if self._detection_rate != config['detection_rate']:
-            self._detection_rate = config['detection_rate']
-            if self._detection_timer is not None:
-                self._detection_timer.shutdown()
-            self._detection_timer = rospy.Timer(rospy.Duration(1.0 / self._detection_rate), self.detection_timer_callback)
-            
-        if self._tf_rate != config['tf_rate']:
-            self._tf_rate = config['tf_rate']
-            if self._tf_timer is not None:
-                self._tf_timer.shutdown()
-            self._tf_timer = rospy.Timer(rospy.Duration(1.0 / self._tf_rate), self.tf_callback)
+        self._detection_rate = config['detection_rate']
+        self._tf_rate = config['tf_rate']
+        self._adaptive_rates = config['adaptive_rates']
+        self._rate_scheduler.max_detection_rate = self._detection_rate
+        self._rate_scheduler.min_detection_rate = min(config['min_detection_rate'], self._detection_rate)
+        self._rate_scheduler.max_tf_rate = self._tf_rate
+        self._rate_scheduler.min_tf_rate = min(config['min_tf_rate'], self._tf_rate)
+        self._rate_scheduler.center_tolerance = config['model_center_tolerance']
+        self._rate_scheduler.speed_tolerance = config['model_speed_tolerance']
+        self._rate_scheduler.angular_resolution = config['tf_angular_resolution']
+        
+        if self._adaptive_rates:
+            self.reschedule_timers()
+        else:
+            if self._detection_timer_rate != self._detection_rate and not self.topic_input_enabled():
+                self.start_detection_timer(self._detection_rate)
+            if self._tf_timer_rate != self._tf_rate:
+                self.start_tf_timer(self._tf_rate)
     
     def dynamic_reconfigure_callback(self, config, level):   
         """ A callback for the dynamic_reconfigure server. """   
         self.set_parameters(config)
+        config['reset_tracking'] = False
         return config
 
     
-    def start(self):
-        """ Start the object tracker. """
+    def start(self, camera_workers=0):
+        """
+        Start the object tracker.
+
+        Args:
+            camera_workers: the number of processes preprocessing the results of the fused cameras (see camera_topics), 0 to
+                            preprocess them in the subscriber threads
+        """
+        # fork the camera workers before the node starts its threads
+        if camera_workers > 0:
+            self._camera_workers = CameraWorkerPool(camera_workers)
+        
         rospy.init_node("rotating_object_tracker")
         
         # dynamic reconfigure params
@@ -926,29 +2311,60 @@ class Tracker:
         
         # estimation service
         rospy.wait_for_service("estimate_rotation")
-        self._estimate_rotation_service = rospy.ServiceProxy("estimate_rotation", EstimateRotation, True)
+        self._estimation_services = [ rospy.ServiceProxy("estimate_rotation", EstimateRotation, True) 
+                                      for connection in range(self._estimation_connections) ]
+        self._estimate_rotation_service = self._estimation_services[0]
+        
+        # prediction service
+        self._prediction_service = rospy.Service("predict_object_poses", PredictObjectPoses, self.predict_object_poses_callback)
+        self._dump_trace_service = rospy.Service("dump_trace", DumpTrace, self.dump_trace_callback)
         
         # Publishers
         self._marker_publisher = rospy.Publisher("rotating_objects_markers", MarkerArray)
         self._rotation_publisher = rospy.Publisher("rotating_objects", RotatingObjects)
         self._rotating_objects_publisher = rospy.Publisher("recognized_rotating_objects", RecognizedObjectArray)
         
-        # Object recognition server
-        rospy.loginfo("Waiting for object recognition server...")
+        self._input_status_publisher = rospy.Publisher("tracker_input_status", TrackerInputStatus)
+        self._model_update_publisher = rospy.Publisher("model_update_status", ModelUpdateStatus)
+        
+        # Object recognition server, polled unless the results are received through the topic
         self._object_detection_client = actionlib.SimpleActionClient("recognize_objects", ObjectRecognitionAction)
-        self._object_detection_client.wait_for_server()
-        self._detection_timer = rospy.Timer(rospy.Duration(1.0 / self._detection_rate), self.detection_timer_callback)
+        if not (self._subscribe_input or self._camera_topics):
+            rospy.loginfo("Waiting for object recognition server...")
+            self._object_detection_client.wait_for_server()
+            self.start_detection_timer(self._detection_timer_rate)
         
         # setup the tf publisher
         self._tf_publisher = tf.TransformBroadcaster()
-        self._tf_timer = rospy.Timer(rospy.Duration(1.0 / self._tf_rate), self.tf_callback)
+        self.start_tf_timer(self._tf_timer_rate)
         
         self._tf_listener = tf.TransformListener()
+        
+        # warm restart
+        if self._checkpoint_file != "":
+            with self._detection_lock:
+                self.restore_checkpoint()
+        
+        rospy.on_shutdown(lambda: self.open_detection_log(""))
+        rospy.on_shutdown(lambda: self.open_shared_state(""))
+        rospy.on_shutdown(lambda: self.open_model_history(""))
+        
+        self._running = True
+        if self._subscribe_input:
+            self.enable_topic_input(True)
+        if self._camera_topics:
+            self.enable_camera_fusion(self._camera_topics)
+        rospy.on_shutdown(lambda: self._camera_fusion is not None and self._camera_fusion.close())
+        rospy.on_shutdown(lambda: self._camera_workers is not None and self._camera_workers.close())
         rospy.loginfo("started")
         
         rospy.spin()
     
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rotating object tracker.')
+    parser.add_argument('--camera-workers', type=int, default=0, help='the number of processes preprocessing the results of the fused cameras (0 preprocesses them in process)')
+    args = parser.parse_args(rospy.myargv()[1:])
+    
     tracker = Tracker()
-    tracker.start()
+    tracker.start(args.camera_workers)
     
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import struct
+import timeit
+from io import BytesIO
+
+from object_recognition_msgs.msg import RecognizedObject, RecognizedObjectArray
+from object_tracker.msg import RotatingObjects
+
+_UINT32 = struct.Struct('<I')
+_STAMP = struct.Struct('<II')
+
+def serialize_message(msg):
+    """ Serialize a ROS message, returning its wire representation. """
+    buff = BytesIO()
+    msg.serialize(buff)
+    return buff.getvalue()
+
+def stamp_offsets(msg, header):
+    """
+    Find where the stamp of a header ends up in the serialized representation of a message.
+
+    The message is serialized twice with two different stamps and the offsets where the two stamps appear are compared,
+    so a header shared by several fields of the message (e.g. a RecognizedObject and its pose) is found everywhere.
+
+    Args:
+        msg: the message
+        header: a std_msgs/Header contained in the message
+
+    Returns:
+        the list of byte offsets of the stamp
+    """
+    old_stamp = (header.stamp.secs, header.stamp.nsecs)
+    markers = ((0x6d617263, 0x6b657231), (0x4d415243, 0x4b455232))
+    data = []
+    for secs, nsecs in markers:
+        header.stamp.secs, header.stamp.nsecs = secs, nsecs
+        data.append(serialize_message(msg))
+    header.stamp.secs, header.stamp.nsecs = old_stamp
+
+    first, second = [_STAMP.pack(*marker) for marker in markers]
+    offsets = []
+    offset = data[0].find(first)
+    while offset >= 0:
+        if data[1][offset:offset + _STAMP.size] == second:
+            offsets.append(offset)
+        offset = data[0].find(first, offset + 1)
+    return offsets
+
+class PreSerializedRecognizedObjectArray(RecognizedObjectArray):
+    """ A RecognizedObjectArray whose content, except the header, has already been serialized. """
+    def __init__(self):
+        RecognizedObjectArray.__init__(self)
+        self.body = b''
+
+    def serialize(self, buff):
+        self.header.serialize(buff)
+        buff.write(self.body)
+
+class PreSerializedRotatingObjects(RotatingObjects):
+    """ A RotatingObjects message whose content, except the header, has already been serialized. """
+    def __init__(self):
+        RotatingObjects.__init__(self)
+        self.body = b''
+
+    def serialize(self, buff):
+        self.header.serialize(buff)
+        buff.write(self.body)
+
+class RecognizedObjectCache:
+    """
+    Cache of the serialized RecognizedObject templates of the tracked objects.
+
+    The templates of the tracked objects only change when a track is created, so each one is serialized once and reused by
+    every output. The stamp of the object is the only field that is rewritten, directly in a copy of the serialized buffer.
+    """
+    _entries = None
+
+    def __init__(self):
+        self._entries = dict()
+
+    def serialized(self, key, recognized_object, stamp=None):
+        """
+        Return the serialized representation of a RecognizedObject.
+
+        Args:
+            key: a key identifying the object (e.g. the progressive id of the track)
+            recognized_object: the RecognizedObject, serialized again only if it is not the one cached for the key
+            stamp: if not None, the rospy.Time to write in the headers of the object
+
+        Returns:
+            the serialized object
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] is not recognized_object:
+            offsets = stamp_offsets(recognized_object, recognized_object.header)
+            entry = (recognized_object, serialize_message(recognized_object), offsets)
+            self._entries[key] = entry
+
+        if stamp is None:
+            return entry[1]
+
+        data = bytearray(entry[1])
+        for offset in entry[2]:
+            _STAMP.pack_into(data, offset, stamp.secs, stamp.nsecs)
+        return bytes(data)
+
+    def prune(self, keys):
+        """ Forget the objects whose key is not in keys. """
+        keys = set(keys)
+        for key in list(self._entries):
+            if key not in keys:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+class RecognizedObjectArrayBuilder:
+    """
+    Builds the RecognizedObjectArray listing the tracked objects in their rotating frames.
+
+    A single message is kept and updated in place: the section containing the objects is assembled from the cached
+    serialized templates and, if nothing changed since the last update, no message is produced at all.
+    """
+    _cache = None
+    _message = None
+    _trailer = None
+    _signature = None
+    _subscribers = 0
+
+    def __init__(self, cache):
+        """
+        Args:
+            cache: the RecognizedObjectCache holding the serialized templates
+        """
+        self._cache = cache
+        self._message = PreSerializedRecognizedObjectArray()
+        # the fields following the objects, serialized once (the header and the length of the empty list are skipped)
+        empty = RecognizedObjectArray()
+        self._trailer = serialize_message(empty)[len(serialize_message(empty.header)) + _UINT32.size:]
+
+    def reset(self):
+        """ Forget the last message, so the next update always produces one. """
+        self._signature = None
+
+    def objects_section(self, objects, stamp=None):
+        """
+        Serialize the objects of a RecognizedObjectArray, i.e. everything that follows its header.
+
+        Args:
+            objects: a list of (key, RecognizedObject) pairs
+            stamp: if not None, the rospy.Time to write in the headers of the objects
+
+        Returns:
+            the serialized section
+        """
+        chunks = [_UINT32.pack(len(objects))]
+        chunks.extend(self._cache.serialized(key, recognized_object, stamp) for key, recognized_object in objects)
+        chunks.append(self._trailer)
+        return b''.join(chunks)
+
+    def update(self, frame_id, stamp, objects, skip_unchanged=True, subscribers=0):
+        """
+        Update the message with the current tracked objects.
+
+        Args:
+            frame_id: the frame of the message
+            stamp: the rospy.Time of the message and of the objects
+            objects: a list of (key, RecognizedObject) pairs
+            skip_unchanged: if True and the objects are the same of the last update, no message is produced
+            subscribers: the number of subscribers of the topic, a message is always produced when new ones connect
+
+        Returns:
+            the message to publish, or None if there is nothing new to publish
+        """
+        signature = (frame_id, tuple((key, id(recognized_object)) for key, recognized_object in objects))
+        new_subscribers = subscribers > self._subscribers
+        self._subscribers = subscribers
+        if skip_unchanged and not new_subscribers and signature == self._signature:
+            return None
+        self._signature = signature
+
+        self._message.header.frame_id = frame_id
+        self._message.header.stamp = stamp
+        self._message.body = self.objects_section(objects, stamp)
+        return self._message
+
+class RotatingObjectsBuilder:
+    """
+    Builds the RotatingObjects message published after every update of the rotation model.
+
+    The list of objects is serialized again only when the set of tracked objects changes, while the rotation parameters,
+    the radii and the phases are packed at every update. An update that does not change any of them produces no message.
+    """
+    _objects_builder = None
+    _message = None
+    _signature = None
+    _objects_signature = None
+    _objects_section = None
+    _subscribers = 0
+
+    def __init__(self, cache):
+        """
+        Args:
+            cache: the RecognizedObjectCache holding the serialized templates
+        """
+        self._objects_builder = RecognizedObjectArrayBuilder(cache)
+        self._message = PreSerializedRotatingObjects()
+
+    def reset(self):
+        """ Forget the last message, so the next update always produces one. """
+        self._signature = None
+        self._objects_signature = None
+        self._objects_section = None
+
+    def update(self, rotation_parameters, objects, radius, phase, skip_unchanged=True, subscribers=0):
+        """
+        Update the message with the current model and tracked objects.
+
+        Args:
+            rotation_parameters: the RotationParameters of the model
+            objects: a list of (key, RecognizedObject) pairs
+            radius: the list of radii of the objects
+            phase: the list of phases of the objects
+            skip_unchanged: if True and nothing but the stamp of the parameters changed since the last update, no message is produced
+            subscribers: the number of subscribers of the topic, a message is always produced when new ones connect
+
+        Returns:
+            the message to publish, or None if there is nothing new to publish
+        """
+        parameters = serialize_message(rotation_parameters)
+        objects_signature = tuple((key, id(recognized_object)) for key, recognized_object in objects)
+        # the parameters start with their header: the sequence number and the stamp are not part of the signature
+        signature = (parameters[_UINT32.size + _STAMP.size:], objects_signature, tuple(radius), tuple(phase))
+        new_subscribers = subscribers > self._subscribers
+        self._subscribers = subscribers
+        if skip_unchanged and not new_subscribers and signature == self._signature:
+            return None
+        self._signature = signature
+
+        if objects_signature != self._objects_signature:
+            # the nested array has an empty header, as the objects carry their own
+            self._objects_section = serialize_message(RecognizedObjectArray().header) + self._objects_builder.objects_section(objects)
+            self._objects_signature = objects_signature
+
+        count = len(radius)
+        self._message.rotation_parameters = rotation_parameters
+        self._message.body = b''.join([parameters,
+                                       self._objects_section,
+                                       struct.pack('<I%dd' % count, count, *radius),
+                                       struct.pack('<I%dd' % count, count, *phase)])
+        return self._message
+
+def benchmark(object_counts=(1, 4, 16, 64, 256), repetitions=200):
+    """
+    Measure the cost of building and serializing the RecognizedObjectArray output in a publishing cycle.
+
+    The message is built and serialized the way the tracker did before the cache was introduced, then through a
+    RecognizedObjectArrayBuilder forced to produce a new message at every cycle, and finally through a builder skipping
+    the unchanged messages.
+
+    Args:
+        object_counts: the numbers of tracked objects to test
+        repetitions: the number of publishing cycles timed for every count
+
+    Returns:
+        a list of (object count, rebuilt time, cached time, skipped time) tuples, times in microseconds per cycle
+    """
+    import genpy
+
+    results = []
+    for count in object_counts:
+        objects = []
+        for i in range(count):
+            recognized_object = RecognizedObject()
+            recognized_object.header.frame_id = "rotating_object_%d" % i
+            recognized_object.id.id = "object_%d" % i
+            recognized_object.id.db = "db"
+            recognized_object.confidence = 0.9
+            recognized_object.pose.header = recognized_object.header
+            recognized_object.pose.pose.pose.orientation.w = 1.0
+            objects.append((i, recognized_object))
+        stamps = [genpy.Time(1000 + i, 0) for i in range(repetitions)]
+
+        def rebuilt():
+            for stamp in stamps:
+                msg = RecognizedObjectArray()
+                msg.header.frame_id = "base"
+                msg.header.stamp = stamp
+                for _, recognized_object in objects:
+                    recognized_object.header.stamp = stamp
+                    msg.objects.append(recognized_object)
+                serialize_message(msg)
+
+        def cached(skip_unchanged):
+            builder = RecognizedObjectArrayBuilder(RecognizedObjectCache())
+            for stamp in stamps:
+                msg = builder.update("base", stamp, objects, skip_unchanged)
+                if msg is not None:
+                    serialize_message(msg)
+
+        times = [timeit.timeit(rebuilt, number=1),
+                 timeit.timeit(lambda: cached(False), number=1),
+                 timeit.timeit(lambda: cached(True), number=1)]
+        results.append((count,) + tuple(1e6 * t / repetitions for t in times))
+    return results
+
+if __name__ == '__main__':
+    print "%8s %14s %14s %14s" % ("objects", "rebuilt [us]", "cached [us]", "skipped [us]")
+    for row in benchmark():
+        print "%8d %14.1f %14.1f %14.1f" % row
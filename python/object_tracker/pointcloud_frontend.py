@@ -0,0 +1,258 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+"""
+A point cloud input stage for the tracker, the NumPy counterpart of PointCloudUtils.hpp.
+
+Each sensor_msgs/PointCloud2 is decoded in place, downsampled on a voxel grid, cropped, stripped of its dominant plane
+(the turntable) and clustered on a grid; the cluster centroids are then fed to the tracker as detections.
+"""
+
+import itertools
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from sensor_msgs.msg import PointField
+from object_recognition_msgs.msg import RecognizedObjectArray, RecognizedObject
+
+CLUSTER_ID = "cloud_cluster"
+CLUSTER_DB = "point_cloud"
+
+def pointcloud2_to_xyz(cloud):
+    """
+    Extract the finite x, y, z coordinates of a sensor_msgs/PointCloud2.
+
+    The message buffer is viewed through a structured dtype (no parsing), only the coordinates are copied out.
+
+    Args:
+        cloud: a PointCloud2 with FLOAT32 x, y and z fields
+
+    Returns:
+        an Nx3 array of points
+    """
+    fields = dict((field.name, field) for field in cloud.fields)
+    endianness = '>' if cloud.is_bigendian else '<'
+    for name in ('x', 'y', 'z'):
+        if name not in fields or fields[name].datatype != PointField.FLOAT32:
+            raise ValueError("The point cloud has no FLOAT32 %s field" % name)
+    
+    dtype = np.dtype({ 'names': [ 'x', 'y', 'z' ], 
+                       'formats': [ endianness + 'f4' ] * 3, 
+                       'offsets': [ fields['x'].offset, fields['y'].offset, fields['z'].offset ], 
+                       'itemsize': cloud.point_step })
+    grid = np.ndarray(shape=(cloud.height, cloud.width), dtype=dtype, buffer=cloud.data, strides=(cloud.row_step, cloud.point_step))
+    
+    points = np.empty((cloud.height * cloud.width, 3))
+    points[:, 0] = grid['x'].ravel()
+    points[:, 1] = grid['y'].ravel()
+    points[:, 2] = grid['z'].ravel()
+    return points[np.isfinite(points).all(axis=1)]
+
+def grid_sample(points, leaf_size=0.02):
+    """
+    Downsample the points on a voxel grid, replacing the points of each voxel with their centroid.
+
+    Args:
+        points: an Nx3 array
+        leaf_size: the voxel size (m)
+
+    Returns:
+        an Mx3 array, one point per occupied voxel
+    """
+    if points.shape[0] == 0:
+        return points
+    keys = np.floor(points / leaf_size).astype(np.int64)
+    keys -= keys.min(axis=0)
+    voxels = np.ravel_multi_index(keys.T, keys.max(axis=0) + 1)
+    _, inverse = np.unique(voxels, return_inverse=True)
+    counts = np.bincount(inverse).astype(float)
+    return np.column_stack([ np.bincount(inverse, weights=points[:, axis]) / counts for axis in range(3) ])
+
+def crop_box(points, limits):
+    """
+    Keep the points inside an axis aligned box.
+
+    Args:
+        points: an Nx3 array
+        limits: the box as [ x_min, x_max, y_min, y_max, z_min, z_max ]
+
+    Returns:
+        the points inside the box
+    """
+    limits = np.asarray(limits, dtype=float).reshape(3, 2)
+    inside = np.all((points >= limits[:, 0]) & (points <= limits[:, 1]), axis=1)
+    return points[inside]
+
+def plane_segmentation(points, distance_threshold=0.015, iterations=100, rng=np.random):
+    """
+    Find the dominant plane with RANSAC, all the hypotheses being scored at once.
+
+    Args:
+        points: an Nx3 array
+        distance_threshold: the maximum distance of an inlier from the plane (m)
+        iterations: the number of plane hypotheses
+        rng: the random number generator
+
+    Returns:
+        the plane coefficients (a, b, c, d), with a unit normal oriented towards the origin of the points frame (the sensor), 
+        or None if no plane could be found
+    """
+    if points.shape[0] < 3:
+        return None
+    
+    samples = points[rng.randint(0, points.shape[0], size=(iterations, 3))]
+    normals = np.cross(samples[:, 1] - samples[:, 0], samples[:, 2] - samples[:, 0])
+    norms = np.sqrt(np.sum(normals**2, axis=1))
+    valid = norms > 1e-9
+    if not valid.any():
+        return None
+    normals = normals[valid] / norms[valid, None]
+    offsets = -np.sum(normals * samples[valid, 0], axis=1)
+    
+    inliers_count = np.sum(np.abs(np.dot(points, normals.T) + offsets) < distance_threshold, axis=0)
+    best = np.argmax(inliers_count)
+    inliers = points[np.abs(np.dot(points, normals[best]) + offsets[best]) < distance_threshold]
+    
+    # least squares refinement on the inliers
+    centroid = inliers.mean(axis=0)
+    normal = np.linalg.svd(inliers - centroid, full_matrices=False)[2][-1]
+    offset = -np.dot(normal, centroid)
+    if offset < 0:
+        normal = -normal
+        offset = -offset
+    return np.append(normal, offset)
+
+def extract_non_plane_points(points, plane, min_height=0.01, max_height=10.0):
+    """ Keep the points lying on the sensor side of the plane, between the given heights (m). """
+    heights = np.dot(points, plane[0:3]) + plane[3]
+    return points[(heights > min_height) & (heights < max_height)]
+
+def grid_segment(points, cluster_tolerance=0.03, min_cluster_size=10):
+    """
+    Cluster the points by connecting the occupied cells of a grid whose size is the cluster tolerance.
+
+    Only the occupied cells are considered (no dense grid is allocated), neighboring cells being found with a binary search.
+
+    Args:
+        points: an Nx3 array
+        cluster_tolerance: the grid cell size (m)
+        min_cluster_size: the minimum number of points of a cluster
+
+    Returns:
+        centroids: a Kx3 array with the centroids of the clusters
+        sizes: an array with the number of points of each cluster
+    """
+    if points.shape[0] == 0:
+        return np.zeros((0, 3)), np.zeros(0, dtype=int)
+    
+    keys = np.floor(points / cluster_tolerance).astype(np.int64)
+    keys -= keys.min(axis=0) - 1
+    dims = keys.max(axis=0) + 2
+    cells, point_cells = np.unique(np.ravel_multi_index(keys.T, dims), return_inverse=True)
+    cell_keys = np.column_stack(np.unravel_index(cells, dims))
+    
+    # connect each occupied cell with its occupied neighbors
+    rows = []
+    cols = []
+    for offset in itertools.product((-1, 0, 1), repeat=3):
+        if offset <= (0, 0, 0):
+            continue
+        neighbors = np.ravel_multi_index((cell_keys + offset).T, dims)
+        positions = np.minimum(np.searchsorted(cells, neighbors), cells.shape[0] - 1)
+        found = cells[positions] == neighbors
+        rows.append(np.flatnonzero(found))
+        cols.append(positions[found])
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    adjacency = coo_matrix((np.ones(rows.shape[0]), (rows, cols)), shape=(cells.shape[0], cells.shape[0]))
+    _, cell_labels = connected_components(adjacency, directed=False)
+    
+    labels = cell_labels[point_cells]
+    sizes = np.bincount(labels)
+    centroids = np.column_stack([ np.bincount(labels, weights=points[:, axis]) for axis in range(3) ]) / sizes[:, None]
+    big_enough = sizes >= min_cluster_size
+    return centroids[big_enough], sizes[big_enough]
+
+class PointCloudFrontEnd:
+    """ Turn point clouds into detections of object centroids. """
+    def __init__(self):
+        self.leaf_size = 0.01
+        self.plane_threshold = 0.015
+        self.cluster_tolerance = 0.03
+        self.min_cluster_size = 10
+        self.roi_limits = None
+        
+    def find_centroids(self, cloud):
+        """
+        Find the centroids of the objects lying on the dominant plane of a point cloud.
+
+        Args:
+            cloud: a sensor_msgs/PointCloud2
+
+        Returns:
+            a Kx3 array of centroids, expressed in the point cloud frame
+        """
+        points = grid_sample(pointcloud2_to_xyz(cloud), self.leaf_size)
+        if self.roi_limits is not None:
+            points = crop_box(points, self.roi_limits)
+        plane = plane_segmentation(points, self.plane_threshold)
+        if plane is not None:
+            points = extract_non_plane_points(points, plane, self.plane_threshold)
+        centroids, _ = grid_segment(points, self.cluster_tolerance, self.min_cluster_size)
+        return centroids
+    
+    def detect(self, cloud):
+        """
+        Find the objects in a point cloud.
+
+        Args:
+            cloud: a sensor_msgs/PointCloud2
+
+        Returns:
+            a RecognizedObjectArray with one object per cluster, all with the CLUSTER_ID id and CLUSTER_DB db; the tracker
+            associates them with the tracks of any recognized object
+        """
+        data = RecognizedObjectArray()
+        data.header = cloud.header
+        for centroid in self.find_centroids(cloud).tolist():
+            obj = RecognizedObject()
+            obj.header = cloud.header
+            obj.id.id = CLUSTER_ID
+            obj.id.db = CLUSTER_DB
+            obj.confidence = 1.0
+            obj.pose.header = cloud.header
+            obj.pose.pose.pose.position.x, obj.pose.pose.pose.position.y, obj.pose.pose.pose.position.z = centroid
+            obj.pose.pose.pose.orientation.w = 1.0
+            data.objects.append(obj)
+        return data
@@ -0,0 +1,137 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import numpy as np
+
+def cylinder_limits(center, axis, radius, min_height, max_height, transformation=None):
+    """
+    Compute the axis aligned box containing a cylinder, optionally in another reference frame.
+
+    Args:
+        center: the center of the base of the cylinder
+        axis: the (unit) axis of the cylinder
+        radius: the radius of the cylinder
+        min_height: the position of the bottom of the cylinder along the axis, wrt. the center
+        max_height: the position of the top of the cylinder along the axis, wrt. the center
+        transformation: None or the 4x4 matrix transforming the points into the frame of the box
+
+    Returns:
+        the (x_min, x_max, y_min, y_max, z_min, z_max) limits of the box
+    """
+    center = np.asarray(center, dtype=float)
+    axis = np.asarray(axis, dtype=float)
+    if transformation is not None:
+        center = np.dot(transformation[0:3, 0:3], center) + transformation[0:3, 3]
+        axis = np.dot(transformation[0:3, 0:3], axis)
+    axis = axis / np.linalg.norm(axis)
+    
+    # a circle of radius r orthogonal to the unit vector n extends r * sqrt(1 - n_i^2) along each axis i
+    extents = radius * np.sqrt(np.maximum(1.0 - axis**2, 0.0))
+    ends = np.vstack((center + min_height * axis, center + max_height * axis))
+    limits = np.empty(6)
+    limits[0::2] = np.amin(ends, axis=0) - extents
+    limits[1::2] = np.amax(ends, axis=0) + extents
+    return limits.tolist()
+
+def intersect_limits(limits, other_limits):
+    """ Return the intersection of two (x_min, x_max, y_min, y_max, z_min, z_max) boxes, None if it is empty. """
+    limits = np.asarray(limits, dtype=float)
+    other_limits = np.asarray(other_limits, dtype=float)
+    intersection = np.empty(6)
+    intersection[0::2] = np.maximum(limits[0::2], other_limits[0::2])
+    intersection[1::2] = np.minimum(limits[1::2], other_limits[1::2])
+    if np.any(intersection[0::2] > intersection[1::2]):
+        return None
+    return intersection.tolist()
+
+class PredictiveRoi:
+    """
+    Predict the region where the tracked objects will be detected, to restrict the object detection to it.
+
+    Every tracked object lies on a circle around the rotation axis, so the objects are contained in the cylinder around the
+    axis as wide as the farthest object and as tall as the band of heights of the objects. The cylinder is padded by a margin,
+    accounting for the size of the objects and the uncertainty on the rotation center. When the tracked objects expected in
+    view are not all detected the margin is widened at every recognition result, until after max_misses results the
+    prediction is dropped.
+    """
+    margin = 0.0
+    max_misses = 0
+    misses = 0
+    
+    def __init__(self, margin=0.1, max_misses=5):
+        """
+        Args:
+            margin: the padding (m) of the region around the objects
+            max_misses: the number of consecutive recognition results missing some objects after which no region is predicted
+        """
+        self.margin = margin
+        self.max_misses = max_misses
+        self.misses = 0
+        
+    def record(self, tracked_objects, detected_objects):
+        """ Record how many of the tracked objects expected in view were detected in a recognition result. """
+        if detected_objects < tracked_objects or tracked_objects == 0:
+            self.misses += 1
+        else:
+            self.misses = 0
+        
+    def reset(self):
+        """ Forget the missed recognition results. """
+        self.misses = 0
+        
+    def limits(self, center, axis, positions, center_std_dev=0.0, transformation=None):
+        """
+        Predict the region containing the tracked objects.
+
+        Args:
+            center: the rotation center
+            axis: the rotation axis
+            positions: the Nx3 array of the last positions of the tracked objects
+            center_std_dev: the standard deviation (m) of the rotation center, added to the margin three times
+            transformation: None or the 4x4 matrix transforming the points into the frame of the region
+
+        Returns:
+            the (x_min, x_max, y_min, y_max, z_min, z_max) limits of the region, or None if it can not be predicted
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        if positions.shape[0] == 0 or self.misses >= self.max_misses:
+            return None
+        
+        axis = np.asarray(axis, dtype=float) / np.linalg.norm(axis)
+        offsets = positions - center
+        heights = np.dot(offsets, axis)
+        radii = np.sqrt(np.maximum(np.sum(offsets**2, axis=1) - heights**2, 0.0))
+        
+        margin = self.margin * (1 + self.misses) + 3.0 * center_std_dev
+        return cylinder_limits(center, axis, np.amax(radii) + margin, np.amin(heights) - margin, np.amax(heights) + margin, transformation)
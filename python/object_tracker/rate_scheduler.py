@@ -0,0 +1,158 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import math
+import threading
+import rospy
+
+class AdaptiveRateScheduler:
+    """
+    Choose the detection and TF rates from the state of the rotation model.
+
+    The detection rate goes from its maximum, while the model is uncertain, down to its minimum once the estimated
+    center and speed are stable in time; it is never higher than what the measured detection latency allows.
+    The TF rate is the lowest rate at which the rotating frame moves less than a given angle between two broadcasts.
+    """
+    # smoothing factor of the detection latency moving average
+    LATENCY_SMOOTHING = 0.3
+    # relative change needed before a new rate is applied, avoids restarting the timers for small variations
+    RATE_HYSTERESIS = 0.1
+
+    def __init__(self):
+        self.min_detection_rate = 0.5
+        self.max_detection_rate = 2.0
+        self.min_tf_rate = 1.0
+        self.max_tf_rate = 20.0
+        self.center_tolerance = 0.01
+        self.speed_tolerance = 0.01
+        self.angular_resolution = 0.01
+        self.detection_latency = 0.0
+        self.uncertainty = float('inf')
+
+    def reset(self):
+        """ Forget the model uncertainty, e.g. when the model has to be initialized again. """
+        self.uncertainty = float('inf')
+
+    def record_detection_latency(self, latency):
+        """ Add a measured detection latency (s) to the moving average. """
+        if self.detection_latency == 0.0:
+            self.detection_latency = latency
+        else:
+            self.detection_latency += self.LATENCY_SMOOTHING * (latency - self.detection_latency)
+
+    def update_model_uncertainty(self, center_time_covariance, speed_time_std_dev):
+        """
+        Update the uncertainty of the model from the covariances of the last estimates.
+
+        Args:
+            center_time_covariance: the 3x3 covariance of the last estimated centers or None if not available yet
+            speed_time_std_dev: the standard deviation of the last estimated speeds or None if not available yet
+        """
+        if center_time_covariance is None or speed_time_std_dev is None:
+            self.uncertainty = float('inf')
+            return
+        center_std_dev = math.sqrt(max(center_time_covariance[0, 0] + center_time_covariance[1, 1] + center_time_covariance[2, 2], 0.0))
+        self.uncertainty = max(center_std_dev / self.center_tolerance, speed_time_std_dev / self.speed_tolerance)
+
+    def detection_rate(self):
+        """ Return the detection rate (Hz) for the current model uncertainty and detection latency. """
+        # uncertainty is 1 when the estimates vary as much as the tolerances allow
+        weight = min(self.uncertainty, 1.0)
+        rate = self.min_detection_rate + (self.max_detection_rate - self.min_detection_rate) * weight
+        if self.detection_latency > 0.0:
+            rate = min(rate, 1.0 / self.detection_latency)
+        return max(min(rate, self.max_detection_rate), self.min_detection_rate)
+
+    def tf_rate(self, speed):
+        """ Return the TF rate (Hz) keeping the rotation between two broadcasts within the angular resolution. """
+        rate = abs(speed) / self.angular_resolution
+        return max(min(rate, self.max_tf_rate), self.min_tf_rate)
+
+    def should_reschedule(self, current_rate, new_rate):
+        """ Return True if the new rate differs enough from the current one to restart a timer. """
+        return abs(new_rate - current_rate) > self.RATE_HYSTERESIS * current_rate
+
+class PhasedTimer:
+    """
+    A periodic rospy.Timer whose rate can be changed while it is running.
+
+    Restarting a rospy.Timer delays its next tick by a whole new period. When the rate changes, the next tick is instead
+    scheduled one new period after the last one (immediately if that time has already passed), through a one-shot timer
+    which then hands over to a periodic one.
+    """
+    def __init__(self, callback):
+        """
+        Args:
+            callback: the function invoked with a rospy.timer.TimerEvent at every tick
+        """
+        self.rate = 0.0
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._timer = None
+        self._generation = 0
+        self._last_tick = None
+
+    def start(self, rate):
+        """ (Re)start the timer at the given rate (Hz). """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.shutdown()
+            self._generation += 1
+            self.rate = rate
+            
+            delay = 1.0 / rate
+            if self._last_tick is not None:
+                delay = max(self._last_tick + delay - rospy.get_time(), 0.001)
+            generation = self._generation
+            self._timer = rospy.Timer(rospy.Duration(delay), lambda event: self._first_tick(event, generation), oneshot=True)
+
+    def shutdown(self):
+        """ Stop the timer. """
+        with self._lock:
+            self._generation += 1
+            if self._timer is not None:
+                self._timer.shutdown()
+                self._timer = None
+
+    def _first_tick(self, event, generation):
+        with self._lock:
+            # the timer has been restarted or stopped in the meantime
+            if generation != self._generation:
+                return
+            self._timer = rospy.Timer(rospy.Duration(1.0 / self.rate), self._tick)
+        self._tick(event)
+
+    def _tick(self, event):
+        self._last_tick = rospy.get_time()
+        self._callback(event)
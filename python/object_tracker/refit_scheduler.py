@@ -0,0 +1,230 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import numpy as np
+
+def pose_positions(poses):
+    """ Return the Nx3 array of the positions of a list of PoseWithCovarianceStamped. """
+    return np.array([ (pose.pose.pose.position.x, pose.pose.pose.position.y, pose.pose.pose.position.z) for pose in poses ]).reshape(-1, 3)
+
+class ObjectFit:
+    """ The cached result of the last rotation fit of a tracked object: the rotation and the circle described by the object. """
+    def __init__(self, center, axis, speed, radius, height, stamp, time):
+        """
+        Args:
+            center: the center of rotation
+            axis: the (unit) rotation axis
+            speed: the angular speed (rad/s)
+            radius: the mean distance of the fitted poses from the axis (m)
+            height: the mean height of the fitted poses along the axis, wrt. the center (m)
+            stamp: the time (s) of the newest fitted pose
+            time: the time (s) the fit was performed
+        """
+        self.center = center
+        self.axis = axis
+        self.speed = speed
+        self.radius = radius
+        self.height = height
+        self.stamp = stamp
+        self.time = time
+
+class RefitScheduler:
+    """
+    Decide which tracked objects need their rotation fit to be performed again.
+
+    The fit of an object is stale when enough new poses arrived since it was performed, when it is too old, or when the new
+    poses drift away from the circle it describes. The fits of the other objects are reused as they are.
+
+    With a time budget, only the stale objects whose fits are expected to complete within the budget are fitted in a cycle,
+    in priority order; the others are deferred and get the highest priority in the following cycles, so every stale object
+    is eventually fitted in a round-robin fashion. A joint fit of all the objects can not be split, it is only allowed if it
+    is expected to complete within the budget. While joint fits are skipped their cost estimate decays toward the cost of
+    the independent fits, and one is tried again at least every max_age seconds, so a single slow fit does not disable them.
+    """
+    # smoothing factor of the moving average of the fit time per object
+    FIT_TIME_SMOOTHING = 0.3
+    
+    min_new_poses = 1
+    max_age = 0.0
+    drift_tolerance = 0.0
+    budget = 0.0
+    fit_time = 0.0
+    joint_fit_time = 0.0
+    last_joint_fit = 0.0
+    joint_fit_skips = 0
+    overruns = 0
+    deferred = 0
+    
+    def __init__(self, min_new_poses=3, max_age=10.0, drift_tolerance=0.01, budget=0.0):
+        """
+        Args:
+            min_new_poses: the number of new poses making a fit stale
+            max_age: the age (s) making a fit stale, 0 disables the check
+            drift_tolerance: the distance (m) of a new pose from the fitted circle making a fit stale
+            budget: the time (s) available for the fits in a cycle, 0 for no limit
+        """
+        self.min_new_poses = min_new_poses
+        self.max_age = max_age
+        self.drift_tolerance = drift_tolerance
+        self.budget = budget
+        self.fit_time = 0.0
+        self.joint_fit_time = 0.0
+        self.last_joint_fit = 0.0
+        self.joint_fit_skips = 0
+        self.overruns = 0
+        self.deferred = 0
+        
+    def new_poses(self, obj):
+        """ Return the poses of an object newer than its last fit. """
+        if obj.fit is None:
+            return obj.poses
+        count = 0
+        for pose in reversed(obj.poses):
+            if pose.header.stamp.to_sec() <= obj.fit.stamp:
+                break
+            count += 1
+        return obj.poses[len(obj.poses) - count:]
+        
+    def drift(self, fit, poses):
+        """ Return the largest distance of the poses from the circle described by a fit. """
+        if not poses:
+            return 0.0
+        positions = pose_positions(poses) - fit.center
+        heights = np.dot(positions, fit.axis)
+        distances = np.sqrt(np.maximum(np.sum(positions**2, axis=1) - heights**2, 0.0))
+        return float(np.max(np.hypot(distances - fit.radius, heights - fit.height)))
+        
+    def is_stale(self, obj, now):
+        """
+        Return True if the fit of an object has to be performed again.
+
+        Args:
+            obj: a TrackedObject
+            now: the current time (s)
+        """
+        if obj.fit is None:
+            return True
+        if self.max_age > 0.0 and now - obj.fit.time > self.max_age:
+            return True
+        new_poses = self.new_poses(obj)
+        if len(new_poses) >= self.min_new_poses:
+            return True
+        return self.drift(obj.fit, new_poses) > self.drift_tolerance
+        
+    def priority(self, obj, now):
+        """ Return the sort key of a stale object: the most deferred first, then the oldest fit, the largest drift and the most new poses. """
+        if obj.fit is None:
+            return (-obj.deferrals, float('-inf'), 0.0, -len(obj.poses))
+        new_poses = self.new_poses(obj)
+        return (-obj.deferrals, obj.fit.time, -self.drift(obj.fit, new_poses), -len(new_poses))
+    
+    def schedule(self, objs, now, elapsed=0.0):
+        """
+        Choose the stale objects to fit in this cycle.
+
+        Args:
+            objs: the list of the stale objects
+            now: the current time (s)
+            elapsed: the part of the budget (s) already spent in this cycle
+
+        Returns:
+            a (scheduled, deferred) tuple of lists of objects; at least one object is always scheduled
+        """
+        objs = sorted(objs, key=lambda obj: self.priority(obj, now))
+        if self.budget <= 0.0 or self.fit_time <= 0.0:
+            count = len(objs)
+        else:
+            count = max(int((self.budget - elapsed) / self.fit_time), 1)
+        
+        scheduled, deferred = objs[:count], objs[count:]
+        for obj in deferred:
+            obj.deferrals += 1
+        self.deferred += len(deferred)
+        return scheduled, deferred
+    
+    def joint_fit_allowed(self, num_poses, now):
+        """
+        Return True if a joint fit of num_poses poses is expected to complete within the budget, or if it is time to try one again.
+
+        Args:
+            num_poses: the number of poses of the joint fit
+            now: the current time (s)
+        """
+        if self.budget <= 0.0 or self.joint_fit_time <= 0.0:
+            return True
+        if self.max_age > 0.0 and now - self.last_joint_fit > self.max_age:
+            return True
+        return self.joint_fit_time * num_poses <= self.budget
+    
+    def skip_joint_fit(self, num_objs, num_poses):
+        """ Record a joint fit skipped for the budget, moving its cost estimate toward the cost of fitting the objects independently. """
+        self.joint_fit_skips += 1
+        if self.fit_time > 0.0 and num_poses > 0:
+            self.joint_fit_time = self.smooth(self.joint_fit_time, self.fit_time * num_objs / num_poses)
+    
+    def smooth(self, average, value):
+        """ Update a moving average of a fit time with a new value. """
+        return value if average <= 0.0 else average + self.FIT_TIME_SMOOTHING * (value - average)
+    
+    def record_fit_time(self, num_fits, elapsed):
+        """ Record the time taken by the independent fits of num_fits objects. """
+        if num_fits > 0:
+            self.fit_time = self.smooth(self.fit_time, elapsed / num_fits)
+    
+    def record_joint_fit_time(self, num_poses, elapsed, now):
+        """ Record the time taken by a joint fit of num_poses poses at time now (s), its cost grows linearly with the poses. """
+        self.last_joint_fit = now
+        if num_poses > 0:
+            self.joint_fit_time = self.smooth(self.joint_fit_time, elapsed / num_poses)
+    
+    def check_overrun(self, elapsed):
+        """
+        Check the time taken by the fits of a cycle against the budget.
+
+        Returns:
+            True if the budget was overrun
+        """
+        overrun = self.budget > 0.0 and elapsed > self.budget
+        if overrun:
+            self.overruns += 1
+        return overrun
+    
+    def fitted(self, obj, center, axis, speed, now):
+        """ Cache the result of a fit of an object, measuring the circle its poses describe around the fitted axis. """
+        positions = pose_positions(obj.poses) - center
+        heights = np.dot(positions, axis)
+        distances = np.sqrt(np.maximum(np.sum(positions**2, axis=1) - heights**2, 0.0))
+        obj.fit = ObjectFit(np.asarray(center), np.asarray(axis), speed, float(np.mean(distances)), float(np.mean(heights)), 
+                            obj.poses[-1].header.stamp.to_sec(), now)
+        obj.deferrals = 0
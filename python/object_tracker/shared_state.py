@@ -0,0 +1,143 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import os
+import time
+import numpy as np
+
+# the model, stored at the beginning of the segment
+MODEL_DTYPE = np.dtype([ ('sequence', np.uint64),
+                         ('stamp', np.float64),
+                         ('model_valid', np.uint8),
+                         ('center', np.float64, (3,)),
+                         ('axis', np.float64, (3,)),
+                         ('speed', np.float64),
+                         ('angle', np.float64),
+                         ('angle_stamp', np.float64),
+                         ('reference_frame', np.float64, (4, 4)),
+                         ('capacity', np.uint32),
+                         ('num_objects', np.uint32) ])
+# the tracked objects, stored after the model
+OBJECT_DTYPE = np.dtype([ ('progressive_id', np.int64),
+                          ('id', 'S64'),
+                          ('db', 'S64'),
+                          ('radius', np.float64),
+                          ('phase', np.float64),
+                          ('last_seen', np.float64),
+                          ('num_poses', np.uint32) ])
+# room left for the model, so that the object table offset does not change if fields are added
+MODEL_SIZE = 512
+DEFAULT_CAPACITY = 256
+
+class SharedStateWriter:
+    """
+    Export the rotation model and the tracked objects in a memory mapped file, e.g. under /dev/shm.
+
+    The segment has a fixed layout: a MODEL_DTYPE record followed by a table of capacity OBJECT_DTYPE records. Consistency is
+    guaranteed seqlock style: the sequence counter is odd while the writer is updating the segment.
+    """
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        """
+        Args:
+            path: the file backing the segment, created or overwritten
+            capacity: the maximum number of objects exported
+        """
+        self.path = path
+        size = MODEL_SIZE + capacity * OBJECT_DTYPE.itemsize
+        with open(path, 'wb') as segment:
+            segment.truncate(size)
+        self._model = np.memmap(path, dtype=MODEL_DTYPE, mode='r+', shape=(1,))
+        self._objects = np.memmap(path, dtype=OBJECT_DTYPE, mode='r+', offset=MODEL_SIZE, shape=(capacity,))
+        self._model['capacity'] = capacity
+        
+    def write(self, model, objects):
+        """
+        Update the segment.
+
+        Args:
+            model: a dictionary with the values of the MODEL_DTYPE fields (except sequence, capacity and num_objects)
+            objects: a list of tuples with the values of the OBJECT_DTYPE fields, truncated to the capacity
+        """
+        objects = objects[:len(self._objects)]
+        record = self._model[0]
+        record['sequence'] += 1
+        for name, value in model.iteritems():
+            record[name] = value
+        self._objects[:len(objects)] = objects
+        record['num_objects'] = len(objects)
+        record['sequence'] += 1
+        
+    def close(self):
+        """ Unmap and remove the segment. """
+        del self._model
+        del self._objects
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class SharedStateReader:
+    """ Read the segment written by SharedStateWriter from another process. """
+    def __init__(self, path):
+        """
+        Args:
+            path: the file backing the segment
+        """
+        self.model = np.memmap(path, dtype=MODEL_DTYPE, mode='r', shape=(1,))
+        capacity = int(self.model[0]['capacity'])
+        self.objects = np.memmap(path, dtype=OBJECT_DTYPE, mode='r', offset=MODEL_SIZE, shape=(capacity,))
+        
+    def sequence(self):
+        """ Return the current sequence counter, it changes by two at each update. """
+        return int(self.model[0]['sequence'])
+        
+    def read(self, timeout=1.0):
+        """
+        Take a consistent snapshot of the segment.
+
+        Args:
+            timeout: the maximum time (s) spent retrying while the writer is updating the segment
+
+        Returns:
+            model: a MODEL_DTYPE record
+            objects: an array of OBJECT_DTYPE records
+            or None, None if no consistent snapshot could be taken before the timeout
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            sequence = self.sequence()
+            if sequence % 2 == 0:
+                model = self.model[0].copy()
+                objects = np.array(self.objects[:int(model['num_objects'])])
+                if self.sequence() == sequence:
+                    return model, objects
+        return None, None
@@ -0,0 +1,114 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2012, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# Author: Tommaso Cavallari
+
+import time
+import logging
+import threading
+from collections import deque
+import rospy
+
+# the logger rospy sends the log messages of a node to
+_ROSOUT_LOGGER = logging.getLogger('rosout')
+
+def debug_enabled():
+    """ Return True if the debug messages of the node are logged. """
+    return _ROSOUT_LOGGER.isEnabledFor(logging.DEBUG)
+
+def logdebug(message, *args):
+    """
+    Log a debug message, formatting it only if debug messages are logged.
+
+    Args:
+        message: the format string of the message
+        args: the values formatted into the message
+    """
+    if _ROSOUT_LOGGER.isEnabledFor(logging.DEBUG):
+        rospy.logdebug(message % args if args else message)
+
+class TraceBuffer:
+    """
+    Keep the latest trace records of the tracker in memory, so that they can be dumped when something goes wrong.
+
+    A record is a (time, kind, fields) tuple. Recording only appends the tuple to a bounded deque, the oldest records are
+    discarded; the records are formatted when they are dumped.
+    """
+    capacity = 0
+    
+    def __init__(self, capacity=1000):
+        """
+        Args:
+            capacity: the maximum number of records kept, 0 disables the recording
+        """
+        self.capacity = capacity
+        self._records = deque(maxlen=max(capacity, 1))
+        self._lock = threading.Lock()
+        
+    def resize(self, capacity):
+        """ Change the maximum number of records kept, keeping the latest records. """
+        if capacity == self.capacity:
+            return
+        with self._lock:
+            self.capacity = capacity
+            self._records = deque(self._records, maxlen=max(capacity, 1))
+        
+    def record(self, kind, **fields):
+        """
+        Record an event.
+
+        Args:
+            kind: the kind of the event, e.g. 'association'
+            fields: the values describing the event
+        """
+        if self.capacity > 0:
+            self._records.append((time.time(), kind, fields))
+        
+    def __len__(self):
+        return len(self._records)
+    
+    def dump(self, max_records=0, clear=False):
+        """
+        Return the latest records formatted as strings, oldest first.
+
+        Args:
+            max_records: the maximum number of records returned, 0 for all of them
+            clear: if True the buffer is emptied
+        """
+        with self._lock:
+            records = list(self._records)
+            if clear:
+                self._records.clear()
+        if max_records > 0:
+            records = records[-max_records:]
+        return [ "%.6f %s %s" % (stamp, kind, " ".join("%s=%s" % (name, fields[name]) for name in sorted(fields))) 
+                 for stamp, kind, fields in records ]